@@ -1,7 +1,11 @@
 import streamlit as st
-from core.db import save_question, save_student_answer, get_questions, save_grades, clear_grades, detect_rule_type, get_grade_thresholds, save_grade_thresholds, get_db, get_student_answers, get_grades, save_test, get_tests, get_test_by_id, delete_test, save_test_answer, get_test_answers, save_test_grades, get_test_grades, clear_test_grades, update_question, delete_question, update_test, get_question_by_id
-from services.grading_service import grade_all
-from services.test_grading_service import grade_test, get_test_statistics
+from core.db import save_question, save_student_answer, get_questions, save_grades, clear_grades, upsert_grades, prune_grades, prune_test_grades, detect_rule_type, get_grade_thresholds, save_grade_thresholds, get_db, get_student_answers, get_grades, save_test, get_tests, get_test_by_id, delete_test, save_test_answer, get_test_answers, save_test_grades, get_test_grades, clear_test_grades, update_question, delete_question, update_test, get_question_by_id, enqueue_grading_job, get_latest_grading_job, request_cancel_grading_job
+from services.grading_service import grade_all, iter_grade_all, draft_grade_all, CancellationToken, GradingSaveError
+from core.static_embeddings import static_embeddings_available
+from core.grader import get_embedding_cache_stats, get_encoding_stats, get_cascade_stats
+from core.model_provider import warm_up_in_background
+from config import EMBEDDING_MODEL, GRADING_CONFIG, GRADING_JOBS
+from services.test_grading_service import grade_test, iter_grade_test, get_test_statistics
 from services.auth_service import create_user, authenticate_user, create_session_token, verify_session_token, get_user_by_id, refresh_session_token, get_session_info, create_mongo_session, get_mongo_session, update_mongo_session, delete_mongo_session, validate_mongo_session
 from services.import_export_service import ImportExportService
 from bson.objectid import ObjectId
@@ -11,6 +15,7 @@ from datetime import datetime
 import io
 import zipfile
 import csv
+from collections import deque
 st.set_page_config(page_title="Scorix", layout="wide")
 
 # --- Session Management ---
@@ -61,6 +66,58 @@ def clear_form_fields_on_reset(form_key):
 
 # --- End Form Reset Utility ---
 
+# --- Background Grading Jobs ---
+def show_grading_job_status(user_id, kind, test_id=None):
+    """Show the latest background grading job for a target, with a stop button while it runs"""
+    job = get_latest_grading_job(user_id, kind, test_id)
+    if not job:
+        return
+    
+    job_id = str(job["_id"])
+    active_key = f"grading_job_active_{kind}_{test_id}"
+    status = job["status"]
+    progress = job.get("progress", {})
+    done, total = progress.get("done", 0), progress.get("total", 0)
+    
+    if status in ("queued", "running"):
+        st.session_state[active_key] = job_id
+        if status == "queued":
+            st.info("⏳ Grading job queued - waiting for a grading worker to pick it up.")
+        elif total:
+            st.progress(done / total, text=f"Graded {done} of {total} (worker {job.get('worker_id')})")
+        else:
+            st.progress(0.0, text=f"Preparing grading run (worker {job.get('worker_id')})...")
+        
+        stop_col, refresh_col = st.columns([1, 1])
+        with stop_col:
+            if st.button("⏹️ Stop Grading", key=f"stop_grading_job_{job_id}"):
+                cancel_success, cancel_message = request_cancel_grading_job(job_id, user_id)
+                if cancel_success:
+                    st.info(cancel_message)
+                else:
+                    st.warning(cancel_message)
+        with refresh_col:
+            if not hasattr(st, "fragment"):
+                st.button("🔄 Refresh status", key=f"refresh_grading_job_{job_id}")
+        return
+    
+    # The job just finished while we were watching: rerun the page so saved grades show up
+    if st.session_state.pop(active_key, None) == job_id:
+        st.rerun()
+    
+    if status == "completed":
+        st.success(f"✅ {job.get('message', 'Grading complete')}")
+    elif status == "cancelled":
+        st.warning(f"⏹️ {job.get('message') or 'Grading job cancelled.'}")
+    else:
+        st.error(f"❌ Grading job failed: {job.get('message', '')}")
+
+# Poll the job in place rather than rerunning the whole page
+if hasattr(st, "fragment"):
+    show_grading_job_status = st.fragment(run_every=GRADING_JOBS["status_refresh"])(show_grading_job_status)
+
+# --- End Background Grading Jobs ---
+
 def set_session_token(token):
     """Store session token in session state."""
     st.session_state.token = token
@@ -287,6 +344,11 @@ def logout():
 
 # --- Main App ---
 def main_app():
+    # Load the grading model in the background once someone is logged in,
+    # so the login page never waits for it and the first grading run rarely does
+    if EMBEDDING_MODEL["warm_up_after_login"]:
+        warm_up_in_background()
+    
     col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
     with col1:
         st.title("🎓 Scorix")
@@ -841,25 +903,57 @@ def main_app():
                     else:
                         debug_mode = st.checkbox("Enable Debug Mode", help="Show detailed analysis of grading process")
                         
-                        if st.button("🎯 Grade Test & Save Results"):
-                            with st.spinner("Running test grading analysis..."):
-                                # Clear existing grades for this test
-                                clear_success, clear_message = clear_test_grades(st.session_state.user["_id"], selected_test_id)
-                                if not clear_success:
-                                    st.warning(f"Warning: {clear_message}")
+                        full_test_regrade = st.checkbox("Force full regrade", key="full_test_regrade", help="Re-grade every student, even ones whose answers, rules and settings haven't changed")
+                        
+                        if GRADING_JOBS["enabled"]:
+                            user_id = st.session_state.user["_id"]
+                            if st.button("🎯 Queue Test Grading Job"):
+                                job_success, job_message, _ = enqueue_grading_job(user_id, "test", selected_test_id, incremental=not full_test_regrade)
+                                if job_success:
+                                    st.success(f"✅ {job_message}")
+                                else:
+                                    st.error(f"❌ {job_message}")
+                            show_grading_job_status(user_id, "test", selected_test_id)
+                        else:
+                            if st.button("🎯 Grade Test & Save Results"):
+                                user_id = st.session_state.user["_id"]
                                 
-                                # Run grading
-                                results = grade_test(selected_test_id, st.session_state.user["_id"], debug=debug_mode)
+                                # Remove grades for students whose answers were deleted
+                                roll_numbers = [a.get("student_roll_no") for a in test_answers]
+                                prune_success, prune_message = prune_test_grades(user_id, selected_test_id, roll_numbers)
+                                if not prune_success:
+                                    st.warning(f"Warning: {prune_message}")
                                 
-                                if results:
-                                    # Save grades
-                                    save_success, save_message = save_test_grades(results, st.session_state.user["_id"])
-                                    if save_success:
-                                        st.success(f"✅ {save_message}")
-                                        st.rerun()
-                                    else:
-                                        st.error(f"❌ {save_message}")
+                                # Run grading - only new or changed submissions unless forced. Grades are
+                                # saved chunk by chunk, so a run cut short by a refresh or restart keeps
+                                # them and the next (incremental) run only grades the rest.
+                                progress_bar = st.progress(0.0, text="Running test grading analysis...")
+                                graded_count = 0
+                                test_run_stats = {}
+                                test_save_error = None
+                                try:
+                                    for _, done, total in iter_grade_test(
+                                        selected_test_id, user_id, debug=debug_mode, incremental=not full_test_regrade, save=True, run_stats=test_run_stats
+                                    ):
+                                        graded_count += 1
+                                        progress_bar.progress(done / total, text=f"Graded {done} of {total} students")
+                                except GradingSaveError as e:
+                                    test_save_error = e
+                                
+                                if test_save_error:
+                                    st.error(f"❌ Grading stopped: {test_save_error}. {graded_count} test grades were saved before the error; run again to grade the rest.")
+                                elif test_run_stats.get("errors"):
+                                    st.error(f"❌ Saved {graded_count} test grades, but grading hit {len(test_run_stats['errors'])} errors:")
+                                    for error in test_run_stats["errors"][:5]:
+                                        st.caption(f"• {error}")
+                                elif graded_count:
+                                    st.success(f"✅ Saved {graded_count} test grades successfully")
+                                    st.rerun()
+                                elif not full_test_regrade:
+                                    progress_bar.empty()
+                                    st.success("✅ All test grades are up to date - nothing new to grade.")
                                 else:
+                                    progress_bar.empty()
                                     st.warning("⚠️ No results to save. Please ensure you have test answers.")
                         
                         # Show test statistics if available
@@ -1284,27 +1378,144 @@ def main_app():
         if 'grading_results' not in st.session_state:
             st.session_state.grading_results = None
         
-        if st.button("Run Grading & Save to DB"):
-            with st.spinner("Running grading analysis..."):
-                # Clear existing grades
-                clear_success, clear_message = clear_grades(st.session_state.user["_id"])
-                if not clear_success:
-                    st.warning(f"Warning: {clear_message}")
-                
-                # Run grading
-                results = grade_all(debug=debug_mode, user_id=st.session_state.user["_id"])
-                
-                if results:
-                    # Save grades
-                    save_success, save_message = save_grades(results, st.session_state.user["_id"])
-                    if save_success:
-                        st.success(f"✅ {save_message}")
-                        st.session_state.grading_results = results
-                    else:
-                        st.error(f"❌ {save_message}")
+        full_regrade = st.checkbox("Force full regrade", help="Re-grade every answer, even ones whose answer, rules and settings haven't changed")
+        
+        if GRADING_JOBS["enabled"]:
+            # Grading runs in a grading worker; this page only queues the job and shows progress
+            user_id = st.session_state.user["_id"]
+            if st.button("Queue Grading Job"):
+                job_success, job_message, _ = enqueue_grading_job(user_id, "answers", incremental=not full_regrade)
+                if job_success:
+                    st.success(f"✅ {job_message}")
+                else:
+                    st.error(f"❌ {job_message}")
+            show_grading_job_status(user_id, "answers")
+        else:
+            run_col, stop_col = st.columns([3, 1])
+            with stop_col:
+                # Clicking reruns the page, which interrupts the current run; the token makes
+                # the grading generator stop cleanly at the next chunk boundary
+                if st.button("⏹️ Stop Grading"):
+                    cancel_token = st.session_state.get("grading_cancel_token")
+                    if cancel_token:
+                        cancel_token.cancel()
+            with run_col:
+                run_grading = st.button("Run Grading & Save to DB")
+        
+            if run_grading:
+                user_id = st.session_state.user["_id"]
+            
+                # Remove grades for deleted answers (and old grades saved without an answer ID)
+                answer_ids = [str(a["_id"]) for a in get_student_answers(user_id)]
+                prune_success, prune_message = prune_grades(user_id, answer_ids)
+                if not prune_success:
+                    st.warning(f"Warning: {prune_message}")
+            
+                question_titles = {str(q["_id"]): q["question"][:60] for q in get_questions(user_id)}
+                cancel_token = CancellationToken()
+                st.session_state.grading_cancel_token = cancel_token
+            
+                progress_bar = st.progress(0.0, text="Preparing grading run...")
+                table_placeholder = st.empty()
+                recent_rows = deque(maxlen=GRADING_CONFIG["streaming"]["preview_rows"])
+                graded_count = 0
+                run_stats = {}
+                save_error = None
+            
+                # Run grading - only new answers or answers whose rubric/settings changed.
+                # Results are saved chunk by chunk, so everything shown here is already in the DB.
+                try:
+                    for record, done, total in iter_grade_all(
+                        user_id, debug=debug_mode, incremental=not full_regrade, cancel_token=cancel_token, save=True, run_stats=run_stats
+                    ):
+                        graded_count += 1
+                        recent_rows.append({
+                            "Student": record["student_name"],
+                            "Roll No": record["student_roll_no"],
+                            "Question": question_titles.get(record["question_id"], record["question_id"]),
+                            "Score": record["correct_%"],
+                            "Grade": record["grade"]
+                        })
+                        progress_bar.progress(done / total, text=f"Graded {done} of {total} answers")
+                        if graded_count % GRADING_CONFIG["streaming"]["preview_refresh"] == 0 or done == total:
+                            table_placeholder.dataframe(list(recent_rows), use_container_width=True)
+                except GradingSaveError as e:
+                    save_error = e
+            
+                st.session_state.grading_results = list(recent_rows)
+                if save_error:
+                    st.error(f"❌ Grading stopped: {save_error}. {graded_count} grades were saved before the error; run again to grade the rest.")
+                elif cancel_token.cancelled:
+                    st.warning(f"⏹️ Grading stopped after {graded_count} answers. Saved grades are kept; run again to grade the rest.")
+                elif run_stats.get("errors"):
+                    st.error(f"❌ Saved {graded_count} grades, but grading hit {len(run_stats['errors'])} errors:")
+                    for error in run_stats["errors"][:5]:
+                        st.caption(f"• {error}")
+                elif graded_count:
+                    progress_bar.progress(1.0, text="Grading complete")
+                    st.success(f"✅ Saved {graded_count} grades successfully")
+                    cache_stats = get_embedding_cache_stats()
+                    st.caption(
+                        f"🧠 Embedding cache: {cache_stats['memory_hits'] + cache_stats['persistent_hits']} hits "
+                        f"({cache_stats['persistent_hits']} from store), {cache_stats['misses']} misses, "
+                        f"hit rate {cache_stats['hit_rate'] * 100:.1f}%"
+                    )
+                    encoding_stats = get_encoding_stats()
+                    if encoding_stats["tokens"]:
+                        st.caption(
+                            f"⚡ Answer encoding: {encoding_stats['tokens_per_second']:,.0f} tokens/s, "
+                            f"{encoding_stats['padding_efficiency'] * 100:.0f}% of batch tokens were real (not padding)"
+                        )
+                    cascade_stats = get_cascade_stats()
+                    if cascade_stats["answers"]:
+                        st.caption(
+                            f"🪜 Cascade: {cascade_stats['answers_skipped_fraction'] * 100:.0f}% of answers and "
+                            f"{cascade_stats['pairs_skipped_fraction'] * 100:.0f}% of semantic rule checks decided without the model"
+                        )
+                    if run_stats.get("saved_calls"):
+                        st.caption(
+                            f"♻️ {run_stats['unique_answers']} unique answers graded for {run_stats['answers']} submissions "
+                            f"({run_stats['saved_calls']} grading calls saved by reusing identical answers)"
+                        )
+                elif answer_ids and not full_regrade:
+                    progress_bar.empty()
+                    st.success("✅ All grades are up to date - nothing new to grade.")
                 else:
+                    progress_bar.empty()
                     st.warning("⚠️ No results to save. Please ensure you have questions and student answers.")
-                    st.session_state.grading_results = []
+        
+        st.divider()
+        st.subheader("⚡ Draft Preview (approximate)")
+        st.caption(
+            "Instant approximate grades from static word vectors instead of the full model - useful while "
+            "tuning a rubric. Draft grades are **not saved** and can differ from a real grading run."
+        )
+        if not static_embeddings_available():
+            st.info("ℹ️ Draft preview needs static vectors: run `python -m core.static_embeddings --build` once on the server.")
+        elif st.button("Preview Draft Grades"):
+            user_id = st.session_state.user["_id"]
+            question_titles = {str(q["_id"]): q["question"][:60] for q in get_questions(user_id)}
+            started = time.perf_counter()
+            draft_records = draft_grade_all(user_id)
+            elapsed = time.perf_counter() - started
+            
+            if draft_records:
+                st.warning("⚠️ DRAFT - approximate grades from static word vectors, not saved. Run grading for real grades.")
+                st.dataframe([
+                    {
+                        "Student": record["student_name"],
+                        "Roll No": record["student_roll_no"],
+                        "Question": question_titles.get(record["question_id"], record["question_id"]),
+                        "Draft Score": record["correct_%"],
+                        "Draft Grade": record["grade"],
+                        "Matched Rules": len(record["matched_rules"]),
+                        "Missed Rules": len(record["missed_rules"])
+                    }
+                    for record in draft_records
+                ], use_container_width=True)
+                st.caption(f"Draft-graded {len(draft_records)} answers in {elapsed:.2f}s")
+            else:
+                st.warning("⚠️ Nothing to preview. Please ensure you have questions and student answers.")
         
         st.divider()
         st.subheader("📚 Questions and Student Answers Overview")
@@ -0,0 +1,69 @@
+"""
+Measure what the tiered grading cascade saves and what it changes
+
+Grades the parity corpus (replicated for a realistic class size) with the cascade off, then
+with several min_similarity settings, and reports grading time, the share of answers graded
+without the model, and how many rule decisions and letter grades differ from the full model.
+Use it to check GRADING_CONFIG["cascade"] settings before enabling GRADING_CASCADE_ENABLED:
+    python bench_cascade.py            # 25 copies of every corpus answer
+    python bench_cascade.py 100
+"""
+import sys
+import time
+
+# Imported first: disables the shared cache and the embedding server for a self-contained run
+from check_backend_parity import CORPUS
+import numpy as np
+from config import GRADING_CONFIG
+from core.grader import grade_answers_batch, embedding_cache, get_cascade_stats
+from core.model_provider import encode
+
+# Similarity assumed for rules matched on concept overlap; higher values accept lower overlaps
+MIN_SIMILARITIES = [0.0, 0.1, 0.2]
+
+def grade_corpus(copies):
+    """Grade every corpus question; answers are repeated with a suffix so none are identical"""
+    embedding_cache.clear()
+    started = time.perf_counter()
+    grades = [
+        grade_answers_batch([f"{answer} ({i})" for i in range(copies) for answer in answers], sample, rules)
+        for sample, rules, answers in CORPUS
+    ]
+    return grades, time.perf_counter() - started
+
+def compare(reference_grades, grades):
+    changed_rules, changed_grades, score_drift = 0, 0, []
+    for question_reference, question_grades in zip(reference_grades, grades):
+        for reference, result in zip(question_reference, question_grades):
+            changed_rules += len(set(reference["matched_rules"]) ^ set(result["matched_rules"]))
+            changed_grades += reference["grade"] != result["grade"]
+            score_drift.append(abs(reference["score"] - result["score"]))
+    return changed_rules, changed_grades, float(np.mean(score_drift))
+
+def main(copies):
+    cascade = GRADING_CONFIG["cascade"]
+    answer_count = copies * sum(len(answers) for _, _, answers in CORPUS)
+    print(f"=== Grading cascade on {answer_count} answers ===")
+    encode(["warm up"])
+
+    cascade["enabled"] = False
+    reference_grades, reference_time = grade_corpus(copies)
+    print(f"Cascade off: {reference_time * 1000:.0f} ms")
+
+    cascade["enabled"] = True
+    for min_similarity in MIN_SIMILARITIES:
+        cascade["min_similarity"] = min_similarity
+        before = get_cascade_stats()
+        grades, elapsed = grade_corpus(copies)
+        after = get_cascade_stats()
+
+        skipped = 1 - (after["answers_embedded"] - before["answers_embedded"]) / (after["answers"] - before["answers"])
+        changed_rules, changed_grades, mean_drift = compare(reference_grades, grades)
+        print(
+            f"min_similarity {min_similarity}: {elapsed * 1000:.0f} ms "
+            f"({reference_time / elapsed:.1f}x), {skipped * 100:.0f}% of answers not embedded, "
+            f"{changed_rules} rule decisions and {changed_grades} grades changed, mean score drift {mean_drift:.4f}"
+        )
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 25)
@@ -0,0 +1,91 @@
+"""
+Benchmark fuzzy keyword lookup: SymSpell deletion index vs pairwise edit distance
+
+Generates classes of answers of realistic sizes, with some key terms misspelled, and
+resolves every answer word of at least min_word_length characters against a rubric's
+important words. Both methods must find the same words; the report is time per answer.
+    python bench_fuzzy_keywords.py        # edit distance bound 1
+    python bench_fuzzy_keywords.py 2
+"""
+import random
+import sys
+import time
+from core.symspell import DeletionIndex, edit_distance
+
+# Important words of a large science rubric
+RUBRIC_WORDS = [
+    "photosynthesis", "chlorophyll", "glucose", "oxygen", "carbon", "dioxide", "sunlight", "energy",
+    "mitochondria", "ribosome", "protein", "nucleus", "membrane", "cytoplasm", "respiration", "enzyme",
+    "electron", "proton", "neutron", "atom", "molecule", "element", "compound", "reaction",
+    "acceleration", "velocity", "momentum", "friction", "gravity", "inertia", "newton", "force",
+    "evaporation", "condensation", "precipitation", "temperature", "pressure", "volume", "density", "mass"
+]
+
+FILLER_WORDS = [
+    "the", "plant", "uses", "makes", "because", "when", "then", "this", "process", "inside", "cells",
+    "which", "happens", "during", "called", "produces", "releases", "takes", "from", "into", "through",
+    "important", "example", "other", "causes", "object", "moving", "system", "living", "change"
+]
+
+MIN_WORD_LENGTH = 5
+ANSWER_SIZES = [50, 150, 400]
+CLASS_SIZE = 200
+
+def misspell(word, rng):
+    """One random deletion, substitution or adjacent swap"""
+    i = rng.randrange(len(word) - 1)
+    edit = rng.choice(("delete", "substitute", "swap"))
+    if edit == "delete":
+        return word[:i] + word[i + 1:]
+    if edit == "substitute":
+        return word[:i] + rng.choice("aeiourst") + word[i + 1:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+def make_answers(size, rng):
+    answers = []
+    for _ in range(CLASS_SIZE):
+        words = []
+        for _ in range(size):
+            if rng.random() < 0.3:
+                word = rng.choice(RUBRIC_WORDS)
+                words.append(misspell(word, rng) if rng.random() < 0.15 else word)
+            else:
+                words.append(rng.choice(FILLER_WORDS))
+        answers.append(words)
+    return answers
+
+def pairwise_lookup(token, vocabulary, max_distance):
+    """Closest rubric words by computing the edit distance to every one of them"""
+    if token in vocabulary:
+        return {token}
+    distances = {word: edit_distance(token, word, max_distance) for word in vocabulary}
+    closest = min(distances.values())
+    return {word for word, distance in distances.items() if distance == closest <= max_distance}
+
+def main(max_distance):
+    rng = random.Random(0)
+    vocabulary = {word for word in RUBRIC_WORDS if len(word) >= MIN_WORD_LENGTH}
+    print(f"=== Fuzzy keyword lookup, {len(vocabulary)} rubric words, edit distance <= {max_distance}, {CLASS_SIZE} answers per size ===")
+
+    for size in ANSWER_SIZES:
+        answers = make_answers(size, rng)
+        tokens = [[word for word in answer if len(word) >= MIN_WORD_LENGTH] for answer in answers]
+
+        started = time.perf_counter()
+        # Built once per question, as build_keyword_index does
+        index = DeletionIndex(vocabulary, max_distance)
+        indexed = [set().union(*(index.lookup(token) for token in answer)) for answer in tokens]
+        index_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pairwise = [set().union(*(pairwise_lookup(token, vocabulary, max_distance) for token in answer)) for answer in tokens]
+        pairwise_time = time.perf_counter() - started
+
+        assert indexed == pairwise, "deletion index and pairwise lookup disagree"
+        print(
+            f"{size:4d}-word answers: deletion index {index_time / CLASS_SIZE * 1e6:8.1f} µs/answer, "
+            f"pairwise {pairwise_time / CLASS_SIZE * 1e6:9.1f} µs/answer ({pairwise_time / index_time:.0f}x)"
+        )
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
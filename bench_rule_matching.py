@@ -0,0 +1,64 @@
+"""
+Micro-benchmark: cost of one lexical (answer, rule) match
+
+Compares compiling the rule on every call (what match_rule used to do) with matching
+against a CompiledRule built once, for the exact_phrase and contains_keywords rules of the
+test scripts. Answer features are built up front, as the graders do, so only rule work is timed.
+    python bench_rule_matching.py          # 2000 rounds
+    python bench_rule_matching.py 10000
+"""
+import sys
+import time
+from core.grader import AnswerFeatures, CompiledRule, compile_rule, match_rule
+
+RULES = [
+    {"text": "Mentions the formula F = ma.", "type": "exact_phrase"},
+    {"text": "Mentions the formula E = mc²", "type": "exact_phrase"},
+    {"text": "Student mentions the center or core is a nucleus", "type": "contains_keywords"},
+    {"text": "it has protons, neutrons and electrons", "type": "contains_keywords"},
+    {"text": "contains mitochondria", "type": "contains_keywords"},
+    {"text": "contains DNA and RNA", "type": "contains_keywords"}
+]
+
+ANSWERS = [
+    "Newton's Second Law states that the force acting on an object is the product of its mass and acceleration (F = ma).",
+    "An atom has a nucleus at its center. The nucleus contains protons and neutrons. Electrons orbit around the nucleus.",
+    "The cell contains many mitochondria. It also has numerous ribosomes.",
+    "Einstein's famous formula is E = mc². The cell contains DNA and RNA molecules.",
+    "I don't know."
+]
+
+def time_pairs(match_pair, features, rounds):
+    """Seconds per (answer, rule) pair"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for answer_features in features:
+            for rule in RULES:
+                match_pair(answer_features, rule)
+    return (time.perf_counter() - started) / (rounds * len(features) * len(RULES))
+
+def main(rounds):
+    features = [AnswerFeatures(answer) for answer in ANSWERS]
+    compiled = {rule["text"]: CompiledRule.from_rule(rule) for rule in RULES}
+
+    # Every path must agree before timing anything
+    for answer_features in features:
+        for rule in RULES:
+            expected = compile_rule(rule["text"], rule["type"]).match(answer_features)
+            assert compiled[rule["text"]].match(answer_features) == expected
+            assert match_rule(answer_features, rule["text"], rule["type"]) == expected
+
+    timings = [
+        ("compile per call (before)", lambda f, rule: compile_rule(rule["text"], rule["type"]).match(f)),
+        ("match_rule (cached compile)", lambda f, rule: match_rule(f, rule["text"], rule["type"])),
+        ("CompiledRule.match", lambda f, rule: compiled[rule["text"]].match(f))
+    ]
+    print(f"=== Lexical rule matching, {rounds * len(features) * len(RULES)} pairs per path ===")
+    baseline = None
+    for name, match_pair in timings:
+        per_pair = time_pairs(match_pair, features, rounds)
+        baseline = baseline or per_pair
+        print(f"{name:28s} {per_pair * 1e6:8.2f} µs/pair ({baseline / per_pair:.1f}x)")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,120 @@
+"""
+Compare an inference backend with the PyTorch reference on a fixed grading corpus
+
+Reports embedding drift (cosine between the two backends' vectors), score drift, rule
+decisions and letter grades that change, and grading time. Run it before switching
+EMBEDDING_BACKEND in config.py:
+    python check_backend_parity.py            # onnx-int8 vs torch
+    python check_backend_parity.py onnx       # any backend vs torch
+"""
+import os
+import sys
+import time
+
+# Keep the comparison self-contained: the shared cache's keys would mix the two backends
+os.environ["EMBEDDING_CACHE_BACKEND"] = "none"
+os.environ["EMBEDDING_SERVER_ENABLED"] = "false"
+
+import numpy as np
+from core import model_provider
+from core.grader import grade_answers_batch, embedding_cache
+
+# (sample answer, rules, student answers) - the examples from the test scripts plus weaker answers
+CORPUS = [
+    (
+        "Newton's Second Law states that the force acting on an object is equal to the mass of the object multiplied by its acceleration (F = ma). It explains how an object will accelerate in the direction of the net force applied. For example, pushing a cart with more force causes it to accelerate faster.",
+        [
+            {"text": "Mentions the formula F = ma.", "type": "exact_phrase"},
+            {"text": "Explains the relationship between force, mass, and acceleration.", "type": "semantic"},
+            {"text": "Gives a real-world example of force causing acceleration.", "type": "semantic"}
+        ],
+        [
+            "Newton's Second Law states that the force acting on an object is the product of its mass and acceleration (F = ma). This means that if you push an object, it will accelerate in the direction of the force. For example, a heavier object needs more force to accelerate.",
+            "Force equals mass times acceleration.",
+            "Objects at rest stay at rest unless a force acts on them.",
+            "If you kick a ball harder it speeds up more, because a bigger force gives a bigger acceleration."
+        ]
+    ),
+    (
+        "An atom has a small dense nucleus at its center made of protons and neutrons, with electrons moving around it.",
+        [
+            {"text": "Student mentions the center or core is a nucleus", "type": "contains_keywords"},
+            {"text": "it has protons, neutrons and electrons", "type": "contains_keywords"},
+            {"text": "atom has subatomic particles in its nucleus", "type": "semantic"}
+        ],
+        [
+            "An atom has a nucleus at its center. The nucleus contains protons and neutrons. Electrons orbit around the nucleus.",
+            "Atoms are tiny.",
+            "The core of an atom holds positive and neutral particles, and negative particles circle it."
+        ]
+    ),
+    (
+        "Cells contain mitochondria, which release energy through cellular respiration, and ribosomes, which make proteins.",
+        [
+            {"text": "contains mitochondria", "type": "contains_keywords"},
+            {"text": "has ribosomes", "type": "contains_keywords"},
+            {"text": "explains cellular respiration", "type": "semantic"}
+        ],
+        [
+            "The cell contains many mitochondria. It also has numerous ribosomes. The mitochondria produce energy through cellular respiration.",
+            "Cells break down glucose with oxygen to release energy.",
+            "Plants are green."
+        ]
+    ),
+    (
+        "Photosynthesis is the process by which plants use sunlight, water and carbon dioxide to make glucose and release oxygen.",
+        [
+            "Mentions the formula E = mc²",
+            "contains DNA and RNA",
+            "explains the process of photosynthesis"
+        ],
+        [
+            "Einstein's famous formula is E = mc². The cell contains DNA and RNA molecules. Photosynthesis is the process where plants make food.",
+            "Plants turn light into chemical energy, taking in carbon dioxide and giving out oxygen.",
+            "I don't know."
+        ]
+    )
+]
+
+def run(backend):
+    """Grade the corpus and embed every text on one backend"""
+    model_provider.use_backend(backend)
+    embedding_cache.clear()
+    model_provider.encode(["warm up"])
+
+    started = time.perf_counter()
+    grades = [grade_answers_batch(answers, sample, rules) for sample, rules, answers in CORPUS]
+    elapsed = time.perf_counter() - started
+
+    texts = [text for sample, _, answers in CORPUS for text in [sample] + answers]
+    return grades, np.asarray(model_provider.encode(texts), dtype=np.float32), elapsed
+
+def main(candidate):
+    print(f"=== {candidate} vs torch on {sum(len(answers) for _, _, answers in CORPUS)} answers ===")
+    reference_grades, reference_embs, reference_time = run("torch")
+    candidate_grades, candidate_embs, candidate_time = run(candidate)
+
+    unit = lambda m: m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    cosines = (unit(reference_embs) * unit(candidate_embs)).sum(axis=1)
+
+    score_drift, changed_rules, rule_count, changed_grades = [], 0, 0, 0
+    for question_reference, question_candidate in zip(reference_grades, candidate_grades):
+        for reference, result in zip(question_reference, question_candidate):
+            score_drift.append(abs(reference["score"] - result["score"]))
+            rule_count += len(reference["matched_rules"]) + len(reference["missed_rules"])
+            changed_rules += len(set(reference["matched_rules"]) ^ set(result["matched_rules"]))
+            changed_grades += reference["grade"] != result["grade"]
+
+    print(f"Embedding cosine to torch: min {cosines.min():.5f}, mean {cosines.mean():.5f}")
+    print(f"Score drift: max {max(score_drift):.5f}, mean {np.mean(score_drift):.5f}")
+    print(f"Rule decisions changed: {changed_rules} of {rule_count}")
+    print(f"Letter grades changed: {changed_grades} of {len(score_drift)}")
+    print(f"Grading time: torch {reference_time * 1000:.1f} ms, {candidate} {candidate_time * 1000:.1f} ms")
+
+    if changed_rules or changed_grades:
+        print(f"⚠️ {candidate} changes grading decisions on this corpus")
+    else:
+        print(f"✅ {candidate} matches torch grading decisions")
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "onnx-int8")
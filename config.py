@@ -11,6 +11,107 @@ DB_NAME = os.getenv("DB_NAME")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 SESSION_TIMEOUT = 86400  # 24 hours in seconds (increased from 1 hour)
 
+# Embedding Model Configuration
+# The name, revision and backend are part of every embedding cache key, so changing any of
+# them automatically invalidates cached vectors. Pin a commit hash for reproducible grading.
+EMBEDDING_MODEL = {
+    "name": os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2"),
+    "revision": os.getenv("EMBEDDING_MODEL_REVISION", "main"),
+    # Inference backend: "torch" (sentence-transformers), "onnx" or "onnx-int8" (ONNX Runtime,
+    # dynamically quantized weights). ONNX backends need `pip install onnxruntime` and export
+    # the model to onnx_dir on first use; check drift with check_backend_parity.py.
+    "backend": os.getenv("EMBEDDING_BACKEND", "torch"),
+    "onnx_dir": os.getenv("EMBEDDING_ONNX_DIR", ".onnx_models"),
+    # The model loads lazily on first grading use; optionally start loading it right after login
+    "warm_up_after_login": os.getenv("MODEL_WARM_UP_AFTER_LOGIN", "true").lower() == "true"
+}
+
+# Models whose tokenizer lowercases its input, so answers differing only in case embed identically.
+# EMBEDDING_MODEL["uncased"] says whether the configured model is one; duplicate answers are
+# only merged across case if it is (EMBEDDING_MODEL_UNCASED overrides the detection).
+UNCASED_EMBEDDING_MODELS = {"all-MiniLM-L6-v2", "all-MiniLM-L12-v2", "sentence-transformers/all-MiniLM-L6-v2", "sentence-transformers/all-MiniLM-L12-v2"}
+EMBEDDING_MODEL["uncased"] = os.getenv(
+    "EMBEDDING_MODEL_UNCASED", str(EMBEDDING_MODEL["name"] in UNCASED_EMBEDDING_MODELS)
+).lower() == "true"
+
+# Inference Configuration
+# All encode calls in a process go through one queue; requests arriving within the
+# window are merged into one forward pass.
+INFERENCE = {
+    "micro_batch_window_ms": 5,
+    "max_batch_texts": 256,
+    # Torch intra-op threads per process (0 leaves torch's default)
+    "torch_threads": int(os.getenv("TORCH_NUM_THREADS", "0")),
+    # Number of recent requests kept for p50/p99 latency
+    "latency_window": 1000
+}
+
+# Embedding Server Configuration
+# Run `python -m core.embedding_server` and enable this so every app process on the
+# host sends encode calls to one model process that micro-batches across them.
+# The connection carries pickled data, so EMBEDDING_SERVER_AUTHKEY must be set to a secret.
+DEFAULT_EMBEDDING_SERVER_AUTHKEY = "change-this-embedding-server-key"
+EMBEDDING_SERVER = {
+    "enabled": os.getenv("EMBEDDING_SERVER_ENABLED", "false").lower() == "true",
+    "host": os.getenv("EMBEDDING_SERVER_HOST", "127.0.0.1"),
+    "port": int(os.getenv("EMBEDDING_SERVER_PORT", "6150")),
+    "authkey": os.getenv("EMBEDDING_SERVER_AUTHKEY", DEFAULT_EMBEDDING_SERVER_AUTHKEY),
+    "batch_window_ms": 10,
+    "max_batch_texts": 512,
+    # How often the server prints its stats (seconds, 0 disables)
+    "stats_interval": 60
+}
+
+if EMBEDDING_SERVER["enabled"] and EMBEDDING_SERVER["authkey"] == DEFAULT_EMBEDDING_SERVER_AUTHKEY:
+    raise RuntimeError("EMBEDDING_SERVER_ENABLED is set but EMBEDDING_SERVER_AUTHKEY is the default; set it to a secret")
+
+# Embedding Cache Configuration
+EMBEDDING_CACHE = {
+    # In-process LRU size (number of vectors)
+    "max_entries": 20000,
+    # Persistent tier: "mongo", "file" or "none". A store that fails (e.g. MongoDB unreachable)
+    # is dropped after its first error and the process carries on with the in-memory tier.
+    "backend": os.getenv("EMBEDDING_CACHE_BACKEND", "mongo"),
+    "collection": "embedding_cache",
+    "file_dir": os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache")
+}
+
+# Draft Grading Configuration
+# Static token vectors distilled from the embedding model for instant, approximate previews;
+# build them with `python -m core.static_embeddings --build`.
+STATIC_EMBEDDINGS = {
+    "dir": os.getenv("STATIC_EMBEDDINGS_DIR", ".static_embeddings"),
+    # Words whose WordPiece split is remembered
+    "word_cache_size": 50000
+}
+
+# Lemmatization Configuration
+# Lemmas come from a precomputed table when present (build it with
+# `python -m core.lemmas --build <text files>`), then from an LRU, and only then from WordNet.
+LEMMATIZATION = {
+    "table_path": os.getenv("LEMMA_TABLE_PATH", ".lemma_table.json"),
+    # Words whose lemma is remembered in memory
+    "cache_size": 100000,
+    # Most frequent words kept when building the table
+    "table_max_words": 200000
+}
+
+# Grading Job Queue Configuration
+# When enabled the grading pages enqueue jobs in the grading_jobs collection instead of
+# grading in the Streamlit session; run `python -m services.grading_worker` on any host
+# that can reach MongoDB to process them.
+GRADING_JOBS = {
+    "enabled": os.getenv("GRADING_JOBS_ENABLED", "false").lower() == "true",
+    # How long an idle worker sleeps before looking for a new job (seconds)
+    "poll_interval": 2,
+    # Minimum gap between progress/heartbeat writes while a job runs (seconds)
+    "heartbeat_interval": 5,
+    # A running job whose worker has not heartbeat for this long is handed to another worker
+    "stale_after": 600,
+    # How often the grading page refreshes a job's status (seconds)
+    "status_refresh": 2
+}
+
 # Grading Configuration
 GRADING_CONFIG = {
     # Scoring weights
@@ -34,6 +135,74 @@ GRADING_CONFIG = {
         "sample_bonus_threshold": 0.5
     },
     
+    # Batched encoding used by grade_all
+    "batching": {
+        "batch_size": 64,
+        # Answers are bucketed by token length; a batch is capped at batch_size answers and
+        # at this many tokens once every answer is padded to the batch's longest
+        "token_budget": 8192,
+        # Grade identical answers (differing only in case, for uncased models) once and share
+        # the result
+        "deduplicate_answers": True
+    },
+    
+    # Long answers: the model truncates past its token limit, so answers longer than
+    # max_answer_tokens are split into overlapping sentence windows of about window_tokens;
+    # a rule's similarity is its best window. max_chunks caps the windows per answer.
+    "chunking": {
+        "enabled": True,
+        "max_answer_tokens": 256,
+        "window_tokens": 200,
+        "overlap_sentences": 1,
+        "max_chunks": 8
+    },
+    
+    # Lexical matching: questions whose rules have at least this many key phrases scan each
+    # answer once with an Aho-Corasick automaton instead of one substring check per phrase
+    # (the pure-Python automaton only wins on large rubrics; grades are identical either way)
+    "lexical": {
+        "automaton_min_phrases": 128
+    },
+    
+    # Misspelling-tolerant keyword rules: an answer word within max_edit_distance edits of a
+    # keyword rule's important word counts as that word; words shorter than min_word_length
+    # must match exactly. Lookups go through a SymSpell deletion index built per question.
+    "fuzzy_keywords": {
+        "enabled": os.getenv("GRADING_FUZZY_KEYWORDS", "false").lower() == "true",
+        "max_edit_distance": 1,
+        "min_word_length": 5
+    },
+    
+    # Tiered grading, accept side only: a semantic rule is matched without the model when its
+    # key concept overlap alone reaches the match threshold, assuming the answer's similarity
+    # to the rule is at least min_similarity (at 0.0, two thirds of its concepts). An answer is
+    # only left unembedded if every rule matched that way or lexically: its score is capped at
+    # 1.0, so the sample bonus can't change it. There is no reject band: similarity alone can
+    # match a rule, so no overlap rules one out.
+    # min_similarity is an assumption, not something the grader checks. Cosine similarity can
+    # be negative, and an answer scoring below min_similarity against a rule it shares most
+    # concepts with is graded differently than by the full model. 0.0 holds for the MiniLM
+    # models in practice (see bench_cascade.py); -1.0 (the lowest cosine) never skips the model.
+    "cascade": {
+        "enabled": os.getenv("GRADING_CASCADE_ENABLED", "false").lower() == "true",
+        "min_similarity": 0.0
+    },
+    
+    # Streaming grading: answers graded (and saved) per chunk
+    "streaming": {
+        "chunk_size": 100,
+        # Live results table on the grading page: rows kept and refresh interval
+        "preview_rows": 50,
+        "preview_refresh": 10
+    },
+    
+    # Process-pool grading; 1 keeps grading in the app process
+    "parallel": {
+        "workers": int(os.getenv("GRADING_WORKERS", "1")),
+        # Below workers * this many answers (or students) grading stays single-process
+        "min_items_per_worker": 50
+    },
+    
     # Default grade thresholds
     "default_grade_thresholds": {
         "A": 85,
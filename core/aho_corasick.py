@@ -0,0 +1,61 @@
+"""
+Aho-Corasick multi-phrase matcher
+
+Finds which of many phrases occur in a text with one left-to-right scan, so the cost is
+linear in the text length however many phrases there are. Matching is plain substring
+matching, the same as `phrase in text` for each phrase.
+"""
+from collections import deque
+
+class AhoCorasick:
+    """Automaton over (phrase, value) pairs; matches(text) returns the values of phrases found"""
+    def __init__(self, patterns):
+        # Node 0 is the root; each node has its transitions, failure link and the values of
+        # every phrase ending there, including phrases that are suffixes of it
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        self.pattern_count = 0
+
+        for phrase, value in patterns:
+            if not phrase:
+                continue
+            node = 0
+            for char in phrase:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                    self._goto[node][char] = child
+                node = child
+            self._output[node].add(value)
+            self.pattern_count += 1
+
+        # Breadth first, so every failure link points at an already finished node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] |= self._output[self._fail[child]]
+
+        self._output = [frozenset(values) for values in self._output]
+
+    def matches(self, text):
+        """Set of values whose phrase occurs anywhere in text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found |= output[node]
+        return found
@@ -1,7 +1,8 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
 from config import MONGO_URI, DB_NAME
 from bson.objectid import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 
 client = MongoClient(MONGO_URI)
 db = client[DB_NAME]
@@ -10,6 +11,36 @@ def get_db():
     """Get database instance"""
     return db
 
+_indexes_ready = False
+
+def ensure_indexes():
+    """
+    Create the unique indexes the upserts and the job queue rely on (once per process)
+    Grades are unique per graded answer, and a target has at most one active grading job.
+    """
+    global _indexes_ready
+    if _indexes_ready:
+        return True, "Indexes already created"
+    try:
+        # Legacy grades without an answer_id are left out; prune_grades removes them
+        db.grades.create_index(
+            [("user_id", ASCENDING), ("answer_id", ASCENDING)],
+            unique=True, partialFilterExpression={"answer_id": {"$exists": True}}
+        )
+        db.test_grades.create_index(
+            [("user_id", ASCENDING), ("test_id", ASCENDING), ("student_roll_no", ASCENDING)],
+            unique=True
+        )
+        db.grading_jobs.create_index(
+            [("user_id", ASCENDING), ("kind", ASCENDING), ("test_id", ASCENDING)],
+            unique=True, partialFilterExpression={"active": True}
+        )
+        _indexes_ready = True
+        return True, "Indexes created"
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+        return False, f"Error creating indexes: {str(e)}"
+
 # Default grade thresholds
 DEFAULT_GRADE_THRESHOLDS = {
     "A": 85,
@@ -49,11 +80,94 @@ def save_grade_thresholds(thresholds, user_id=None):
             {"$set": {"thresholds": thresholds, "user_id": user_id}},
             upsert=True
         )
+        
+        # Existing grades keep their raw scores, so only the letters need recomputing. Thresholds
+        # aren't part of the grade fingerprints, so a failure here is never fixed by re-grading:
+        # report it so the user saves again (which retries the re-lettering)
+        if user_id:
+            grades_success, grades_message = reletter_grades(user_id, thresholds)
+            test_success, test_message = reletter_test_grades(user_id, thresholds)
+            if not (grades_success and test_success):
+                return False, f"Grade thresholds saved, but existing grades still show the old letters ({grades_message}, {test_message}). Save again to retry."
+            return True, f"Grade thresholds saved successfully ({grades_message}, {test_message})"
         return True, "Grade thresholds saved successfully"
     except Exception as e:
         print(f"Error saving grade thresholds: {e}")
         return False, f"Error saving grade thresholds: {str(e)}"
 
+def grade_letter_expression(score_expression, thresholds):
+    """
+    Aggregation expression mapping a 0-1 score to a letter, same rules as grader.assign_grade
+    """
+    sorted_thresholds = sorted(thresholds.items(), key=lambda x: x[1], reverse=True)
+    percent = {"$multiply": [score_expression, 100]}
+    return {
+        "$switch": {
+            "branches": [{"case": {"$gte": [percent, threshold]}, "then": grade} for grade, threshold in sorted_thresholds],
+            "default": sorted_thresholds[-1][0] if sorted_thresholds else "F"
+        }
+    }
+
+def reletter_pipeline(thresholds):
+    """
+    Update pipeline that re-letters a grade record from its raw score
+    Grades saved before raw scores were stored only have the "85.00%" string; it is parsed
+    leniently, so a malformed legacy value leaves that record's letter alone instead of
+    making the server abort the whole update.
+    """
+    correct = {"$cond": [{"$eq": [{"$type": "$correct_%"}, "string"]}, {"$trim": {"input": "$correct_%", "chars": "% "}}, "$correct_%"]}
+    legacy_percent = {"$convert": {"input": correct, "to": "double", "onError": None, "onNull": None}}
+    return [
+        {"$set": {"score": {"$ifNull": ["$score", {"$ifNull": [{"$divide": [legacy_percent, 100]}, "$$REMOVE"]}]}}},
+        {"$set": {"grade": {"$cond": [{"$isNumber": "$score"}, grade_letter_expression("$score", thresholds), "$grade"]}}}
+    ]
+
+def reletter_grades(user_id, thresholds):
+    """Recompute every grade letter for a user from the stored raw scores, in one update"""
+    try:
+        if not user_id or not thresholds:
+            return False, "User ID and thresholds are required"
+        
+        result = db.grades.update_many(
+            {"user_id": user_id, "$or": [{"score": {"$exists": True}}, {"correct_%": {"$exists": True}}]},
+            reletter_pipeline(thresholds)
+        )
+        return True, f"Re-lettered {result.modified_count} grades"
+    except Exception as e:
+        print(f"Error re-lettering grades: {e}")
+        return False, f"Error re-lettering grades: {str(e)}"
+
+def reletter_test_grades(user_id, thresholds, test_id=None):
+    """Recompute overall and per-question letters of test grades from their stored scores"""
+    try:
+        if not user_id or not thresholds:
+            return False, "User ID and thresholds are required"
+        
+        query = {"user_id": user_id, "overall_score": {"$exists": True}}
+        if test_id:
+            query["test_id"] = test_id
+        
+        question_details = {"$ifNull": ["$question_details", []]}
+        result = db.test_grades.update_many(query, [
+            {"$set": {
+                "overall_grade": grade_letter_expression("$overall_score", thresholds),
+                "question_details": {"$map": {
+                    "input": question_details,
+                    "as": "detail",
+                    "in": {"$mergeObjects": ["$$detail", {"grade": grade_letter_expression("$$detail.score", thresholds)}]}
+                }},
+                "question_grades": {"$map": {
+                    "input": question_details,
+                    "as": "detail",
+                    "in": grade_letter_expression("$$detail.score", thresholds)
+                }}
+            }}
+        ])
+        return True, f"Re-lettered {result.modified_count} test grades"
+    except Exception as e:
+        print(f"Error re-lettering test grades: {e}")
+        return False, f"Error re-lettering test grades: {str(e)}"
+
 def detect_rule_type(rule_text):
     """Dynamically detect rule type based on content analysis"""
     if not rule_text or not isinstance(rule_text, str):
@@ -73,6 +187,31 @@ def detect_rule_type(rule_text):
     else:
         return "semantic"
 
+def build_compiled_rubric(sample_answer, rule_objects):
+    """Compile a rubric at write time; grading recompiles it lazily if this fails"""
+    try:
+        # Imported here so pages that never grade don't load the embedding model
+        from core.rubric import compile_rubric
+        return compile_rubric(sample_answer, rule_objects)
+    except Exception as e:
+        print(f"Warning: Could not compile rubric: {e}")
+        return None
+
+def save_compiled_rubric(question_id, compiled_rubric):
+    """Store a freshly compiled rubric on an existing question"""
+    try:
+        if not question_id or not compiled_rubric:
+            return False, "Question ID and compiled rubric are required"
+        
+        db.questions.update_one(
+            {"_id": ObjectId(question_id)},
+            {"$set": {"compiled_rubric": compiled_rubric}}
+        )
+        return True, "Compiled rubric saved successfully"
+    except Exception as e:
+        print(f"Error saving compiled rubric: {e}")
+        return False, f"Error saving compiled rubric: {str(e)}"
+
 def save_question(question_text, sample_answer, rules, user_id):
     """Save a question with validation"""
     try:
@@ -100,6 +239,7 @@ def save_question(question_text, sample_answer, rules, user_id):
             "question": question_text,
             "sample_answer": sample_answer,
             "marking_scheme": rule_objects,
+            "compiled_rubric": build_compiled_rubric(sample_answer, rule_objects),
             "user_id": user_id,
             "created_at": datetime.utcnow()
         }
@@ -209,6 +349,64 @@ def clear_grades(user_id):
         print(f"Error clearing grades: {e}")
         return False, f"Error clearing grades: {str(e)}"
 
+def get_grade_fingerprints(user_id):
+    """Map answer_id -> stored fingerprints for a user's grades"""
+    try:
+        if not user_id:
+            return {}
+        
+        grades = db.grades.find(
+            {"user_id": user_id, "answer_id": {"$exists": True}},
+            {"answer_id": 1, "fingerprints": 1}
+        )
+        return {g["answer_id"]: g.get("fingerprints") for g in grades}
+    except Exception as e:
+        print(f"Error getting grade fingerprints: {e}")
+        return {}
+
+def upsert_grades(grades, user_id):
+    """Insert or replace grades keyed by the answer they grade"""
+    try:
+        if not user_id:
+            return False, "User ID is required"
+        
+        if not grades:
+            return True, "No grades to save (everything is up to date)"
+        
+        ensure_indexes()
+        now = datetime.utcnow()
+        operations = []
+        for grade in grades:
+            grade["user_id"] = user_id
+            grade["updated_at"] = now
+            grade.pop("created_at", None)
+            operations.append(UpdateOne(
+                {"user_id": user_id, "answer_id": grade["answer_id"]},
+                {"$set": grade, "$setOnInsert": {"created_at": now}},
+                upsert=True
+            ))
+        
+        db.grades.bulk_write(operations, ordered=False)
+        return True, f"Saved {len(operations)} grades successfully"
+    except Exception as e:
+        print(f"Error upserting grades: {e}")
+        return False, f"Error saving grades: {str(e)}"
+
+def prune_grades(user_id, answer_ids):
+    """Delete grades whose answer no longer exists, and legacy grades without an answer_id"""
+    try:
+        if not user_id:
+            return False, "User ID is required"
+        
+        result = db.grades.delete_many({
+            "user_id": user_id,
+            "$or": [{"answer_id": {"$exists": False}}, {"answer_id": {"$nin": list(answer_ids)}}]
+        })
+        return True, f"Removed {result.deleted_count} stale grades"
+    except Exception as e:
+        print(f"Error pruning grades: {e}")
+        return False, f"Error pruning grades: {str(e)}"
+
 def get_question_by_id(qid, user_id):
     """Get a specific question by ID for a user"""
     try:
@@ -254,6 +452,7 @@ def update_question(question_id, question_text, sample_answer, rules, user_id):
             "question": question_text,
             "sample_answer": sample_answer,
             "marking_scheme": rule_objects,
+            "compiled_rubric": build_compiled_rubric(sample_answer, rule_objects),
             "updated_at": datetime.utcnow()
         }
         
@@ -563,3 +762,246 @@ def clear_test_grades(user_id, test_id=None):
     except Exception as e:
         print(f"Error clearing test grades: {e}")
         return False, f"Error clearing test grades: {str(e)}"
+
+
+def get_test_grade_fingerprints(user_id, test_id):
+    """Map student_roll_no -> stored fingerprints for a test's grades"""
+    try:
+        if not user_id or not test_id:
+            return {}
+        
+        grades = db.test_grades.find(
+            {"user_id": user_id, "test_id": test_id},
+            {"student_roll_no": 1, "fingerprints": 1}
+        )
+        return {g["student_roll_no"]: g.get("fingerprints") for g in grades}
+    except Exception as e:
+        print(f"Error getting test grade fingerprints: {e}")
+        return {}
+
+def upsert_test_grades(test_grades, user_id):
+    """Insert or replace test grades keyed by test and student"""
+    try:
+        if not user_id:
+            return False, "User ID is required"
+        
+        if not test_grades:
+            return True, "No test grades to save (everything is up to date)"
+        
+        ensure_indexes()
+        now = datetime.utcnow()
+        operations = []
+        for grade in test_grades:
+            grade["user_id"] = user_id
+            grade["updated_at"] = now
+            grade.pop("created_at", None)
+            operations.append(UpdateOne(
+                {"user_id": user_id, "test_id": grade["test_id"], "student_roll_no": grade["student_roll_no"]},
+                {"$set": grade, "$setOnInsert": {"created_at": now}},
+                upsert=True
+            ))
+        
+        db.test_grades.bulk_write(operations, ordered=False)
+        return True, f"Saved {len(operations)} test grades successfully"
+    except Exception as e:
+        print(f"Error upserting test grades: {e}")
+        return False, f"Error saving test grades: {str(e)}"
+
+def prune_test_grades(user_id, test_id, roll_numbers):
+    """Delete a test's grades for students who no longer have answers"""
+    try:
+        if not user_id or not test_id:
+            return False, "User ID and test ID are required"
+        
+        result = db.test_grades.delete_many({
+            "user_id": user_id,
+            "test_id": test_id,
+            "student_roll_no": {"$nin": list(roll_numbers)}
+        })
+        return True, f"Removed {result.deleted_count} stale test grades"
+    except Exception as e:
+        print(f"Error pruning test grades: {e}")
+        return False, f"Error pruning test grades: {str(e)}"
+
+# Grading job queue. Jobs move queued -> running -> completed / failed / cancelled; a
+# running job whose worker stops heartbeating is claimable again, so a crashed worker's
+# job is picked up by another one. Queued and running jobs carry active: True, which a
+# partial unique index (see ensure_indexes) limits to one job per target.
+def enqueue_grading_job(user_id, kind, test_id=None, incremental=True):
+    """
+    Queue a grading run ("answers" for all of a user's answers, "test" for one test)
+    Returns (success, message, job_id); an already queued or running job for the same
+    target is returned instead of queueing a duplicate.
+    """
+    try:
+        if not user_id:
+            return False, "User ID is required", None
+        
+        if kind not in ("answers", "test"):
+            return False, f"Unknown grading job kind: {kind}", None
+        
+        if kind == "test" and not test_id:
+            return False, "Test ID is required", None
+        
+        target = {"user_id": user_id, "kind": kind, "test_id": test_id}
+        ensure_indexes()
+        job = {
+            **target,
+            "incremental": incremental,
+            "status": "queued",
+            "active": True,
+            "progress": {"done": 0, "total": 0},
+            "cancel_requested": False,
+            "attempts": 0,
+            "worker_id": None,
+            "message": "",
+            "created_at": datetime.utcnow()
+        }
+        try:
+            result = db.grading_jobs.insert_one(job)
+        except DuplicateKeyError:
+            existing = db.grading_jobs.find_one({**target, "active": True})
+            if existing is None:
+                # The active job finished in between; queue a new one
+                result = db.grading_jobs.insert_one(job)
+                return True, "Grading job queued", str(result.inserted_id)
+            return True, "A grading job for this is already in progress", str(existing["_id"])
+        return True, "Grading job queued", str(result.inserted_id)
+    except Exception as e:
+        print(f"Error enqueueing grading job: {e}")
+        return False, f"Error enqueueing grading job: {str(e)}", None
+
+def claim_grading_job(worker_id, stale_after):
+    """Atomically hand the oldest queued (or abandoned running) job to a worker"""
+    try:
+        now = datetime.utcnow()
+        return db.grading_jobs.find_one_and_update(
+            {"$or": [
+                {"status": "queued"},
+                {"status": "running", "heartbeat_at": {"$lt": now - timedelta(seconds=stale_after)}}
+            ]},
+            {
+                "$set": {"status": "running", "worker_id": worker_id, "started_at": now, "heartbeat_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+    except Exception as e:
+        print(f"Error claiming grading job: {e}")
+        return None
+
+def heartbeat_grading_job(job_id, worker_id, done, total):
+    """
+    Record a running job's progress
+    Returns the job's cancel_requested flag, or None if this worker no longer owns the job
+    (it was reclaimed after a missed heartbeat) and should stop.
+    """
+    try:
+        job = db.grading_jobs.find_one_and_update(
+            {"_id": ObjectId(job_id), "worker_id": worker_id, "status": "running"},
+            {"$set": {"progress": {"done": done, "total": total}, "heartbeat_at": datetime.utcnow()}},
+            projection={"cancel_requested": 1}
+        )
+        return None if job is None else bool(job.get("cancel_requested"))
+    except Exception as e:
+        # A transient write failure shouldn't kill the run; try again on the next heartbeat
+        print(f"Error updating grading job progress: {e}")
+        return False
+
+def finish_grading_job(job_id, worker_id, status, message=""):
+    """Mark a worker's job completed, failed or cancelled"""
+    try:
+        db.grading_jobs.update_one(
+            {"_id": ObjectId(job_id), "worker_id": worker_id},
+            {"$set": {"status": status, "message": message, "finished_at": datetime.utcnow()}, "$unset": {"active": ""}}
+        )
+    except Exception as e:
+        print(f"Error finishing grading job: {e}")
+
+def release_grading_job(job_id, worker_id):
+    """Put a worker's running job back in the queue (used when the worker shuts down)"""
+    try:
+        db.grading_jobs.update_one(
+            {"_id": ObjectId(job_id), "worker_id": worker_id, "status": "running"},
+            {"$set": {"status": "queued", "worker_id": None}}
+        )
+    except Exception as e:
+        print(f"Error releasing grading job: {e}")
+
+def request_cancel_grading_job(job_id, user_id):
+    """Cancel a queued job outright, or ask the worker running it to stop after its current chunk"""
+    try:
+        if not job_id or not user_id:
+            return False, "Job ID and user ID are required"
+        
+        now = datetime.utcnow()
+        result = db.grading_jobs.update_one(
+            {"_id": ObjectId(job_id), "user_id": user_id, "status": "queued"},
+            {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now}, "$unset": {"active": ""}}
+        )
+        if result.modified_count:
+            return True, "Grading job cancelled"
+        
+        result = db.grading_jobs.update_one(
+            {"_id": ObjectId(job_id), "user_id": user_id, "status": "running"},
+            {"$set": {"cancel_requested": True}}
+        )
+        if result.modified_count:
+            return True, "Stopping after the current chunk"
+        return False, "Grading job is not running"
+    except Exception as e:
+        print(f"Error cancelling grading job: {e}")
+        return False, f"Error cancelling grading job: {str(e)}"
+
+def get_latest_grading_job(user_id, kind, test_id=None):
+    """The most recent grading job for a target, or None"""
+    try:
+        if not user_id:
+            return None
+        
+        return db.grading_jobs.find_one(
+            {"user_id": user_id, "kind": kind, "test_id": test_id},
+            sort=[("created_at", -1)]
+        )
+    except Exception as e:
+        print(f"Error getting grading job: {e}")
+        return None
+
+# Grading checkpoints: the resume cursor of a grading run that saves chunk by chunk. A run
+# that dies part-way leaves its checkpoint behind and the next run continues after it.
+def get_grading_checkpoint(user_id, kind, target_id):
+    """The unfinished run's checkpoint for a grading target, or None"""
+    try:
+        if not user_id or not target_id:
+            return None
+        
+        return db.grading_checkpoints.find_one({"user_id": user_id, "kind": kind, "target_id": target_id})
+    except Exception as e:
+        print(f"Error getting grading checkpoint: {e}")
+        return None
+
+def save_grading_checkpoint(user_id, kind, target_id, cursor, done, total):
+    """Record that everything up to and including cursor has been graded and saved"""
+    try:
+        now = datetime.utcnow()
+        db.grading_checkpoints.update_one(
+            {"user_id": user_id, "kind": kind, "target_id": target_id},
+            {
+                "$set": {"cursor": cursor, "progress": {"done": done, "total": total}, "updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True
+        )
+        return True
+    except Exception as e:
+        # The chunk itself is saved; losing a checkpoint only means re-checking more on resume
+        print(f"Error saving grading checkpoint: {e}")
+        return False
+
+def clear_grading_checkpoint(user_id, kind, target_id):
+    """Drop a target's checkpoint once its run has finished"""
+    try:
+        db.grading_checkpoints.delete_one({"user_id": user_id, "kind": kind, "target_id": target_id})
+    except Exception as e:
+        print(f"Error clearing grading checkpoint: {e}")
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from config import EMBEDDING_CACHE
+
+def normalize_cache_text(text):
+    """Collapse whitespace so trivially different copies of a text share an entry"""
+    return " ".join(text.split())
+
+def cache_key(text, model_name, model_revision):
+    """Content address of an embedding: model name, model revision and normalized text"""
+    payload = f"{model_name}\0{model_revision}\0{normalize_cache_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class MongoEmbeddingStore:
+    """Persistent tier storing float16 vectors as BinData in a Mongo collection"""
+    def __init__(self, collection_name):
+        # Imported here so the file and memory-only tiers never touch the database
+        from core.db import get_db
+        self.collection = get_db()[collection_name]
+
+    def get_many(self, keys):
+        found = {}
+        for doc in self.collection.find({"_id": {"$in": keys}}):
+            found[doc["_id"]] = np.frombuffer(doc["vector"], dtype=np.float16).astype(np.float32)
+        return found
+
+    def put_many(self, entries, model_name, model_revision):
+        from bson.binary import Binary
+        from pymongo import UpdateOne
+
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {"$setOnInsert": {
+                    "model": model_name,
+                    "revision": model_revision,
+                    "dim": int(vector.shape[0]),
+                    "vector": Binary(vector.astype(np.float16).tobytes()),
+                    "created_at": datetime.utcnow()
+                }},
+                upsert=True
+            )
+            for key, vector in entries.items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+class FileEmbeddingStore:
+    """Persistent tier storing float16 .npy files under a local directory"""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.npy")
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            path = self._path(key)
+            if os.path.exists(path):
+                found[key] = np.load(path).astype(np.float32)
+        return found
+
+    def put_many(self, entries, model_name, model_revision):
+        for key, vector in entries.items():
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.save(path, vector.astype(np.float16))
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model name, model revision, normalized-text hash)
+    An in-process LRU sits in front of an optional persistent store. Because the model
+    name and revision are part of every key, switching models never serves stale vectors.
+    The first failed read or write disables the persistent tier for the rest of the process,
+    so an unreachable database costs one timeout rather than one per lookup.
+    """
+    def __init__(self, model_name, model_revision, max_entries=None, backend=None):
+        self.model_name = model_name
+        self.model_revision = model_revision
+        self.max_entries = max_entries or EMBEDDING_CACHE["max_entries"]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+        self.store = self._create_store(backend or EMBEDDING_CACHE["backend"])
+
+    def _create_store(self, backend):
+        try:
+            if backend == "mongo":
+                return MongoEmbeddingStore(EMBEDDING_CACHE["collection"])
+            if backend == "file":
+                return FileEmbeddingStore(EMBEDDING_CACHE["file_dir"])
+        except Exception as e:
+            print(f"Warning: Could not open persistent embedding cache ({backend}): {e}")
+        return None
+
+    def _disable_store(self, operation, error):
+        print(f"Warning: Persistent embedding cache {operation} failed, using memory only from now on: {error}")
+        self.store = None
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_encode(self, texts, encode_fn):
+        """
+        Return an (n, dim) float32 array for texts, encoding only the cache misses
+        encode_fn receives the list of missing texts and must return an (m, dim) array.
+        """
+        keys = [cache_key(text, self.model_name, self.model_revision) for text in texts]
+        vectors = {}
+
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    vectors[key] = self._entries[key]
+                    self._stats["memory_hits"] += 1
+
+        missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+        store = self.store
+        if missing and store is not None:
+            try:
+                stored = store.get_many(missing)
+            except Exception as e:
+                self._disable_store("read", e)
+                stored = {}
+            with self._lock:
+                for key, vector in stored.items():
+                    self._remember(key, vector)
+                    self._stats["persistent_hits"] += 1
+            vectors.update(stored)
+
+        missing = [key for key in missing if key not in vectors]
+        if missing:
+            text_by_key = dict(zip(keys, texts))
+            encoded = np.asarray(encode_fn([text_by_key[key] for key in missing]), dtype=np.float32)
+            new_entries = dict(zip(missing, encoded))
+            with self._lock:
+                for key, vector in new_entries.items():
+                    self._remember(key, vector)
+                self._stats["misses"] += len(missing)
+            vectors.update(new_entries)
+
+            store = self.store
+            if store is not None:
+                try:
+                    store.put_many(new_entries, self.model_name, self.model_revision)
+                except Exception as e:
+                    self._disable_store("write", e)
+
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self):
+        """Hit/miss counters since process start"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """Drop the in-process tier and reset counters (the persistent tier is kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
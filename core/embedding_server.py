@@ -0,0 +1,133 @@
+"""
+Local embedding server
+
+Loads the sentence model once and serves encode requests from every app process on
+the host over a multiprocessing connection. Requests arriving within a short window
+are coalesced into one forward pass by the same InferenceQueue used in-process.
+
+Run it with:
+    python -m core.embedding_server           # start the server
+    python -m core.embedding_server --stats   # print stats from a running server
+"""
+import sys
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+from config import EMBEDDING_SERVER, DEFAULT_EMBEDDING_SERVER_AUTHKEY
+from core.model_provider import InferenceQueue, get_model
+
+def _address():
+    return (EMBEDDING_SERVER["host"], EMBEDDING_SERVER["port"])
+
+def _authkey():
+    # Connections exchange pickles, so a well-known key would let anyone on the network run code
+    if EMBEDDING_SERVER["authkey"] == DEFAULT_EMBEDDING_SERVER_AUTHKEY:
+        raise RuntimeError("Set EMBEDDING_SERVER_AUTHKEY to a secret before using the embedding server")
+    return EMBEDDING_SERVER["authkey"].encode("utf-8")
+
+class EmbeddingServer:
+    """Accepts client connections and feeds their requests into one coalescing queue"""
+    def __init__(self):
+        self.queue = InferenceQueue(
+            window_ms=EMBEDDING_SERVER["batch_window_ms"],
+            max_batch_texts=EMBEDDING_SERVER["max_batch_texts"]
+        )
+
+    def serve_forever(self):
+        authkey = _authkey()
+        # Load before accepting connections so the first client doesn't pay for it
+        get_model()
+        if EMBEDDING_SERVER["stats_interval"]:
+            threading.Thread(target=self._report_stats, name="embedding-server-stats", daemon=True).start()
+
+        with Listener(_address(), backlog=64, authkey=authkey) as listener:
+            print(f"Embedding server listening on {_address()[0]}:{_address()[1]}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    print(f"Warning: Rejected embedding client: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+
+    def _handle(self, connection):
+        """Serve one client connection until it closes"""
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    if message[0] == "encode":
+                        _, texts, batch_size = message
+                        connection.send(("ok", self.queue.encode(texts, batch_size)))
+                    elif message[0] == "stats":
+                        connection.send(("ok", self.queue.stats()))
+                    else:
+                        connection.send(("error", f"Unknown request: {message[0]}"))
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    connection.send(("error", str(e)))
+
+    def _report_stats(self):
+        while True:
+            time.sleep(EMBEDDING_SERVER["stats_interval"])
+            print(f"Embedding server stats: {self.queue.stats()}")
+
+class EmbeddingClient:
+    """
+    Client side of the embedding server
+    Connections are not thread-safe, so each thread gets its own.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = Client(_address(), authkey=_authkey())
+            self._local.connection = connection
+        return connection
+
+    def _request(self, message):
+        try:
+            connection = self._connection()
+            connection.send(message)
+            status, payload = connection.recv()
+        except (EOFError, OSError):
+            # Drop the broken connection so the next call reconnects
+            self._local.connection = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"Embedding server error: {payload}")
+        return payload
+
+    def encode(self, texts, batch_size=32):
+        """Encode a list of texts on the server and return an (n, dim) array"""
+        return self._request(("encode", list(texts), batch_size))
+
+    def stats(self):
+        """Queue depth, batch-size histogram and p50/p99 latency reported by the server"""
+        return self._request(("stats",))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide embedding server client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = EmbeddingClient()
+    return _client
+
+if __name__ == "__main__":
+    if "--stats" in sys.argv:
+        for key, value in get_client().stats().items():
+            print(f"{key}: {value}")
+    else:
+        EmbeddingServer().serve_forever()
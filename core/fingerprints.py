@@ -0,0 +1,52 @@
+import hashlib
+import json
+from config import GRADING_CONFIG, EMBEDDING_MODEL
+from core.grader import GRADING_LOGIC_VERSION
+from core.rubric import RUBRIC_VERSION, rubric_fingerprint
+from core.model_provider import embedding_revision, token_counter
+
+# Config sections that change grading results (batching and worker settings do not)
+RESULT_CONFIG_KEYS = ["semantic_weights", "rule_thresholds", "final_scoring", "chunking", "cascade", "fuzzy_keywords"]
+
+def _hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def answer_fingerprint(answer_text):
+    """Fingerprint of one answer's text"""
+    return _hash(answer_text)
+
+def normalized_answer_key(answer_text):
+    """
+    Key shared by answers that grade identically (copy-paste, blank templates)
+    Whitespace is kept: phrase rules match against the raw text, so "genetic\ninformation"
+    doesn't contain "genetic information". Case is folded only when the embedding model is
+    uncased: rule matching lowercases everything, but a cased model embeds "DNA" and "dna"
+    differently.
+    """
+    return _hash(answer_text.lower() if EMBEDDING_MODEL["uncased"] else answer_text)
+
+def student_test_fingerprint(question_answers):
+    """Fingerprint of a student's answers to every question of a test"""
+    return _hash(question_answers)
+
+def question_rubric_fingerprint(question):
+    """Fingerprint of a question's sample answer and rules, including the rubric format version"""
+    return _hash([RUBRIC_VERSION, rubric_fingerprint(question.get("sample_answer", ""), question.get("marking_scheme", []))])
+
+def grading_config_fingerprint():
+    """
+    Fingerprint of everything besides the answer and rubric that affects a grade's score
+    Grade thresholds are deliberately left out: letters are re-derived from stored scores.
+    """
+    return _hash({
+        "logic_version": GRADING_LOGIC_VERSION,
+        "model": EMBEDDING_MODEL["name"],
+        "revision": embedding_revision(),
+        # Token counts decide which answers are split into windows
+        "token_counter": token_counter(),
+        "config": {key: GRADING_CONFIG[key] for key in RESULT_CONFIG_KEYS}
+    })
+
+def grade_fingerprints(answer, rubric, config):
+    """The fingerprint set stored on every grade record"""
+    return {"answer": answer, "rubric": rubric, "config": config}
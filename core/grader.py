@@ -1,25 +1,170 @@
-from sentence_transformers import SentenceTransformer, util
 import re
-import nltk
-from nltk.stem import WordNetLemmatizer
-
-# Download NLTK data if not available
-try:
-    nltk.data.find('corpora/wordnet')
-except LookupError:
-    nltk.download('wordnet')
-
-try:
-    lemmatizer = WordNetLemmatizer()
-except Exception as e:
-    print(f"Warning: Could not initialize WordNet lemmatizer: {e}")
-    # Fallback lemmatizer
-    class FallbackLemmatizer:
-        def lemmatize(self, word):
-            return word.lower()
-    lemmatizer = FallbackLemmatizer()
-
-model = SentenceTransformer('all-MiniLM-L6-v2')
+import threading
+import time
+from functools import lru_cache
+import numpy as np
+from config import GRADING_CONFIG, EMBEDDING_MODEL
+from core.embedding_cache import EmbeddingCache
+from core.aho_corasick import AhoCorasick
+from core.symspell import DeletionIndex
+from core.static_embeddings import get_static_embedder
+from core.model_provider import encode, get_lemmatizer, token_lengths, embedding_revision
+
+# Bump whenever a change to the matching or scoring logic should invalidate stored grades
+GRADING_LOGIC_VERSION = 3
+
+# Sample answers and rule texts rarely change, so their embeddings are cached across runs
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL["name"], embedding_revision())
+
+def encode_reference_texts(texts, batch_size=None):
+    """Embed sample answers and rule texts through the content-addressed cache"""
+    batch_size = batch_size or GRADING_CONFIG["batching"]["batch_size"]
+    return embedding_cache.get_or_encode(
+        list(texts), lambda missing: encode(missing, batch_size=batch_size)
+    )
+
+def length_buckets(lengths, max_texts, token_budget):
+    """
+    Group text indices into batches of similar token length
+    Indices are taken shortest first; a batch closes once it holds max_texts texts or once
+    padding every member to the newest (longest) one would exceed token_budget tokens.
+    """
+    buckets, current = [], []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        if current and (len(current) >= max_texts or (len(current) + 1) * lengths[i] > token_budget):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+# Throughput of answer encoding since startup
+_encoding_stats = {"texts": 0, "batches": 0, "tokens": 0, "padded_tokens": 0, "seconds": 0.0}
+_encoding_stats_lock = threading.Lock()
+
+def encode_answers(texts, batch_size=None):
+    """
+    Embed student answers in length-bucketed batches and return them in input order
+    Short answers share big batches and long ones get small batches, so little of each
+    forward pass is spent on padding.
+    """
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    
+    batch_size = batch_size or GRADING_CONFIG["batching"]["batch_size"]
+    started = time.perf_counter()
+    lengths = token_lengths(texts)
+    buckets = length_buckets(lengths, batch_size, GRADING_CONFIG["batching"]["token_budget"])
+    
+    embeddings = [None] * len(texts)
+    for bucket in buckets:
+        # One bucket is one forward pass
+        bucket_embs = encode([texts[i] for i in bucket], batch_size=len(bucket))
+        for i, embedding in zip(bucket, bucket_embs):
+            embeddings[i] = embedding
+    
+    with _encoding_stats_lock:
+        _encoding_stats["texts"] += len(texts)
+        _encoding_stats["batches"] += len(buckets)
+        _encoding_stats["tokens"] += sum(lengths)
+        _encoding_stats["padded_tokens"] += sum(len(bucket) * max(lengths[i] for i in bucket) for bucket in buckets)
+        _encoding_stats["seconds"] += time.perf_counter() - started
+    
+    return np.stack(embeddings)
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+def sentence_windows(sentences, lengths, window_tokens, overlap_sentences):
+    """
+    Pack consecutive sentences into windows of about window_tokens tokens, each window
+    repeating the last overlap_sentences sentences of the one before (a window only runs
+    over the budget when it has to take a single long sentence)
+    """
+    windows, start, previous_end = [], 0, 0
+    while start < len(sentences):
+        end, size = start, 0
+        # Every window takes at least one sentence the previous window didn't have
+        while end < len(sentences) and (end <= previous_end or size + lengths[end] <= window_tokens):
+            size += lengths[end]
+            end += 1
+        windows.append(" ".join(sentences[start:end]))
+        if end >= len(sentences):
+            break
+        start, previous_end = max(end - overlap_sentences, start + 1), end
+    return windows
+
+def cap_windows(windows, max_chunks):
+    """Keep at most max_chunks windows, evenly spread so the start, middle and end are all covered"""
+    if len(windows) <= max_chunks:
+        return windows
+    if max_chunks == 1:
+        return windows[:1]
+    step = (len(windows) - 1) / (max_chunks - 1)
+    return [windows[round(i * step)] for i in range(max_chunks)]
+
+def split_answer_chunks(text, length=None):
+    """
+    The texts to embed for one answer: the answer itself, or overlapping sentence windows if
+    it is longer than the model would read (see GRADING_CONFIG["chunking"])
+    """
+    chunking = GRADING_CONFIG["chunking"]
+    if not chunking["enabled"]:
+        return [text]
+    
+    if length is None:
+        length = token_lengths([text], truncate=False)[0]
+    if length <= chunking["max_answer_tokens"]:
+        return [text]
+    
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY.split(text.strip()) if sentence]
+    # Drop the two special tokens every separately measured sentence is counted with
+    sentence_lengths = [max(1, n - 2) for n in token_lengths(sentences, truncate=False)]
+    windows = sentence_windows(sentences, sentence_lengths, chunking["window_tokens"], chunking["overlap_sentences"])
+    return cap_windows(windows, chunking["max_chunks"])
+
+def encode_answer_chunks(texts, batch_size=None):
+    """
+    Embed answers, long ones as sentence windows, with every window of every answer in one batch
+    Returns (answer embeddings, chunk embeddings, chunk offsets): answer i owns chunk rows
+    offsets[i]:offsets[i + 1], and its answer embedding is the mean of those rows.
+    """
+    texts = list(texts)
+    chunked = [split_answer_chunks(text, length) for text, length in zip(texts, token_lengths(texts, truncate=False))]
+    
+    offsets = [0]
+    for chunks in chunked:
+        offsets.append(offsets[-1] + len(chunks))
+    
+    chunk_embs = encode_answers([chunk for chunks in chunked for chunk in chunks], batch_size)
+    if offsets[-1] == len(texts):
+        # Nothing was split, so the chunks are the answers
+        return chunk_embs, chunk_embs, offsets
+    
+    counts = np.diff(offsets)[:, None]
+    answer_embs = np.add.reduceat(chunk_embs, offsets[:-1], axis=0) / counts
+    return answer_embs, chunk_embs, offsets
+
+def get_encoding_stats():
+    """Answer encoding throughput: tokens per second and share of batch tokens that weren't padding"""
+    with _encoding_stats_lock:
+        stats = dict(_encoding_stats)
+    stats["tokens_per_second"] = stats["tokens"] / stats["seconds"] if stats["seconds"] else 0.0
+    stats["padding_efficiency"] = stats["tokens"] / stats["padded_tokens"] if stats["padded_tokens"] else 1.0
+    return stats
+
+def cos_sim(a, b):
+    """Cosine similarity matrix between the rows of a and b (1-D inputs count as one row)"""
+    a = np.atleast_2d(np.asarray(a, dtype=np.float32))
+    b = np.atleast_2d(np.asarray(b, dtype=np.float32))
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return a @ b.T
+
+def get_embedding_cache_stats():
+    """Hit/miss counters for the reference embedding cache"""
+    return embedding_cache.stats()
 
 def assign_grade(score, grade_thresholds=None):
     """
@@ -52,7 +197,8 @@ def assign_grade(score, grade_thresholds=None):
 
 def normalize(text):
     """Basic lemmatization and lowercasing"""
-    words = re.findall(r'\b\w+\b', text.lower())
+    words = set(re.findall(r'\b\w+\b', text.lower()))
+    lemmatizer = get_lemmatizer()
     return set(lemmatizer.lemmatize(word) for word in words)
 
 def extract_key_concepts(text):
@@ -70,15 +216,26 @@ def extract_key_concepts(text):
     return key_words
 
 def calculate_semantic_similarity(student_answer, rule_text, threshold=0.2):
-    """Calculate semantic similarity between student answer and rule"""
-    # Direct semantic similarity
-    student_emb = model.encode(student_answer, convert_to_tensor=True)
-    rule_emb = model.encode(rule_text, convert_to_tensor=True)
-    direct_similarity = util.cos_sim(student_emb, rule_emb).item()
+    """Calculate semantic similarity between student answer (text or AnswerFeatures) and rule"""
+    return semantic_rule_score(AnswerFeatures.of(student_answer), _cached_compile_rule(rule_text, "semantic"), threshold)
+
+def semantic_rule_score(features, compiled_rule, threshold=0.2):
+    """Semantic score of a compiled rule, using its precomputed embedding when available"""
+    rule_emb = compiled_rule.embedding
+    if rule_emb is None:
+        rule_emb = encode_reference_texts([compiled_rule.text])[0]
+    
+    # Direct semantic similarity (the best window of a chunked long answer)
+    direct_similarity = float(cos_sim(features.chunk_embeddings, rule_emb)[:, 0].max())
     
+    return combine_semantic_score(direct_similarity, features, compiled_rule.text, threshold, compiled_rule.key_concepts)
+
+def combine_semantic_score(direct_similarity, student_answer, rule_text, threshold=0.2, rule_concepts=None):
+    """Combine a precomputed embedding similarity with key concept overlap"""
     # Key concept overlap
-    student_concepts = set(extract_key_concepts(student_answer))
-    rule_concepts = set(extract_key_concepts(rule_text))
+    student_concepts = AnswerFeatures.of(student_answer).key_concepts
+    if rule_concepts is None:
+        rule_concepts = set(extract_key_concepts(rule_text))
     
     if rule_concepts:
         concept_overlap = len(student_concepts.intersection(rule_concepts)) / len(rule_concepts)
@@ -90,113 +247,265 @@ def calculate_semantic_similarity(student_answer, rule_text, threshold=0.2):
     
     return final_similarity >= threshold, final_similarity
 
+def concept_indicators(concept_sets, vocabulary):
+    """0/1 matrix with a row per concept set and a column per vocabulary concept it contains"""
+    matrix = np.zeros((len(concept_sets), len(vocabulary)), dtype=np.float64)
+    for i, concepts in enumerate(concept_sets):
+        columns = [vocabulary[concept] for concept in concepts if concept in vocabulary]
+        matrix[i, columns] = 1.0
+    return matrix
+
+def semantic_score_matrix(answer_embs, answer_concepts, rule_embs, rule_concepts, chunk_offsets=None):
+    """
+    combine_semantic_score for every answer x semantic rule pair in a few array operations
+    Embeddings are normalized and multiplied once; concept overlap is a product of indicator
+    matrices over the rules' concept vocabulary, so answer words no rule uses cost nothing.
+    With chunk_offsets, answer_embs holds chunk embeddings (see encode_answer_chunks) and each
+    answer takes its best chunk's similarity.
+    """
+    direct_similarity = cos_sim(answer_embs, rule_embs).astype(np.float64)
+    if chunk_offsets is not None:
+        direct_similarity = np.maximum.reduceat(direct_similarity, chunk_offsets[:-1], axis=0)
+    
+    return direct_similarity * 0.7 + concept_overlap_matrix(answer_concepts, rule_concepts) * 0.3
+
+def keyword_match_matrix(answer_words, keyword_rules):
+    """
+    Word-level decisions of contains_keywords rules for every answer x rule pair at once
+    Answers and rules are encoded over an integer vocabulary of the rules' important words,
+    so the overlap counts for a whole class are one matrix product. The decisions are those
+    of CompiledRule._match_keywords: at least required_words words in common, an overlap
+    score of 0.8, or 3 words in common. Key phrases are checked separately.
+    """
+    rule_words = [compiled_rule.important_words for compiled_rule in keyword_rules]
+    vocabulary = {word: i for i, word in enumerate(sorted(set().union(*rule_words)))}
+    rule_matrix = concept_indicators(rule_words, vocabulary)
+    overlap = concept_indicators(answer_words, vocabulary) @ rule_matrix.T
+    
+    required_words = np.array([compiled_rule.required_words for compiled_rule in keyword_rules])
+    return (overlap >= required_words) | (overlap / rule_matrix.sum(axis=1) >= 0.8) | (overlap >= 3)
+
+def concept_overlap_matrix(answer_concepts, rule_concepts):
+    """Fraction of each rule's key concepts found in each answer, as an (answers, rules) array"""
+    vocabulary = {concept: i for i, concept in enumerate(sorted(set().union(*rule_concepts)))}
+    rule_matrix = concept_indicators(rule_concepts, vocabulary)
+    answer_matrix = concept_indicators(answer_concepts, vocabulary)
+    
+    # Rules without key concepts have an all-zero row, so their overlap stays 0
+    return (answer_matrix @ rule_matrix.T) / np.maximum(rule_matrix.sum(axis=1), 1)
+
+# How much embedding work the grading cascade has skipped since startup
+_cascade_stats = {"answers": 0, "answers_embedded": 0, "pairs": 0, "pairs_skipped": 0}
+_cascade_stats_lock = threading.Lock()
+
+def cascade_decisions(answer_concepts, rule_concepts, other_rules_matched, threshold=0.2):
+    """
+    Lexical first pass of the grading cascade (GRADING_CONFIG["cascade"])
+    Returns (needs_model, lexical_matches) for answers x semantic rules. A pair is matched
+    from concept overlap alone when the semantic score would reach threshold even at
+    min_similarity: 0.7 * min_similarity + 0.3 * overlap >= threshold. Pairs are never
+    rejected on overlap, since similarity alone matches paraphrases. An answer skips the model
+    only if all its semantic rules are matched this way and other_rules_matched says all its
+    other rules matched too; its score is then capped at 1.0 and the sample bonus can't change it.
+    """
+    # Cosine similarity lies in [-1, 1]; at -1 nothing is matched without the model
+    min_similarity = min(max(GRADING_CONFIG["cascade"]["min_similarity"], -1.0), 1.0)
+    overlap = concept_overlap_matrix(answer_concepts, rule_concepts)
+    lexical_matches = min_similarity * 0.7 + overlap * 0.3 >= threshold
+    needs_model = ~(lexical_matches.all(axis=1) & np.asarray(other_rules_matched, dtype=bool))
+    return needs_model, lexical_matches
+
+def get_cascade_stats():
+    """Share of answers and (answer, semantic rule) pairs the cascade decided without the model"""
+    with _cascade_stats_lock:
+        stats = dict(_cascade_stats)
+    stats["answers_skipped_fraction"] = 1 - stats["answers_embedded"] / stats["answers"] if stats["answers"] else 0.0
+    stats["pairs_skipped_fraction"] = stats["pairs_skipped"] / stats["pairs"] if stats["pairs"] else 0.0
+    return stats
+
+# Remove common function words that don't carry content meaning
+FUNCTION_WORDS = {
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 
+    'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those',
+    'mentions', 'contains', 'has', 'includes', 'explains', 'describes', 'shows', 'demonstrates',
+    'student', 'mentions', 'mention', 'contains', 'contain', 'includes', 'include', 'has', 'have',
+    'shows', 'show', 'demonstrates', 'demonstrate', 'explains', 'explain', 'describes', 'describe'
+}
+
 def extract_important_content(text):
     """Extract important content words from text dynamically"""
-    # Remove common function words that don't carry content meaning
-    function_words = {
-        'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 
-        'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 
-        'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those',
-        'mentions', 'contains', 'has', 'includes', 'explains', 'describes', 'shows', 'demonstrates',
-        'student', 'mentions', 'mention', 'contains', 'contain', 'includes', 'include', 'has', 'have',
-        'shows', 'show', 'demonstrates', 'demonstrate', 'explains', 'explain', 'describes', 'describe'
-    }
-    
-    normalized = normalize(text)
-    important_words = normalized - function_words
+    return important_words_from_lemmas(normalize(text))
+
+def important_words_from_lemmas(lemmas):
+    """Drop function words and very short words from a normalized lemma set"""
+    important_words = lemmas - FUNCTION_WORDS
     
     # Filter out very short words and common verbs
     important_words = {word for word in important_words if len(word) > 2}
     
     return important_words
 
-def match_rule(student_answer, rule_text, rule_type="semantic", threshold=0.2, debug=False):
-    """Match a rule based on its type with completely dynamic matching"""
+class AnswerFeatures:
+    """
+    Everything the rule matchers need from one student answer, computed once
+    The embedding is only encoded on first use so lexical-only rubrics never pay for it.
+    """
+    def __init__(self, text, embedding=None, chunk_embeddings=None):
+        self.text = text
+        self.lower = text.lower()
+        self.lemmas = normalize(text)
+        self.important_words = important_words_from_lemmas(self.lemmas)
+        self.key_concepts = set(extract_key_concepts(text))
+        self._embedding = embedding
+        self._chunk_embeddings = chunk_embeddings
     
-    if rule_type == "exact_phrase":
-        # For exact phrase matching, extract the key content from the rule
-        rule_lower = rule_text.lower()
-        student_lower = student_answer.lower()
-        
-        # Extract the main content phrase (after common instruction words)
-        instruction_patterns = [
-            r'mentions?\s+(?:the\s+)?(.+)',
-            r'contains?\s+(?:the\s+)?(.+)',
-            r'has\s+(?:the\s+)?(.+)',
-            r'includes?\s+(?:the\s+)?(.+)',
-            r'formula\s+(.+)',
-            r'equation\s+(.+)'
-        ]
-        
-        key_phrases = []
-        for pattern in instruction_patterns:
-            matches = re.findall(pattern, rule_lower)
-            for match in matches:
-                # Clean up the extracted phrase
-                phrase = match.strip().rstrip('.')
-                if len(phrase) > 2:  # Only meaningful phrases
-                    key_phrases.append(phrase)
-        
-        # If no pattern matched, try to extract meaningful content
-        if not key_phrases:
-            # Extract words that seem like content (not instruction words)
-            important_words = extract_important_content(rule_text)
-            if important_words:
-                key_phrases.extend(list(important_words))
-        
-        # Check if any key phrase is present
-        for phrase in key_phrases:
-            if phrase in student_lower:
-                return True, 1.0
-        
-        return False, 0.0
+    @property
+    def embedding(self):
+        """Whole-answer embedding (the mean of its windows for a chunked long answer)"""
+        if self._embedding is None:
+            self._encode()
+        return self._embedding
+    
+    @property
+    def chunk_embeddings(self):
+        """(chunks, dim) array: one row for a normal answer, one per sentence window for a long one"""
+        if self._chunk_embeddings is None:
+            self._encode()
+        return self._chunk_embeddings
     
+    def attach_embeddings(self, embedding, chunk_embeddings):
+        """Use embeddings computed in a batch instead of encoding this answer on its own"""
+        self._embedding = embedding
+        self._chunk_embeddings = chunk_embeddings
+    
+    def _encode(self):
+        chunks = split_answer_chunks(self.text)
+        if len(chunks) == 1:
+            if self._embedding is None:
+                self._embedding = encode(self.text)
+            self._chunk_embeddings = np.atleast_2d(self._embedding)
+        else:
+            self._chunk_embeddings = encode_answers(chunks)
+            if self._embedding is None:
+                self._embedding = self._chunk_embeddings.mean(axis=0)
+    
+    @classmethod
+    def of(cls, student_answer):
+        """Accept either raw answer text or already-built features"""
+        if isinstance(student_answer, cls):
+            return student_answer
+        return cls(student_answer)
+
+# Extract the main content phrase (after common instruction words)
+EXACT_PHRASE_PATTERNS = [re.compile(pattern) for pattern in (
+    r'mentions?\s+(?:the\s+)?(.+)',
+    r'contains?\s+(?:the\s+)?(.+)',
+    r'has\s+(?:the\s+)?(.+)',
+    r'includes?\s+(?:the\s+)?(.+)',
+    r'formula\s+(.+)',
+    r'equation\s+(.+)'
+)]
+
+# Extract key phrases from keyword rules (after instruction words)
+KEYWORD_PHRASE_PATTERNS = [re.compile(pattern) for pattern in (
+    r'contains?\s+(?:the\s+)?(.+)',
+    r'has\s+(?:the\s+)?(.+)',
+    r'includes?\s+(?:the\s+)?(.+)',
+    r'keywords?\s+(?:are\s+)?(.+)',
+    r'terms?\s+(?:are\s+)?(.+)'
+)]
+
+def extract_rule_phrases(rule_text, rule_type):
+    """Key phrases an answer must contain verbatim for exact_phrase and contains_keywords rules"""
+    if rule_type == "exact_phrase":
+        instruction_patterns = EXACT_PHRASE_PATTERNS
     elif rule_type == "contains_keywords":
-        # Extract important content words from both rule and answer
-        rule_important = extract_important_content(rule_text)
-        student_important = extract_important_content(student_answer)
-        
-        if not rule_important:
-            # If no important words found, fall back to semantic matching
-            return calculate_semantic_similarity(student_answer, rule_text, threshold)
+        instruction_patterns = KEYWORD_PHRASE_PATTERNS
+    else:
+        return []
+    
+    rule_lower = rule_text.lower()
+    key_phrases = []
+    for pattern in instruction_patterns:
+        matches = pattern.findall(rule_lower)
+        for match in matches:
+            # Clean up the extracted phrase
+            phrase = match.strip().rstrip('.')
+            if len(phrase) > 2:  # Only meaningful phrases
+                key_phrases.append(phrase)
+    
+    # If no pattern matched, try to extract meaningful content
+    if not key_phrases and rule_type == "exact_phrase":
+        # Extract words that seem like content (not instruction words)
+        key_phrases.extend(sorted(extract_important_content(rule_text)))
+    
+    return key_phrases
+
+class CompiledRule:
+    """
+    A marking scheme rule with everything matching needs derived once, independent of any answer
+    Build one per rule (prepare_rubric does this per question) and call match() per answer.
+    """
+    def __init__(self, text, rule_type, key_phrases=None, important_words=None, key_concepts=None, embedding=None):
+        self.text = text
+        self.type = rule_type
+        self.key_phrases = list(key_phrases) if key_phrases is not None else extract_rule_phrases(text, rule_type)
+        self.important_words = set(important_words) if important_words is not None else extract_important_content(text)
+        self.key_concepts = set(key_concepts) if key_concepts is not None else set(extract_key_concepts(text))
+        self.needs_embedding = needs_embedding(text, rule_type, self.important_words)
+        self.embedding = embedding
+        # Keyword rules match with at least 80% of their important words present
+        self.required_words = max(1, len(self.important_words) * 0.8)
+    
+    @classmethod
+    def from_rule(cls, rule):
+        """Compile a marking scheme entry (text or {"text", "type"}), auto-detecting its type"""
+        return cls(*resolve_rule(rule))
+    
+    def match(self, features, threshold=0.2, debug=False, phrase_found=None, answer_words=None):
+        """
+        Match this rule against AnswerFeatures; returns (is_matched, score)
+        phrase_found: whether any of the rule's key phrases occurs in the answer, when the
+        question's phrase matcher has already worked it out (see build_phrase_matcher)
+        answer_words: the answer's important words for keyword matching, if they differ from
+        features.important_words (see keyword_answer_words)
+        """
+        if self.type == "exact_phrase":
+            return self._match_phrases(features, phrase_found)
+        if self.type == "contains_keywords" and self.important_words:
+            return self._match_keywords(features, debug, phrase_found, answer_words)
+        # Semantic, the default if unspecified, and keyword rules without content words
+        return semantic_rule_score(features, self, threshold)
+    
+    def has_phrase(self, features, phrase_found=None):
+        """Whether any key phrase occurs in the answer (phrase_found short-circuits the check)"""
+        if phrase_found is None:
+            # Check if any key phrase is present
+            phrase_found = any(phrase in features.lower for phrase in self.key_phrases)
+        return phrase_found
+    
+    def _match_phrases(self, features, phrase_found=None):
+        return (True, 1.0) if self.has_phrase(features, phrase_found) else (False, 0.0)
+    
+    def _match_keywords(self, features, debug=False, phrase_found=None, answer_words=None):
+        rule_important = self.important_words
+        student_important = features.important_words if answer_words is None else answer_words
         
         # First, try exact phrase matching for multi-word terms
-        rule_lower = rule_text.lower()
-        student_lower = student_answer.lower()
-        
-        # Extract key phrases from the rule (after instruction words)
-        instruction_patterns = [
-            r'contains?\s+(?:the\s+)?(.+)',
-            r'has\s+(?:the\s+)?(.+)',
-            r'includes?\s+(?:the\s+)?(.+)',
-            r'keywords?\s+(?:are\s+)?(.+)',
-            r'terms?\s+(?:are\s+)?(.+)'
-        ]
-        
-        key_phrases = []
-        for pattern in instruction_patterns:
-            matches = re.findall(pattern, rule_lower)
-            for match in matches:
-                phrase = match.strip().rstrip('.')
-                if len(phrase) > 2:
-                    key_phrases.append(phrase)
-        
-        # If we found specific phrases, check for exact matches first
-        if key_phrases:
-            for phrase in key_phrases:
-                if phrase in student_lower:
-                    return True, 1.0
+        if self._match_phrases(features, phrase_found)[0]:
+            return True, 1.0
         
         # Debug: Print what we're looking for
         if debug:
-            print(f"  Keyword rule '{rule_text}' extracted phrases: {key_phrases}")
-            print(f"  Student answer: '{student_lower}'")
+            print(f"  Keyword rule '{self.text}' extracted phrases: {self.key_phrases}")
+            print(f"  Student answer: '{features.lower}'")
             print(f"  No exact phrase match found")
         
         # If no exact phrase match, fall back to word-level matching
         # But be more strict - require higher overlap
         overlap = len(student_important.intersection(rule_important))
-        score = overlap / len(rule_important) if rule_important else 0
+        score = overlap / len(rule_important)
         
         # Debug: Print word-level matching info
         if debug:
@@ -207,8 +516,7 @@ def match_rule(student_answer, rule_text, rule_type="semantic", threshold=0.2, d
         
         # More strict matching: require at least 80% of important words
         # OR if we have a very high overlap score (>= 0.8)
-        required_words = max(1, len(rule_important) * 0.8)  # At least 80% of words
-        words_present = overlap >= required_words
+        words_present = overlap >= self.required_words
         
         # Also consider it a match if we have very high semantic similarity
         if not words_present and score >= 0.8:
@@ -219,13 +527,139 @@ def match_rule(student_answer, rule_text, rule_type="semantic", threshold=0.2, d
             words_present = True
         
         return words_present, score
+
+def compile_rule(rule_text, rule_type):
+    """Derive everything matching needs from a rule, independent of any answer"""
+    return CompiledRule(rule_text, rule_type)
+
+def build_phrase_matcher(compiled_rules):
+    """
+    One Aho-Corasick automaton over the key phrases of all of a question's lexical rules, so
+    each answer is scanned once however many phrases the rubric has; its matches are rule
+    indices. Returns None for rubrics with fewer phrases than
+    GRADING_CONFIG["lexical"]["automaton_min_phrases"], where substring checks are faster.
+    """
+    patterns = [
+        (phrase, i)
+        for i, compiled_rule in enumerate(compiled_rules)
+        if compiled_rule.type in ("exact_phrase", "contains_keywords")
+        for phrase in compiled_rule.key_phrases
+    ]
+    if len(patterns) < GRADING_CONFIG["lexical"]["automaton_min_phrases"]:
+        return None
+    return AhoCorasick(patterns)
+
+def build_keyword_index(compiled_rules):
+    """
+    SymSpell deletion index over the important words of a question's keyword rules, or None
+    when fuzzy keyword matching (GRADING_CONFIG["fuzzy_keywords"]) is off
+    Each word is indexed as its lemma and as the surface forms the rule wrote it in, all
+    standing for the lemma: a misspelled plural such as "protns" is one edit from "protons"
+    but two from "proton".
+    """
+    fuzzy = GRADING_CONFIG["fuzzy_keywords"]
+    if not fuzzy["enabled"]:
+        return None
+    lemmatizer = get_lemmatizer()
+    words = {}
+    for compiled_rule in compiled_rules:
+        if compiled_rule.type != "contains_keywords":
+            continue
+        surface_words = set(re.findall(r'\b\w+\b', compiled_rule.text.lower()))
+        for word in surface_words | compiled_rule.important_words:
+            lemma = word if word in compiled_rule.important_words else lemmatizer.lemmatize(word)
+            if lemma in compiled_rule.important_words and len(word) >= fuzzy["min_word_length"]:
+                words[word] = lemma
+    return DeletionIndex(words, fuzzy["max_edit_distance"]) if words else None
+
+def keyword_answer_words(rubric, features):
+    """
+    The answer's important words as keyword rules see them: with fuzzy matching on, each
+    misspelled word also counts as the closest rule word(s) within the edit distance bound
+    Both the answer's lemmas and its words as written are looked up, since a misspelled word
+    doesn't lemmatize (see build_keyword_index).
+    """
+    keyword_index = rubric.get("keyword_index")
+    if keyword_index is None:
+        return features.important_words
     
-    elif rule_type == "semantic":
-        return calculate_semantic_similarity(student_answer, rule_text, threshold)
+    min_word_length = GRADING_CONFIG["fuzzy_keywords"]["min_word_length"]
+    words = set(features.important_words)
+    for word in features.important_words | set(re.findall(r'\b\w+\b', features.lower)):
+        if len(word) >= min_word_length:
+            words |= keyword_index.lookup(word)
+    return words
+
+def rules_with_phrase_found(rubric, features):
+    """Indices of the rubric's rules with a key phrase in the answer, or None without a phrase matcher"""
+    phrase_matcher = rubric.get("phrase_matcher")
+    if phrase_matcher is None:
+        return None
+    return phrase_matcher.matches(features.lower)
+
+# match_rule is called with raw rule text; remember recent compilations so repeated calls
+# don't redo the regex and lemmatization work. These are never given embeddings.
+_cached_compile_rule = lru_cache(maxsize=1024)(compile_rule)
+
+def match_rule(student_answer, rule_text, rule_type="semantic", threshold=0.2, debug=False):
+    """
+    Match a rule based on its type with completely dynamic matching
+    student_answer may be raw text or an AnswerFeatures built once per answer.
+    """
+    return _cached_compile_rule(rule_text, rule_type).match(AnswerFeatures.of(student_answer), threshold, debug)
+
+def resolve_rule(rule):
+    """Return (rule_text, rule_type) for a marking scheme entry, auto-detecting the type"""
+    # Determine rule type based on content
+    rule_text = rule if isinstance(rule, str) else rule.get("text", rule)
+    rule_type = rule.get("type", "semantic") if isinstance(rule, dict) else "semantic"
+    
+    # Auto-detect rule type if not specified
+    if rule_type == "semantic":
+        rule_lower = rule_text.lower()
+        if any(word in rule_lower for word in ["formula", "equation", "mentions"]):
+            rule_type = "exact_phrase"
+        elif any(word in rule_lower for word in ["contains", "has", "includes"]):
+            rule_type = "contains_keywords"
     
+    return rule_text, rule_type
+
+def needs_embedding(rule_text, rule_type, important_words=None):
+    """Whether match_rule would embed the answer for this rule"""
+    if rule_type == "exact_phrase":
+        return False
+    if rule_type == "contains_keywords":
+        # Keyword rules only fall back to semantic matching when they have no content words
+        if important_words is None:
+            important_words = extract_important_content(rule_text)
+        return not important_words
+    return True
+
+def prepare_rubric(sample, rules, batch_size=None, draft=False):
+    """
+    Compile a question's rules and embed its sample answer and semantic rules once
+    Returns {"sample_embedding": vector, "rules": [compiled rule, ...], "phrase_matcher": ...,
+    "keyword_index": ...} with rules in marking scheme order.
+    draft=True embeds with the static token vectors used for draft grading instead.
+    """
+    compiled_rules = [CompiledRule.from_rule(rule) for rule in rules]
+    reference_texts = [sample] + [rule.text for rule in compiled_rules if rule.needs_embedding]
+    if draft:
+        reference_embs = get_static_embedder().encode(reference_texts)
     else:
-        # Default to semantic if unspecified
-        return calculate_semantic_similarity(student_answer, rule_text, threshold)
+        reference_embs = encode_reference_texts(reference_texts, batch_size)
+    
+    rule_embs = iter(reference_embs[1:])
+    for rule in compiled_rules:
+        if rule.needs_embedding:
+            rule.embedding = next(rule_embs)
+    
+    return {
+        "sample_embedding": reference_embs[0],
+        "rules": compiled_rules,
+        "phrase_matcher": build_phrase_matcher(compiled_rules),
+        "keyword_index": build_keyword_index(compiled_rules)
+    }
 
 def debug_grading(student_answer, sample, rules):
     """Debug function to analyze grading process"""
@@ -234,26 +668,16 @@ def debug_grading(student_answer, sample, rules):
     print(f"Sample Answer: {sample}")
     print(f"Rules: {rules}")
     
-    student_emb = model.encode(student_answer, convert_to_tensor=True)
-    sample_emb = model.encode(sample, convert_to_tensor=True)
-    sample_score = util.cos_sim(student_emb, sample_emb).item()
+    features = AnswerFeatures(student_answer)
+    sample_emb = encode_reference_texts([sample])[0]
+    sample_score = float(cos_sim(features.embedding, sample_emb)[0, 0])
     
     print(f"\nSample Answer Similarity: {sample_score:.4f}")
     
     for i, rule in enumerate(rules):
-        # Determine rule type based on content
-        rule_text = rule if isinstance(rule, str) else rule.get("text", rule)
-        rule_type = rule.get("type", "semantic") if isinstance(rule, dict) else "semantic"
-        
-        # Auto-detect rule type if not specified
-        if rule_type == "semantic":
-            rule_lower = rule_text.lower()
-            if any(word in rule_lower for word in ["formula", "equation", "mentions"]):
-                rule_type = "exact_phrase"
-            elif any(word in rule_lower for word in ["contains", "has", "includes"]):
-                rule_type = "contains_keywords"
+        rule_text, rule_type = resolve_rule(rule)
         
-        is_matched, rule_score = match_rule(student_answer, rule_text, rule_type, 0.2)
+        is_matched, rule_score = match_rule(features, rule_text, rule_type, 0.2)
         
         print(f"\nRule {i+1}: {rule_text}")
         print(f"  Type: {rule_type}")
@@ -262,7 +686,7 @@ def debug_grading(student_answer, sample, rules):
         
         # Show key concepts for semantic rules
         if rule_type == "semantic":
-            student_concepts = set(extract_key_concepts(student_answer))
+            student_concepts = features.key_concepts
             rule_concepts = set(extract_key_concepts(rule_text))
             overlap = student_concepts.intersection(rule_concepts)
             
@@ -273,43 +697,41 @@ def debug_grading(student_answer, sample, rules):
         # Show important words for keyword rules
         elif rule_type == "contains_keywords":
             rule_important = extract_important_content(rule_text)
-            student_important = extract_important_content(student_answer)
+            student_important = features.important_words
             
             print(f"  Important Rule Words: {rule_important}")
             print(f"  Important Student Words: {student_important}")
             print(f"  Overlap: {student_important.intersection(rule_important)}")
 
-def calculate_similarity_with_feedback(student_answer, sample, rules, threshold=0.2, grade_thresholds=None, debug=False):
-    student_emb = model.encode(student_answer, convert_to_tensor=True)
-    sample_emb = model.encode(sample, convert_to_tensor=True)
-    sample_score = util.cos_sim(student_emb, sample_emb).item()
+def calculate_similarity_with_feedback(student_answer, sample, rules, threshold=0.2, grade_thresholds=None, debug=False, rubric=None):
+    """Grade one answer; pass a rubric from prepare_rubric/load_rubric to skip recompiling rules"""
+    if rubric is None:
+        rubric = prepare_rubric(sample, rules)
+    
+    features = AnswerFeatures.of(student_answer)
+    sample_score = float(cos_sim(features.embedding, rubric["sample_embedding"])[0, 0])
 
+    phrase_rules = rules_with_phrase_found(rubric, features)
+    answer_words = keyword_answer_words(rubric, features)
     matched, missed, rule_scores = [], [], []
 
-    for rule in rules:
-        # Determine rule type based on content
-        rule_text = rule if isinstance(rule, str) else rule.get("text", rule)
-        rule_type = rule.get("type", "semantic") if isinstance(rule, dict) else "semantic"
-        
-        # Auto-detect rule type if not specified
-        if rule_type == "semantic":
-            rule_lower = rule_text.lower()
-            if any(word in rule_lower for word in ["formula", "equation", "mentions"]):
-                rule_type = "exact_phrase"
-            elif any(word in rule_lower for word in ["contains", "has", "includes"]):
-                rule_type = "contains_keywords"
-        
-        is_matched, rule_score = match_rule(student_answer, rule_text, rule_type, threshold, debug)
+    for i, compiled_rule in enumerate(rubric["rules"]):
+        phrase_found = None if phrase_rules is None else i in phrase_rules
+        is_matched, rule_score = compiled_rule.match(features, threshold, debug, phrase_found, answer_words)
         rule_scores.append(rule_score)
         
         if is_matched:
-            matched.append(rule_text)
+            matched.append(compiled_rule.text)
         else:
-            missed.append(rule_text)
+            missed.append(compiled_rule.text)
 
+    return build_feedback(matched, missed, len(rubric["rules"]), sample_score, grade_thresholds)
+
+def build_feedback(matched, missed, rule_count, sample_score, grade_thresholds=None):
+    """Turn matched/missed rules and sample similarity into the feedback dict"""
     # Calculate rule-based score (primary scoring method)
-    if rules:
-        rule_score = len(matched) / len(rules)  # Percentage of rules matched
+    if rule_count:
+        rule_score = len(matched) / rule_count  # Percentage of rules matched
     else:
         rule_score = 0
     
@@ -328,3 +750,124 @@ def calculate_similarity_with_feedback(student_answer, sample, rules, threshold=
         "matched_rules": matched,
         "missed_rules": missed
     }
+
+def grade_answers_batch(student_answers, sample, rules, threshold=0.2, grade_thresholds=None, batch_size=None, debug=False, rubric=None, draft=False):
+    """
+    Grade every answer to one question with batched embeddings
+    Produces the same feedback as calling calculate_similarity_with_feedback per answer,
+    but encodes answers in length-bucketed batches, the sample and semantic rules once, and scores
+    every answer against every semantic rule with semantic_score_matrix and against every
+    keyword rule with keyword_match_matrix.
+    draft=True swaps the transformer for mean-pooled static token vectors (see
+    core.static_embeddings): much faster, but only an approximation of the real grade.
+    With the cascade enabled, answers that match every rule without the model (semantic rules
+    on concept overlap alone) are graded without being embedded (see cascade_decisions).
+    """
+    if not student_answers:
+        return []
+    
+    batch_size = batch_size or GRADING_CONFIG["batching"]["batch_size"]
+    if draft:
+        # A compiled rubric holds transformer embeddings, which don't compare with static ones
+        rubric = prepare_rubric(sample, rules, draft=True)
+    elif rubric is None:
+        rubric = prepare_rubric(sample, rules, batch_size)
+    compiled_rules = rubric["rules"]
+    
+    # Only rules that would hit the embedding model get a column in the semantic matrix
+    semantic_columns = {}
+    for i, compiled_rule in enumerate(compiled_rules):
+        if compiled_rule.needs_embedding:
+            semantic_columns[i] = len(semantic_columns)
+    semantic_rules = [compiled_rules[i] for i in semantic_columns]
+    
+    # Keyword rules with content words are decided for the whole class at once; debug mode
+    # matches them pair by pair so their matching details get printed
+    keyword_columns = {}
+    if not debug:
+        for i, compiled_rule in enumerate(compiled_rules):
+            if compiled_rule.type == "contains_keywords" and compiled_rule.important_words:
+                keyword_columns[i] = len(keyword_columns)
+    
+    features = [AnswerFeatures(student_answer) for student_answer in student_answers]
+    answer_concepts = [answer_features.key_concepts for answer_features in features]
+    sample_scores = [0.0] * len(features)
+    
+    answer_words = [keyword_answer_words(rubric, answer_features) for answer_features in features]
+    if keyword_columns:
+        keyword_matches = keyword_match_matrix(answer_words, [compiled_rules[j] for j in keyword_columns]).tolist()
+    
+    # Rules that don't need the model are decided for every answer before anything is embedded
+    lexical_decisions = []
+    for i, answer_features in enumerate(features):
+        phrase_rules = rules_with_phrase_found(rubric, answer_features)
+        decisions = {}
+        for j, compiled_rule in enumerate(compiled_rules):
+            if j in semantic_columns:
+                continue
+            phrase_found = None if phrase_rules is None else j in phrase_rules
+            if j in keyword_columns:
+                decisions[j] = compiled_rule.has_phrase(answer_features, phrase_found) or keyword_matches[i][keyword_columns[j]]
+            else:
+                decisions[j], _ = compiled_rule.match(answer_features, threshold, debug, phrase_found, answer_words[i])
+        lexical_decisions.append(decisions)
+    
+    if draft or not GRADING_CONFIG["cascade"]["enabled"]:
+        embedded = list(range(len(features)))
+        semantic_matches = [None] * len(features)
+    else:
+        # Without rules the score is all sample bonus, so the answer must be embedded
+        needs_model, lexical_matches = cascade_decisions(
+            answer_concepts, [compiled_rule.key_concepts for compiled_rule in semantic_rules],
+            [bool(compiled_rules) and all(decisions.values()) for decisions in lexical_decisions],
+            threshold
+        )
+        embedded = np.flatnonzero(needs_model).tolist()
+        semantic_matches = lexical_matches.tolist()
+        with _cascade_stats_lock:
+            _cascade_stats["answers"] += len(features)
+            _cascade_stats["answers_embedded"] += len(embedded)
+            _cascade_stats["pairs"] += len(features) * len(semantic_rules)
+            _cascade_stats["pairs_skipped"] += (len(features) - len(embedded)) * len(semantic_rules)
+    
+    if embedded:
+        texts = [student_answers[i] for i in embedded]
+        if draft:
+            answer_embs = chunk_embs = get_static_embedder().encode(texts)
+            chunk_offsets = list(range(len(texts) + 1))
+        else:
+            answer_embs, chunk_embs, chunk_offsets = encode_answer_chunks(texts, batch_size)
+        
+        embedded_sample_scores = cos_sim(answer_embs, rubric["sample_embedding"])[:, 0].tolist()
+        if semantic_rules:
+            embedded_matches = (semantic_score_matrix(
+                chunk_embs,
+                [answer_concepts[i] for i in embedded],
+                np.stack([compiled_rule.embedding for compiled_rule in semantic_rules]),
+                [compiled_rule.key_concepts for compiled_rule in semantic_rules],
+                chunk_offsets
+            ) >= threshold).tolist()
+        
+        for row, i in enumerate(embedded):
+            features[i].attach_embeddings(answer_embs[row], chunk_embs[chunk_offsets[row]:chunk_offsets[row + 1]])
+            sample_scores[i] = embedded_sample_scores[row]
+            if semantic_rules:
+                semantic_matches[i] = embedded_matches[row]
+    
+    results = []
+    for i, answer_features in enumerate(features):
+        matched, missed = [], []
+        for j, compiled_rule in enumerate(compiled_rules):
+            if j in semantic_columns:
+                is_matched = semantic_matches[i][semantic_columns[j]]
+            else:
+                is_matched = lexical_decisions[i][j]
+            
+            if is_matched:
+                matched.append(compiled_rule.text)
+            else:
+                missed.append(compiled_rule.text)
+        
+        results.append(build_feedback(matched, missed, len(compiled_rules), sample_scores[i], grade_thresholds))
+    
+    return results
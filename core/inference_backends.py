@@ -0,0 +1,162 @@
+"""
+Inference backends for the sentence embedding model
+
+Every backend exposes what the rest of the grader uses from a SentenceTransformer:
+encode(texts, batch_size), tokenizer and max_seq_length.
+
+    torch      sentence-transformers on PyTorch (the reference)
+    onnx       the same transformer exported to ONNX and run with ONNX Runtime
+    onnx-int8  the ONNX export with dynamically int8-quantized weights
+
+ONNX models are exported on first use; export ahead of time (e.g. while building an image) with:
+    python -m core.inference_backends --export
+"""
+import json
+import os
+import sys
+import numpy as np
+from config import EMBEDDING_MODEL, INFERENCE
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+def export_dir(model_name=None, revision=None):
+    """Where the ONNX export of a model revision lives"""
+    model_name = model_name or EMBEDDING_MODEL["name"]
+    revision = revision or EMBEDDING_MODEL["revision"]
+    return os.path.join(EMBEDDING_MODEL["onnx_dir"], f"{model_name.replace('/', '__')}-{revision}")
+
+def export_onnx(model_name=None, revision=None, quantize=True):
+    """
+    Export the transformer of a sentence-transformers model to ONNX, plus its tokenizer and
+    pooling settings, and optionally an int8 dynamically quantized copy
+    Needs torch (to trace the model) and onnxruntime (to quantize); grading with the export
+    only needs onnxruntime and the tokenizer.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model_name = model_name or EMBEDDING_MODEL["name"]
+    revision = revision or EMBEDDING_MODEL["revision"]
+    target = export_dir(model_name, revision)
+    os.makedirs(target, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, revision=revision, device="cpu")
+    pooling = st_model[1]
+    if not getattr(pooling, "pooling_mode_mean_tokens", False):
+        raise ValueError(f"{model_name} does not use mean pooling; only mean-pooled models can be exported")
+    normalize = any(type(module).__name__ == "Normalize" for module in st_model)
+
+    class TokenEmbeddings(torch.nn.Module):
+        """Just the token embeddings; pooling and normalization run in numpy"""
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.transformer(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            ).last_hidden_state
+
+    tokenizer = st_model.tokenizer
+    sample = tokenizer(["Export this sentence."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+
+    fp32_path = os.path.join(target, "model.onnx")
+    torch.onnx.export(
+        TokenEmbeddings(st_model[0].auto_model.eval()),
+        tuple(sample[name] for name in input_names),
+        fp32_path,
+        input_names=input_names,
+        output_names=["last_hidden_state"],
+        dynamic_axes=dynamic_axes,
+        opset_version=14
+    )
+    tokenizer.save_pretrained(target)
+    with open(os.path.join(target, "pooling.json"), "w") as f:
+        json.dump({"model": model_name, "revision": revision, "normalize": normalize, "max_seq_length": st_model.max_seq_length}, f)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(target, "model-int8.onnx"), weight_type=QuantType.QInt8)
+
+    print(f"Exported {model_name}@{revision} to {target}")
+    return target
+
+class OnnxBackend:
+    """Mean-pooled sentence embeddings from an ONNX export, run with ONNX Runtime on CPU"""
+    def __init__(self, quantized=False):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backends need onnxruntime: pip install onnxruntime")
+        from transformers import AutoTokenizer
+
+        source = export_dir()
+        model_file = "model-int8.onnx" if quantized else "model.onnx"
+        if not os.path.exists(os.path.join(source, model_file)):
+            print(f"No ONNX export found in {source}, exporting {EMBEDDING_MODEL['name']} now")
+            export_onnx(quantize=quantized)
+
+        with open(os.path.join(source, "pooling.json")) as f:
+            pooling = json.load(f)
+        self.normalize = pooling["normalize"]
+        self.max_seq_length = pooling["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(source)
+
+        options = onnxruntime.SessionOptions()
+        if INFERENCE["torch_threads"]:
+            options.intra_op_num_threads = INFERENCE["torch_threads"]
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(source, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        """Encode a list of texts into an (n, dim) float32 array, like SentenceTransformer.encode"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # Longest first within the call, as sentence-transformers does, so batches pad little
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        embeddings = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in batch], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np"
+            )
+            feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+            token_embeddings = self.session.run(["last_hidden_state"], feed)[0]
+
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.normalize:
+                pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            for i, vector in zip(batch, pooled):
+                embeddings[i] = vector.astype(np.float32)
+
+        return np.stack(embeddings)
+
+def load_backend(name=None):
+    """Load the model on the named backend (default: EMBEDDING_MODEL["backend"])"""
+    name = name or EMBEDDING_MODEL["backend"]
+    if name == "torch":
+        from sentence_transformers import SentenceTransformer
+        if INFERENCE["torch_threads"]:
+            # Cap intra-op threads so concurrent gradings don't oversubscribe the CPU
+            import torch
+            torch.set_num_threads(INFERENCE["torch_threads"])
+        return SentenceTransformer(EMBEDDING_MODEL["name"], revision=EMBEDDING_MODEL["revision"])
+    if name == "onnx":
+        return OnnxBackend(quantized=False)
+    if name == "onnx-int8":
+        return OnnxBackend(quantized=True)
+    raise ValueError(f"Unknown embedding backend {name!r}; expected one of {', '.join(BACKENDS)}")
+
+if __name__ == "__main__":
+    if "--export" in sys.argv:
+        export_onnx(quantize="--no-quantize" not in sys.argv)
+    else:
+        print(__doc__)
@@ -0,0 +1,132 @@
+"""
+Memoized lemmatization
+
+Every answer and rule is lemmatized word by word, and WordNet lookups are slow. Lemmas are
+served from a precomputed table when one exists, then from a bounded LRU, and only unseen
+words reach NLTK. With a table covering the common vocabulary, WordNet isn't even loaded
+until a word outside it turns up.
+
+Build the table from text the app grades, e.g. CSV exports of answers and marking schemes:
+    python -m core.lemmas --build answers.csv questions.csv
+    python -m core.lemmas --bench              # lemmatization throughput, cold vs memoized
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from config import LEMMATIZATION
+
+_WORD_PATTERN = re.compile(r'\b\w+\b')
+
+# Lemmas from anything else (such as the lowercasing fallback used when WordNet can't load)
+# would silently change keyword matches for every word the table covers
+TABLE_LEMMATIZER = "WordNetLemmatizer"
+
+def load_lemma_table(path=None):
+    """The precomputed word -> lemma table, or {} if there is none or it wasn't built with WordNet"""
+    path = path or LEMMATIZATION["table_path"]
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("lemmatizer") != TABLE_LEMMATIZER:
+            print(f"Warning: Ignoring lemma table {path}: built with {data.get('lemmatizer')}, not {TABLE_LEMMATIZER}")
+            return {}
+        return data["lemmas"]
+    except Exception as e:
+        print(f"Warning: Could not load lemma table {path}: {e}")
+        return {}
+
+class CachedLemmatizer:
+    """
+    Lemmatizer with a precomputed table and a bounded LRU in front of the NLTK one
+    load_base loads the underlying lemmatizer; it is only called on the first table miss.
+    """
+    def __init__(self, load_base, table=None):
+        self.table = table or {}
+        self._load_base = load_base
+        self._base = None
+        self._base_lock = threading.Lock()
+        self._lemmatize_word = lru_cache(maxsize=LEMMATIZATION["cache_size"])(self._lemmatize_uncached)
+
+    @property
+    def base(self):
+        if self._base is None:
+            with self._base_lock:
+                if self._base is None:
+                    self._base = self._load_base()
+        return self._base
+
+    def _lemmatize_uncached(self, word):
+        return self.base.lemmatize(word)
+
+    def lemmatize(self, word):
+        lemma = self.table.get(word)
+        if lemma is None:
+            lemma = self._lemmatize_word(word)
+        return lemma
+
+    def stats(self):
+        """Table size and LRU hits/misses (table hits aren't counted)"""
+        info = self._lemmatize_word.cache_info()
+        return {"table_words": len(self.table), "cache_hits": info.hits, "cache_misses": info.misses, "cache_size": info.currsize}
+
+def build_lemma_table(paths, path=None):
+    """
+    Lemmatize the most frequent words of the given text files with WordNet and save the table
+    Returns the table's path, or None if WordNet couldn't be loaded.
+    """
+    from core.model_provider import load_base_lemmatizer
+
+    base = load_base_lemmatizer()
+    if type(base).__name__ != TABLE_LEMMATIZER:
+        print(f"Error: Not building a lemma table with {type(base).__name__}; WordNet is required")
+        return None
+
+    counts = Counter()
+    for source in paths:
+        with open(source, encoding="utf-8", errors="ignore") as f:
+            counts.update(_WORD_PATTERN.findall(f.read().lower()))
+
+    words = [word for word, _ in counts.most_common(LEMMATIZATION["table_max_words"])]
+    table = {word: base.lemmatize(word) for word in words}
+
+    path = path or LEMMATIZATION["table_path"]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"lemmatizer": type(base).__name__, "lemmas": table}, f)
+    print(f"Saved lemmas for {len(table)} words to {path}")
+    return path
+
+def _bench():
+    from check_backend_parity import CORPUS
+    from core.model_provider import get_lemmatizer, load_base_lemmatizer
+
+    texts = [text for sample, _, answers in CORPUS for text in [sample] + answers] * 50
+    words = [_WORD_PATTERN.findall(text.lower()) for text in texts]
+    base = load_base_lemmatizer()
+    cached = get_lemmatizer()
+
+    for name, lemmatizer in (("WordNet", base), ("memoized", cached)):
+        started = time.perf_counter()
+        for text_words in words:
+            set(lemmatizer.lemmatize(word) for word in text_words)
+        elapsed = time.perf_counter() - started
+        print(f"{name:9s} {len(texts) / elapsed:10,.0f} texts/s")
+    print(f"Lemmatizer stats: {cached.stats()}")
+
+if __name__ == "__main__":
+    if "--build" in sys.argv:
+        sources = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+        if not sources:
+            print("Give the text files to build the table from, e.g. CSV exports of answers")
+        else:
+            build_lemma_table(sources)
+    elif "--bench" in sys.argv:
+        _bench()
+    else:
+        print(__doc__)
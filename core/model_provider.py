@@ -0,0 +1,286 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from config import EMBEDDING_MODEL, INFERENCE, EMBEDDING_SERVER
+
+# Heavy dependencies (torch, sentence-transformers, NLTK corpora) are only imported on
+# first use, so pages that never grade - login, signup - render without paying for them.
+# Everything here is module-level state: Streamlit re-executes app.py per session and
+# rerun, but imported modules are shared, so there is exactly one model per process.
+_model = None
+_model_lock = threading.Lock()
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+_lemmatizer = None
+_lemmatizer_lock = threading.Lock()
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+_backend_name = EMBEDDING_MODEL["backend"]
+
+def get_model():
+    """Return the sentence embedding model on the configured backend, loading it on first call"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from core.inference_backends import load_backend
+                _model = load_backend(_backend_name)
+    return _model
+
+def use_backend(name):
+    """Switch this process to another inference backend (for tools such as the parity check)"""
+    global _model, _backend_name
+    with _model_lock:
+        _backend_name = name
+        _model = None
+
+def embedding_revision():
+    """
+    Model revision as recorded in cache keys, compiled rubrics and grade fingerprints
+    Non-PyTorch backends produce slightly different vectors, so they get their own revision.
+    """
+    if _backend_name == "torch":
+        return EMBEDDING_MODEL["revision"]
+    return f"{EMBEDDING_MODEL['revision']}+{_backend_name}"
+
+def is_model_loaded():
+    """Whether get_model has already loaded the model"""
+    return _model is not None
+
+class _EncodeRequest:
+    def __init__(self, texts, batch_size):
+        self.texts = texts
+        self.batch_size = batch_size
+        self.submitted_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class InferenceQueue:
+    """
+    Funnels every model.encode call in the process through one dispatcher thread
+    Only one forward pass runs at a time, and requests from different sessions that
+    arrive within window_ms of each other are merged into a single batch.
+    """
+    def __init__(self, window_ms=None, max_batch_texts=None):
+        self.window = (INFERENCE["micro_batch_window_ms"] if window_ms is None else window_ms) / 1000.0
+        self.max_batch_texts = max_batch_texts or INFERENCE["max_batch_texts"]
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "texts": 0, "merged_requests": 0}
+        # Batch sizes bucketed by power of two, and a window of recent request latencies
+        self._batch_size_histogram = {}
+        self._latencies = deque(maxlen=INFERENCE["latency_window"])
+
+    def encode(self, texts, batch_size=32):
+        """Encode a list of texts and return an (n, dim) array; blocks until done"""
+        request = _EncodeRequest(list(texts), batch_size)
+        self._ensure_dispatcher()
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _ensure_dispatcher(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="inference-queue", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            text_count = len(pending[0].texts)
+            deadline = time.monotonic() + self.window
+
+            # Coalesce whatever else arrives inside the window
+            while text_count < self.max_batch_texts:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.append(request)
+                text_count += len(request.texts)
+
+            self._process(pending)
+
+    def _process(self, pending):
+        texts = [text for request in pending for text in request.texts]
+        try:
+            embeddings = get_model().encode(texts, batch_size=max(request.batch_size for request in pending))
+            offset = 0
+            for request in pending:
+                request.result = embeddings[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+        except Exception as e:
+            for request in pending:
+                request.error = e
+        finally:
+            finished_at = time.monotonic()
+            bucket = 1 << max(len(texts) - 1, 0).bit_length()
+            with self._lock:
+                self._stats["requests"] += len(pending)
+                self._stats["batches"] += 1
+                self._stats["texts"] += len(texts)
+                self._stats["merged_requests"] += len(pending) - 1
+                self._batch_size_histogram[bucket] = self._batch_size_histogram.get(bucket, 0) + 1
+                self._latencies.extend(finished_at - request.submitted_at for request in pending)
+            for request in pending:
+                request.done.set()
+
+    def stats(self):
+        """Counters, queue depth, batch-size histogram (<= bucket) and p50/p99 latency in ms"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["batch_size_histogram"] = dict(sorted(self._batch_size_histogram.items()))
+            latencies = sorted(self._latencies)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["p50_latency_ms"] = _percentile(latencies, 50) * 1000
+        stats["p99_latency_ms"] = _percentile(latencies, 99) * 1000
+        return stats
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+_inference_queue = InferenceQueue()
+
+def encode(texts, batch_size=32):
+    """
+    Encode through the embedding server if enabled, otherwise the shared in-process queue
+    A single string returns one vector, a list returns an (n, dim) array.
+    """
+    if isinstance(texts, str):
+        return encode([texts], batch_size)[0]
+    
+    if EMBEDDING_SERVER["enabled"]:
+        try:
+            from core.embedding_server import get_client
+            return get_client().encode(texts, batch_size)
+        except Exception as e:
+            print(f"Warning: Embedding server unavailable, encoding in-process: {e}")
+    
+    return _inference_queue.encode(texts, batch_size)
+
+# Rough word-piece count used when the model's tokenizer can't be loaded at all
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# all-MiniLM-L6-v2 reads at most this many tokens and truncates the rest
+MAX_SEQ_TOKENS = 256
+
+class EstimatingTokenizer:
+    """Word-piece estimate standing in for the tokenizer (special tokens included)"""
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [[0] * (len(_TOKEN_PATTERN.findall(text)) + 2) for text in texts]}
+
+def get_tokenizer():
+    """
+    The model's tokenizer, loaded on its own on first call
+    Token counts decide which answers are chunked, so they must not depend on whether this
+    process also loaded the model (the app and workers may encode through the embedding
+    server). Loading the tokenizer is cheap; the estimate is only used if it can't load.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = _load_tokenizer()
+    return _tokenizer
+
+def _load_tokenizer():
+    try:
+        from transformers import AutoTokenizer
+        
+        name = EMBEDDING_MODEL["name"]
+        # sentence-transformers resolves bare model names in its own hub namespace
+        if "/" not in name and not os.path.isdir(name):
+            name = f"sentence-transformers/{name}"
+        return AutoTokenizer.from_pretrained(name, revision=EMBEDDING_MODEL["revision"])
+    except Exception as e:
+        print(f"Warning: Could not load the tokenizer, estimating token counts: {e}")
+        return EstimatingTokenizer()
+
+def token_counter():
+    """How token_lengths counts in this process ("tokenizer" or "estimate"), for grade fingerprints"""
+    return "estimate" if isinstance(get_tokenizer(), EstimatingTokenizer) else "tokenizer"
+
+def token_lengths(texts, truncate=True):
+    """Number of tokens the model sees for each text (truncate=False: before truncation)"""
+    tokenized = get_tokenizer()(list(texts), add_special_tokens=True, verbose=False)
+    lengths = [len(ids) for ids in tokenized["input_ids"]]
+    return [min(length, MAX_SEQ_TOKENS) for length in lengths] if truncate else lengths
+
+def get_inference_stats():
+    """Counters for the shared inference queue"""
+    return _inference_queue.stats()
+
+class FallbackLemmatizer:
+    """Used when WordNet is unavailable"""
+    def lemmatize(self, word):
+        return word.lower()
+
+def get_lemmatizer():
+    """
+    Return the memoized lemmatizer (see core.lemmas)
+    Without a precomputed lemma table WordNet is loaded, and its corpus downloaded if needed,
+    right away; with one it waits for the first word the table doesn't cover.
+    """
+    global _lemmatizer
+    if _lemmatizer is None:
+        with _lemmatizer_lock:
+            if _lemmatizer is None:
+                from core.lemmas import CachedLemmatizer, load_lemma_table
+                lemmatizer = CachedLemmatizer(load_base_lemmatizer, load_lemma_table())
+                if not lemmatizer.table:
+                    # Nothing to serve common words from, so load WordNet before the first grading call
+                    lemmatizer.base
+                _lemmatizer = lemmatizer
+    return _lemmatizer
+
+def load_base_lemmatizer():
+    """The WordNet lemmatizer itself, without memoization"""
+    try:
+        import nltk
+        from nltk.stem import WordNetLemmatizer
+
+        # Download NLTK data if not available
+        try:
+            nltk.data.find('corpora/wordnet')
+        except LookupError:
+            nltk.download('wordnet')
+
+        lemmatizer = WordNetLemmatizer()
+        # WordNet loads lazily; force it now so the first grading call isn't the slow one
+        lemmatizer.lemmatize("warming")
+        return lemmatizer
+    except Exception as e:
+        print(f"Warning: Could not initialize WordNet lemmatizer: {e}")
+        return FallbackLemmatizer()
+
+def warm_up_in_background():
+    """Start loading the model and lemmatizer in a daemon thread (safe to call on every rerun)"""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is not None or is_model_loaded():
+            return
+        _warm_up_thread = threading.Thread(target=_warm_up, name="grader-warm-up", daemon=True)
+        _warm_up_thread.start()
+
+def _warm_up():
+    try:
+        get_lemmatizer()
+        get_tokenizer()
+        encode(["warm up"])
+    except Exception as e:
+        print(f"Warning: Background model warm-up failed: {e}")
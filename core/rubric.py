@@ -0,0 +1,95 @@
+import hashlib
+import json
+from datetime import datetime
+import numpy as np
+from bson.binary import Binary
+from config import EMBEDDING_MODEL
+from core.grader import prepare_rubric, resolve_rule, CompiledRule, build_phrase_matcher, build_keyword_index
+from core.model_provider import embedding_revision
+
+# Bump whenever the compiled layout or the rule compilation logic changes
+RUBRIC_VERSION = 1
+
+def rubric_fingerprint(sample_answer, rules):
+    """Hash of the sample answer and resolved rules a compiled rubric was built from"""
+    payload = json.dumps({
+        "sample_answer": sample_answer,
+        "rules": [list(resolve_rule(rule)) for rule in rules]
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _to_binary(vector):
+    return Binary(np.asarray(vector, dtype=np.float16).tobytes())
+
+def _from_binary(data):
+    return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+def compile_rubric(sample_answer, rules):
+    """Build the storable compiled rubric for a question (embeddings as float16 BinData)"""
+    prepared = prepare_rubric(sample_answer, rules)
+    return {
+        "version": RUBRIC_VERSION,
+        "model": EMBEDDING_MODEL["name"],
+        "revision": embedding_revision(),
+        "fingerprint": rubric_fingerprint(sample_answer, rules),
+        "sample_embedding": _to_binary(prepared["sample_embedding"]),
+        "rules": [
+            {
+                "text": rule.text,
+                "type": rule.type,
+                "key_phrases": rule.key_phrases,
+                "important_words": sorted(rule.important_words),
+                "key_concepts": sorted(rule.key_concepts),
+                "needs_embedding": rule.needs_embedding,
+                "embedding": _to_binary(rule.embedding) if rule.embedding is not None else None
+            }
+            for rule in prepared["rules"]
+        ],
+        "compiled_at": datetime.utcnow()
+    }
+
+def is_rubric_current(compiled_rubric, sample_answer, rules):
+    """Whether a stored rubric was compiled by this code, for this model, from these rules"""
+    return bool(compiled_rubric) and (
+        compiled_rubric.get("version") == RUBRIC_VERSION
+        and compiled_rubric.get("model") == EMBEDDING_MODEL["name"]
+        and compiled_rubric.get("revision") == embedding_revision()
+        and compiled_rubric.get("fingerprint") == rubric_fingerprint(sample_answer, rules)
+    )
+
+def load_rubric(compiled_rubric):
+    """Turn a stored compiled rubric into the in-memory form the grader consumes"""
+    compiled_rules = [
+        CompiledRule(
+            rule["text"],
+            rule["type"],
+            key_phrases=rule["key_phrases"],
+            important_words=rule["important_words"],
+            key_concepts=rule["key_concepts"],
+            embedding=_from_binary(rule["embedding"]) if rule.get("embedding") is not None else None
+        )
+        for rule in compiled_rubric["rules"]
+    ]
+    return {
+        "sample_embedding": _from_binary(compiled_rubric["sample_embedding"]),
+        "rules": compiled_rules,
+        "phrase_matcher": build_phrase_matcher(compiled_rules),
+        "keyword_index": build_keyword_index(compiled_rules)
+    }
+
+def get_question_rubric(question):
+    """
+    Load a question's compiled rubric, recompiling and storing it if it is missing or stale
+    Questions imported before compilation existed get compiled on their first grading run.
+    """
+    sample_answer = question.get("sample_answer", "")
+    rules = question.get("marking_scheme", [])
+    compiled_rubric = question.get("compiled_rubric")
+
+    if not is_rubric_current(compiled_rubric, sample_answer, rules):
+        compiled_rubric = compile_rubric(sample_answer, rules)
+        if question.get("_id"):
+            from core.db import save_compiled_rubric
+            save_compiled_rubric(question["_id"], compiled_rubric)
+
+    return load_rubric(compiled_rubric)
@@ -0,0 +1,131 @@
+"""
+Static token embeddings for draft grading
+
+Every entry of the model's WordPiece vocabulary is embedded once with the full model and
+stored; a text's draft embedding is then the mean of its tokens' stored vectors. Encoding is
+a dictionary lookup and a numpy mean - no transformer forward pass and no torch import - so
+draft grades are quick previews that only approximate the full model.
+
+Build the vectors once per model revision (takes a minute or two on CPU):
+    python -m core.static_embeddings --build
+    python -m core.static_embeddings --bench   # draft vs full model encoding speed
+"""
+import os
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+import numpy as np
+from config import EMBEDDING_MODEL, STATIC_EMBEDDINGS
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def static_embeddings_path():
+    """File holding the static vectors for the configured model revision"""
+    name = EMBEDDING_MODEL["name"].replace("/", "__")
+    return os.path.join(STATIC_EMBEDDINGS["dir"], f"{name}-{EMBEDDING_MODEL['revision']}.npz")
+
+def static_embeddings_available():
+    return os.path.exists(static_embeddings_path())
+
+def build_static_embeddings(batch_size=256):
+    """Embed every vocabulary token with the full model and save the vectors as float16"""
+    from core.model_provider import get_model
+    model = get_model()
+
+    tokens = [
+        token for token, _ in sorted(model.tokenizer.get_vocab().items(), key=lambda item: item[1])
+        if not (token.startswith("[") and token.endswith("]"))
+    ]
+    # Continuation pieces are embedded as the text they stand for
+    vectors = model.encode([token[2:] if token.startswith("##") else token for token in tokens], batch_size=batch_size)
+
+    os.makedirs(STATIC_EMBEDDINGS["dir"], exist_ok=True)
+    path = static_embeddings_path()
+    np.savez_compressed(path, tokens=np.array(tokens), vectors=np.asarray(vectors, dtype=np.float16))
+    print(f"Saved {len(tokens)} static token vectors to {path}")
+    return path
+
+class StaticEmbedder:
+    """Mean-pooled static token vectors with the same WordPiece split the model uses"""
+    def __init__(self, path=None):
+        data = np.load(path or static_embeddings_path())
+        self.vectors = data["vectors"].astype(np.float32)
+        self.vocabulary = {token: i for i, token in enumerate(data["tokens"].tolist())}
+        # Bound the per-word split cache; student vocabularies are small but open-ended
+        self._word_ids = lru_cache(maxsize=STATIC_EMBEDDINGS["word_cache_size"])(self._split_word)
+
+    def _split_word(self, word):
+        """Greedy longest-match-first WordPiece split; unknown words contribute nothing"""
+        ids, start = [], 0
+        while start < len(word):
+            end = len(word)
+            while end > start:
+                piece = word[start:end] if start == 0 else "##" + word[start:end]
+                if piece in self.vocabulary:
+                    ids.append(self.vocabulary[piece])
+                    break
+                end -= 1
+            if end == start:
+                return ()
+            start = end
+        return tuple(ids)
+
+    def token_ids(self, text):
+        return [token_id for word in _WORD_PATTERN.findall(text.lower()) for token_id in self._word_ids(word)]
+
+    def encode(self, texts, batch_size=None):
+        """Encode a list of texts into an (n, dim) float32 array of normalized mean token vectors"""
+        texts = list(texts)
+        token_ids = [self.token_ids(text) for text in texts]
+        counts = np.array([len(ids) for ids in token_ids])
+
+        embeddings = np.zeros((len(texts), self.vectors.shape[1]), dtype=np.float32)
+        present = counts > 0
+        if present.any():
+            flat = np.fromiter((token_id for ids in token_ids for token_id in ids), dtype=np.int64)
+            offsets = np.concatenate([[0], np.cumsum(counts[present])[:-1]])
+            embeddings[present] = np.add.reduceat(self.vectors[flat], offsets, axis=0) / counts[present, None]
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+def get_static_embedder():
+    """Process-wide static embedder, loaded on first use"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                if not static_embeddings_available():
+                    raise FileNotFoundError(
+                        f"No static embeddings at {static_embeddings_path()}; build them with "
+                        "`python -m core.static_embeddings --build`"
+                    )
+                _embedder = StaticEmbedder()
+    return _embedder
+
+def _bench():
+    from core.model_provider import encode
+    texts = [f"Answer {i}: the force on an object equals its mass times its acceleration, so pushing harder speeds it up." for i in range(500)]
+    embedder = get_static_embedder()
+    encode(texts[:8])
+
+    started = time.perf_counter()
+    embedder.encode(texts)
+    draft_time = time.perf_counter() - started
+    started = time.perf_counter()
+    encode(texts, batch_size=64)
+    full_time = time.perf_counter() - started
+    print(f"{len(texts)} answers: draft {draft_time * 1000:.1f} ms, full model {full_time * 1000:.1f} ms ({full_time / draft_time:.0f}x)")
+
+if __name__ == "__main__":
+    if "--build" in sys.argv:
+        build_static_embeddings()
+    elif "--bench" in sys.argv:
+        _bench()
+    else:
+        print(__doc__)
@@ -0,0 +1,70 @@
+"""
+Misspelling-tolerant word lookup with a SymSpell deletion index
+
+Every dictionary word is indexed under each string obtained by deleting up to max_distance
+of its characters. Two words within that edit distance always share such a deletion, so a
+lookup only generates the token's own deletions and verifies the few dictionary words filed
+under them, instead of computing the edit distance to every dictionary word.
+"""
+from itertools import combinations
+
+def deletions(word, max_distance):
+    """word and every string made by deleting up to max_distance of its characters"""
+    variants = {word}
+    for distance in range(1, min(max_distance, len(word)) + 1):
+        for positions in combinations(range(len(word)), distance):
+            variants.add("".join(char for i, char in enumerate(word) if i not in positions))
+    return variants
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance (insertions, deletions, substitutions and adjacent
+    transpositions), or max_distance + 1 once it is certain to exceed max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        # Later rows build on this one, or on the previous one plus a transposition
+        if min(current) > max_distance and min(previous) >= max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+class DeletionIndex:
+    """
+    Dictionary words indexed by their deletions; lookup(token) finds those within max_distance
+    words may also be a dict mapping each dictionary word to the term lookup returns for it,
+    e.g. a plural and its lemma both standing for the lemma.
+    """
+    def __init__(self, words, max_distance=1):
+        self.max_distance = max_distance
+        self.terms = dict(words) if isinstance(words, dict) else {word: word for word in words}
+        self.words = set(self.terms)
+        self._index = {}
+        for word in self.words:
+            for variant in deletions(word, max_distance):
+                self._index.setdefault(variant, set()).add(word)
+        # A class repeats the same tokens (and misspellings) many times
+        self._lookups = {}
+
+    def lookup(self, token):
+        """The terms of the dictionary words closest to token, if any are within max_distance edits"""
+        if token in self.words:
+            return {self.terms[token]}
+        found = self._lookups.get(token)
+        if found is None:
+            candidates = set()
+            for variant in deletions(token, self.max_distance):
+                candidates |= self._index.get(variant, set())
+            distances = {word: edit_distance(token, word, self.max_distance) for word in candidates}
+            closest = min(distances.values(), default=self.max_distance + 1)
+            found = {self.terms[word] for word, distance in distances.items() if distance == closest <= self.max_distance}
+            self._lookups[token] = found
+        return found
@@ -1,12 +1,135 @@
-from core.grader import calculate_similarity_with_feedback, debug_grading, match_rule
-from core.db import get_questions, get_student_answers, get_grade_thresholds
+import threading
+from core.grader import calculate_similarity_with_feedback, debug_grading, match_rule, grade_answers_batch
+from config import GRADING_CONFIG
+from core.db import get_questions, get_student_answers, get_grade_thresholds, get_grade_fingerprints, upsert_grades
+from core.rubric import get_question_rubric
+from core.fingerprints import answer_fingerprint, question_rubric_fingerprint, grading_config_fingerprint, grade_fingerprints, normalized_answer_key
+from services.parallel_grading import resolve_workers, should_parallelize, streaming_chunk_size, shard, map_shards
 from bson.objectid import ObjectId
 
-def grade_all(debug=False, user_id=None):
-    """Grade all student answers for a user with proper error handling"""
+def _grade_answer_shard(args):
+    """Process-pool task: grade one shard of answers to a single question"""
+    student_answers, sample, rules, rubric, grade_thresholds = args
+    return grade_answers_batch(student_answers, sample, rules, grade_thresholds=grade_thresholds, rubric=rubric)
+
+def grade_question_answers(student_answers, sample, rules, rubric, grade_thresholds, debug=False, workers=1):
+    """Grade all answers to one question, sharding them across the process pool when worthwhile"""
+    if debug or not should_parallelize(len(student_answers), workers):
+        return grade_answers_batch(
+            student_answers, sample, rules, grade_thresholds=grade_thresholds, debug=debug, rubric=rubric
+        )
+    
+    shard_args = [(answers, sample, rules, rubric, grade_thresholds) for answers in shard(student_answers, workers)]
+    return [feedback for shard_feedbacks in map_shards(_grade_answer_shard, shard_args, workers) for feedback in shard_feedbacks]
+
+class GradingSaveError(Exception):
+    """A streaming run could not save a chunk of grades and stopped"""
+
+def record_error(run_stats, message):
+    """Print a grading problem and, if the caller passed run_stats, add it to run_stats["errors"]"""
+    print(message)
+    if run_stats is not None:
+        run_stats.setdefault("errors", []).append(message)
+
+class CancellationToken:
+    """Lets the caller stop a streaming grading run between chunks"""
+    def __init__(self):
+        self._event = threading.Event()
+    
+    def cancel(self):
+        self._event.set()
+    
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+def _plan_question(q, answers, stored_fingerprints, config_fingerprint, incremental, debug):
+    """Return (question, [(student, answer text, fingerprints), ...]) still to be graded"""
+    qid = str(q["_id"])
+    sample = q.get("sample_answer", "")
+    rules = q.get("marking_scheme", [])
+    
+    if not sample:
+        print(f"Warning: No sample answer for question {qid}")
+        return q, []
+
+    # Filter answers for this question
+    question_answers = [a for a in answers if str(a.get("question_id")) == qid]
+    
+    if debug:
+        print(f"Question {qid}: Found {len(question_answers)} answers")
+        for a in question_answers:
+            print(f"  - {a.get('student_name', 'Unknown')}: {a.get('student_ans', a.get('student_answer', 'No answer'))[:50]}...")
+    
+    rubric_fingerprint = question_rubric_fingerprint(q)
+    pending = []
+    for student in question_answers:
+        # Handle both field name variations in the database
+        student_answer = student.get("student_ans", student.get("student_answer", ""))
+        if not student_answer:
+            print(f"Warning: Empty student answer for {student.get('student_name', 'Unknown')}")
+            continue
+        
+        answer_id = str(student["_id"])
+        fingerprints = grade_fingerprints(answer_fingerprint(student_answer), rubric_fingerprint, config_fingerprint)
+        if incremental and stored_fingerprints.get(answer_id) == fingerprints:
+            continue
+        
+        if debug:
+            debug_grading(student_answer, sample, rules)
+        
+        pending.append((student, student_answer, fingerprints))
+    
+    return q, pending
+
+def group_duplicate_answers(pending):
+    """
+    Group pending (student, answer text, fingerprints) entries with the same normalized_answer_key
+    (identical, or differing only in case for uncased models), in first-seen order; each group
+    is graded once using its first answer
+    """
+    if not GRADING_CONFIG["batching"]["deduplicate_answers"]:
+        return [[entry] for entry in pending]
+    
+    groups = {}
+    for entry in pending:
+        groups.setdefault(normalized_answer_key(entry[1]), []).append(entry)
+    return list(groups.values())
+
+def _grade_chunk(q, chunk, rubric, grade_thresholds, debug, workers):
+    """Grade one chunk of a question's answers, falling back to one-by-one if the batch fails"""
+    sample = q.get("sample_answer", "")
+    rules = q.get("marking_scheme", [])
+    try:
+        return grade_question_answers(
+            [student_answer for _, student_answer, _ in chunk],
+            sample, rules, rubric, grade_thresholds, debug=debug, workers=workers
+        )
+    except Exception as e:
+        print(f"Batched grading failed for question {q['_id']}, grading one by one: {e}")
+        feedbacks = []
+        for student, student_answer, _ in chunk:
+            try:
+                feedbacks.append(calculate_similarity_with_feedback(
+                    student_answer, sample, rules, grade_thresholds=grade_thresholds, debug=debug
+                ))
+            except Exception as e:
+                print(f"Error grading student {student.get('student_name', 'Unknown')}: {e}")
+                feedbacks.append(None)
+        return feedbacks
+
+def iter_grade_all(user_id, debug=False, workers=None, incremental=False, cancel_token=None, chunk_size=None, save=False, run_stats=None):
+    """
+    Grade a user's answers chunk by chunk, yielding (grade record, done, total) as results complete
+    With save=True each chunk is upserted before its results are yielded, so a cancelled or
+    interrupted run keeps everything graded so far and memory stays bounded by the chunk size;
+    a chunk that can't be saved raises GradingSaveError.
+    Pass a dict as run_stats to get the answer, unique answer and saved grading call counts,
+    and under "errors" the questions and answers that could not be graded.
+    """
     try:
         if not user_id:
-            return []
+            return
         
         questions = get_questions(user_id)
         answers = get_student_answers(user_id)
@@ -14,67 +137,153 @@ def grade_all(debug=False, user_id=None):
         
         if not questions:
             print("No questions found for user")
-            return []
+            return
         
         if not answers:
             print("No student answers found for user")
-            return []
+            return
         
-        results = []
-
+        workers = resolve_workers(workers)
+        chunk_size = streaming_chunk_size(chunk_size or GRADING_CONFIG["streaming"]["chunk_size"], workers)
+        config_fingerprint = grading_config_fingerprint()
+        stored_fingerprints = get_grade_fingerprints(user_id) if incremental else {}
+        
+        # Work out everything that needs grading first so progress has a total
+        plan = []
         for q in questions:
             try:
-                qid = str(q["_id"])
-                sample = q.get("sample_answer", "")
-                rules = q.get("marking_scheme", [])
-                
-                if not sample:
-                    print(f"Warning: No sample answer for question {qid}")
-                    continue
+                plan.append(_plan_question(q, answers, stored_fingerprints, config_fingerprint, incremental, debug))
+            except Exception as e:
+                record_error(run_stats, f"Error processing question {q.get('_id', 'Unknown')}: {e}")
+        
+        # Copy-pasted and blank-template answers are graded once per question
+        plan = [(q, group_duplicate_answers(pending)) for q, pending in plan]
+        total = sum(len(group) for _, groups in plan for group in groups)
+        unique_answers = sum(len(groups) for _, groups in plan)
+        if run_stats is not None:
+            run_stats.update({"answers": total, "unique_answers": unique_answers, "saved_calls": total - unique_answers})
+        if total > unique_answers:
+            print(f"Grading {unique_answers} unique answers for {total} submissions ({total - unique_answers} grading calls saved)")
+        done = 0
 
-                # Filter answers for this question
-                question_answers = [a for a in answers if str(a.get("question_id")) == qid]
-                
-                if debug:
-                    print(f"Question {qid}: Found {len(question_answers)} answers")
-                    for a in question_answers:
-                        print(f"  - {a.get('student_name', 'Unknown')}: {a.get('student_ans', a.get('student_answer', 'No answer'))[:50]}...")
+        for q, groups in plan:
+            if not groups:
+                continue
+            
+            try:
+                qid = str(q["_id"])
+                rubric = get_question_rubric(q)
                 
-                for student in question_answers:
-                    try:
-                        # Handle both field name variations in the database
-                        student_answer = student.get("student_ans", student.get("student_answer", ""))
-                        if not student_answer:
-                            print(f"Warning: Empty student answer for {student.get('student_name', 'Unknown')}")
+                for start in range(0, len(groups), chunk_size):
+                    if cancel_token is not None and cancel_token.cancelled:
+                        return
+                    
+                    chunk = groups[start:start + chunk_size]
+                    feedbacks = _grade_chunk(q, [group[0] for group in chunk], rubric, grade_thresholds, debug, workers)
+                    
+                    failed = sum(len(group) for group, feedback in zip(chunk, feedbacks) if feedback is None)
+                    if failed:
+                        record_error(run_stats, f"{failed} answers to question {qid} could not be graded")
+                    
+                    records = []
+                    for group, feedback in zip(chunk, feedbacks):
+                        if feedback is None:
                             continue
                         
-                        if debug:
-                            debug_grading(student_answer, sample, rules)
-                            
-                        feedback = calculate_similarity_with_feedback(
-                            student_answer, sample, rules, grade_thresholds=grade_thresholds, debug=debug
-                        )
-                        
-                        results.append({
-                            "student_name": student.get("student_name", "Unknown"),
-                            "student_roll_no": student.get("student_roll_no", "Unknown"),
-                            "student_answer": student_answer,
-                            "question_id": qid,
-                            "correct_%": f"{feedback['score'] * 100:.2f}%",
-                            "grade": feedback['grade'],
-                            "matched_rules": feedback["matched_rules"],
-                            "missed_rules": feedback["missed_rules"]
-                        })
-                    except Exception as e:
-                        print(f"Error grading student {student.get('student_name', 'Unknown')}: {e}")
-                        continue
+                        # Fan the representative's result out to everyone who submitted it
+                        for student, student_answer, fingerprints in group:
+                            records.append({
+                                "answer_id": str(student["_id"]),
+                                "fingerprints": fingerprints,
+                                "student_name": student.get("student_name", "Unknown"),
+                                "student_roll_no": student.get("student_roll_no", "Unknown"),
+                                "student_answer": student_answer,
+                                "question_id": qid,
+                                "score": feedback["score"],
+                                "correct_%": f"{feedback['score'] * 100:.2f}%",
+                                "grade": feedback['grade'],
+                                "matched_rules": list(feedback["matched_rules"]),
+                                "missed_rules": list(feedback["missed_rules"])
+                            })
+                    
+                    if save and records:
+                        save_success, save_message = upsert_grades(records, user_id)
+                        if not save_success:
+                            # Stop rather than yield grades the caller would report as saved
+                            raise GradingSaveError(f"Could not save grades for question {qid}: {save_message}")
+                    
+                    done += sum(len(group) for group in chunk) - len(records)
+                    for record in records:
+                        done += 1
+                        yield record, done, total
                         
+            except GradingSaveError:
+                raise
             except Exception as e:
-                print(f"Error processing question {q.get('_id', 'Unknown')}: {e}")
+                record_error(run_stats, f"Error processing question {q.get('_id', 'Unknown')}: {e}")
                 continue
+        
+    except GradingSaveError:
+        raise
+    except Exception as e:
+        record_error(run_stats, f"Error in grade_all: {e}")
+
+def grade_all(debug=False, user_id=None, workers=None, incremental=False, run_stats=None):
+    """
+    Grade all student answers for a user with proper error handling
+    workers > 1 shards each question's answers across a process pool (see GRADING_WORKERS).
+    incremental=True only grades answers with no grade or a stale fingerprint; save the
+    result with upsert_grades. Use iter_grade_all to stream results instead.
+    """
+    return [
+        record for record, _, _ in
+        iter_grade_all(user_id, debug=debug, workers=workers, incremental=incremental, run_stats=run_stats)
+    ]
 
-        return results
+def draft_grade_all(user_id):
+    """
+    Approximate grades for all of a user's answers from static token vectors
+    Nothing is saved: draft grades are an instant preview while a rubric is being tuned and
+    can differ from a full grading run (see core.static_embeddings).
+    """
+    records = []
+    try:
+        if not user_id:
+            return records
         
+        answers = get_student_answers(user_id)
+        grade_thresholds = get_grade_thresholds(user_id)
+        
+        for q in get_questions(user_id):
+            qid = str(q["_id"])
+            sample = q.get("sample_answer", "")
+            if not sample:
+                continue
+            
+            question_answers = [
+                (a, a.get("student_ans", a.get("student_answer", "")))
+                for a in answers if str(a.get("question_id")) == qid
+            ]
+            question_answers = [(student, text) for student, text in question_answers if text]
+            if not question_answers:
+                continue
+            
+            feedbacks = grade_answers_batch(
+                [text for _, text in question_answers], sample, q.get("marking_scheme", []),
+                grade_thresholds=grade_thresholds, draft=True
+            )
+            for (student, student_answer), feedback in zip(question_answers, feedbacks):
+                records.append({
+                    "student_name": student.get("student_name", "Unknown"),
+                    "student_roll_no": student.get("student_roll_no", "Unknown"),
+                    "question_id": qid,
+                    "score": feedback["score"],
+                    "correct_%": f"{feedback['score'] * 100:.2f}%",
+                    "grade": feedback["grade"],
+                    "matched_rules": feedback["matched_rules"],
+                    "missed_rules": feedback["missed_rules"]
+                })
     except Exception as e:
-        print(f"Error in grade_all: {e}")
-        return []
+        print(f"Error in draft grading: {e}")
+    
+    return records
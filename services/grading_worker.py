@@ -0,0 +1,148 @@
+"""
+Grading worker
+
+Claims jobs from the grading_jobs collection and runs them outside the Streamlit app, so
+a browser refresh or an app restart doesn't lose a grading run. Any number of workers can
+run on any hosts that reach MongoDB; each job is claimed by exactly one of them, and a job
+whose worker dies is picked up again once its heartbeat goes stale.
+
+Run it with:
+    python -m services.grading_worker          # process jobs until stopped
+    python -m services.grading_worker --once   # process the queued jobs, then exit
+"""
+import os
+import signal
+import socket
+import sys
+import time
+from config import GRADING_JOBS
+from core.db import (
+    claim_grading_job, heartbeat_grading_job, finish_grading_job, release_grading_job,
+    get_student_answers, get_test_answers, prune_grades, prune_test_grades
+)
+from core.model_provider import get_model, get_lemmatizer
+from services.grading_service import iter_grade_all
+from services.test_grading_service import iter_grade_test
+from services.parallel_grading import shutdown_pool
+
+class JobMonitor:
+    """
+    Cancellation token for a job run
+    Every check doubles as a throttled heartbeat that records progress and picks up cancel
+    requests from the app, so a worker that lost its job to another one stops too.
+    """
+    def __init__(self, job_id, worker_id):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.done = 0
+        self.total = 0
+        self.lost = False
+        self._cancelled = False
+        self._last_beat = 0.0
+
+    def update(self, done, total):
+        self.done, self.total = done, total
+        self.beat()
+
+    def beat(self, force=False):
+        if not force and time.monotonic() - self._last_beat < GRADING_JOBS["heartbeat_interval"]:
+            return
+        self._last_beat = time.monotonic()
+        cancel_requested = heartbeat_grading_job(self.job_id, self.worker_id, self.done, self.total)
+        if cancel_requested is None:
+            self.lost = True
+        if cancel_requested is None or cancel_requested:
+            self._cancelled = True
+
+    @property
+    def cancelled(self):
+        self.beat()
+        return self._cancelled
+
+def run_job(job, worker_id):
+    """Grade everything a job covers, saving chunk by chunk, and record how it ended"""
+    job_id = str(job["_id"])
+    user_id = job["user_id"]
+    incremental = job.get("incremental", True)
+    monitor = JobMonitor(job_id, worker_id)
+    run_stats = {}
+
+    # Remove grades for answers deleted since the last run, as the grading pages do
+    if job["kind"] == "test":
+        test_id = job["test_id"]
+        roll_numbers = [a.get("student_roll_no") for a in get_test_answers(user_id, test_id)]
+        prune_test_grades(user_id, test_id, roll_numbers)
+        # A job claimed again after its worker stopped continues from that worker's checkpoint
+        resume = job.get("attempts", 1) > 1
+        results = iter_grade_test(test_id, user_id, incremental=incremental, cancel_token=monitor, save=True, run_stats=run_stats, resume=resume)
+    else:
+        answer_ids = [str(a["_id"]) for a in get_student_answers(user_id)]
+        prune_grades(user_id, answer_ids)
+        results = iter_grade_all(user_id, incremental=incremental, cancel_token=monitor, save=True, run_stats=run_stats)
+
+    graded_count = 0
+    for _, done, total in results:
+        graded_count += 1
+        monitor.update(done, total)
+
+    if monitor.lost:
+        print(f"Grading job {job_id} was reclaimed by another worker; stopping")
+        return
+
+    monitor.beat(force=True)
+    errors = run_stats.get("errors", [])
+    if monitor.cancelled:
+        finish_grading_job(job_id, worker_id, "cancelled", f"Grading stopped after {graded_count} of {monitor.total}. Saved grades are kept.")
+    elif errors:
+        message = f"Saved {graded_count} grades, but grading hit {len(errors)} errors: {errors[0]}"
+        finish_grading_job(job_id, worker_id, "failed", message)
+    elif graded_count:
+        message = f"Saved {graded_count} grades successfully"
+        if run_stats.get("saved_calls"):
+            message += f" ({run_stats['saved_calls']} grading calls saved by reusing identical answers)"
+        finish_grading_job(job_id, worker_id, "completed", message)
+    else:
+        finish_grading_job(job_id, worker_id, "completed", "All grades are up to date - nothing new to grade.")
+
+def run_worker(once=False):
+    """Claim and run grading jobs; with once=True exit when the queue is empty"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    # Load before claiming anything so the first job's heartbeat isn't held up by it
+    get_lemmatizer()
+    get_model()
+    print(f"Grading worker {worker_id} waiting for jobs")
+
+    while True:
+        job = claim_grading_job(worker_id, GRADING_JOBS["stale_after"])
+        if job is None:
+            if once:
+                return
+            time.sleep(GRADING_JOBS["poll_interval"])
+            continue
+
+        job_id = str(job["_id"])
+        print(f"Running grading job {job_id} ({job['kind']}) for user {job['user_id']}")
+        try:
+            run_job(job, worker_id)
+        except (KeyboardInterrupt, SystemExit):
+            # Hand the job straight back instead of leaving it until the heartbeat goes stale
+            release_grading_job(job_id, worker_id)
+            raise
+        except Exception as e:
+            print(f"Error running grading job {job_id}: {e}")
+            finish_grading_job(job_id, worker_id, "failed", str(e))
+
+def _exit_on_sigterm(signum, frame):
+    sys.exit(0)
+
+if __name__ == "__main__":
+    # Container runtimes stop processes with SIGTERM; turn it into SystemExit so the
+    # current job is released for another worker
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    try:
+        run_worker(once="--once" in sys.argv)
+    except (KeyboardInterrupt, SystemExit):
+        print("Grading worker stopped")
+    finally:
+        shutdown_pool()
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config import GRADING_CONFIG
+
+# One pool per process, reused across grading runs so workers load the model only once
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def resolve_workers(workers=None):
+    """Worker count for a grading run: the explicit value or GRADING_WORKERS from config"""
+    if workers is None:
+        workers = GRADING_CONFIG["parallel"]["workers"]
+    return max(1, int(workers))
+
+def should_parallelize(item_count, workers):
+    """Small classes stay in-process; a pool only pays off once every worker gets real work"""
+    return workers > 1 and item_count >= workers * GRADING_CONFIG["parallel"]["min_items_per_worker"]
+
+def streaming_chunk_size(chunk_size, workers):
+    """
+    Items per chunk of a streaming run; each chunk is sharded across the pool on its own,
+    so a chunk must be big enough for should_parallelize to use the pool at all
+    """
+    if workers > 1:
+        return max(chunk_size, workers * GRADING_CONFIG["parallel"]["min_items_per_worker"])
+    return chunk_size
+
+def shard(items, workers):
+    """Split items into contiguous, order-preserving shards of near-equal size"""
+    shard_count = max(1, min(workers, len(items)))
+    size, extra = divmod(len(items), shard_count)
+    shards, start = [], 0
+    for i in range(shard_count):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(items[start:end])
+        start = end
+    return shards
+
+def _init_worker(torch_threads):
+    """Load the model once per worker and keep it from oversubscribing the cores"""
+    from config import INFERENCE
+    from core.model_provider import get_model, get_lemmatizer
+    # Picked up by whichever inference backend loads (torch or ONNX Runtime)
+    INFERENCE["torch_threads"] = torch_threads
+    get_lemmatizer()
+    get_model()
+
+def get_pool(workers):
+    """Return the shared process pool, recreating it if the worker count changed"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=True)
+            torch_threads = max(1, (os.cpu_count() or workers) // workers)
+            # spawn rather than fork: forking after torch has started its thread pool can deadlock
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(torch_threads,)
+            )
+            _pool_workers = workers
+        return _pool
+
+def map_shards(fn, shard_args, workers):
+    """Run fn over every shard in the pool; results come back in shard order"""
+    return list(get_pool(workers).map(fn, shard_args))
+
+def shutdown_pool():
+    """Stop the worker processes (they are otherwise kept for the next run)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = None
+        _pool_workers = 0
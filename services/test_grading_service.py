@@ -1,143 +1,244 @@
-from core.grader import calculate_similarity_with_feedback, debug_grading
-from core.db import get_questions, get_test_answers, get_grade_thresholds, get_test_by_id
+from core.grader import calculate_similarity_with_feedback, debug_grading, assign_grade
+from config import GRADING_CONFIG
+from core.db import get_questions, get_test_answers, get_grade_thresholds, get_test_by_id, get_test_grade_fingerprints, upsert_test_grades, get_grading_checkpoint, save_grading_checkpoint, clear_grading_checkpoint
+from core.rubric import get_question_rubric
+from services.grading_service import record_error, GradingSaveError
+from core.fingerprints import student_test_fingerprint, question_rubric_fingerprint, grading_config_fingerprint, grade_fingerprints
+from services.parallel_grading import resolve_workers, should_parallelize, streaming_chunk_size, shard, map_shards
 from bson.objectid import ObjectId
 
-def grade_test(test_id, user_id, debug=False):
-    """Grade all student answers for a specific test"""
+def grade_test_answer(test_id, test_answer, questions, rubrics, grade_thresholds, debug=False, fingerprints=None):
+    """Grade one student's answers to every question of a test and build their test grade record"""
+    try:
+        student_name = test_answer.get("student_name", "Unknown")
+        student_roll_no = test_answer.get("student_roll_no", "Unknown")
+        question_answers = test_answer.get("question_answers", {})
+        
+        if debug:
+            print(f"Grading test for student: {student_name} ({student_roll_no})")
+        
+        # Grade each question in the test
+        question_scores = []
+        question_grades = []
+        question_details = []
+        
+        for question in questions:
+            question_id = str(question["_id"])
+            student_answer = question_answers.get(question_id, "")
+            
+            if not student_answer:
+                print(f"Warning: No answer for question {question_id} by student {student_roll_no}")
+                question_scores.append(0.0)
+                question_grades.append("F")
+                question_details.append({
+                    "question_id": question_id,
+                    "score": 0.0,
+                    "grade": "F",
+                    "matched_rules": [],
+                    "missed_rules": question.get("marking_scheme", [])
+                })
+                continue
+            
+            sample_answer = question.get("sample_answer", "")
+            rules = question.get("marking_scheme", [])
+            
+            if debug:
+                debug_grading(student_answer, sample_answer, rules)
+            
+            feedback = calculate_similarity_with_feedback(
+                student_answer, sample_answer, rules, 
+                grade_thresholds=grade_thresholds, debug=debug, rubric=rubrics[question_id]
+            )
+            
+            score = feedback['score']
+            grade = feedback['grade']
+            
+            question_scores.append(score)
+            question_grades.append(grade)
+            question_details.append({
+                "question_id": question_id,
+                "score": score,
+                "grade": grade,
+                "matched_rules": feedback["matched_rules"],
+                "missed_rules": feedback["missed_rules"]
+            })
+        
+        # Calculate overall test score
+        if question_scores:
+            overall_score = sum(question_scores) / len(question_scores)
+            overall_percentage = overall_score * 100
+            
+            # Determine overall grade based on average score (same rules as re-lettering)
+            overall_grade = assign_grade(overall_score, grade_thresholds)
+        else:
+            overall_score = 0.0
+            overall_percentage = 0.0
+            overall_grade = "F"
+        
+        if debug:
+            print(f"Student {student_roll_no} - Overall: {overall_percentage:.2f}% ({overall_grade})")
+        
+        # Create test grade record
+        return {
+            "test_id": test_id,
+            "student_name": student_name,
+            "student_roll_no": student_roll_no,
+            "overall_score": overall_score,
+            "overall_percentage": f"{overall_percentage:.2f}%",
+            "overall_grade": overall_grade,
+            "question_scores": question_scores,
+            "question_grades": question_grades,
+            "question_details": question_details,
+            "total_questions": len(questions),
+            "answered_questions": len([s for s in question_scores if s > 0]),
+            "fingerprints": fingerprints
+        }
+        
+    except Exception as e:
+        print(f"Error grading test for student {test_answer.get('student_roll_no', 'Unknown')}: {e}")
+        return None
+
+def _grade_test_shard(args):
+    """Process-pool task: grade one shard of students for a test"""
+    test_id, pending, questions, rubrics, grade_thresholds = args
+    return [
+        grade_test_answer(test_id, test_answer, questions, rubrics, grade_thresholds, fingerprints=fingerprints)
+        for test_answer, fingerprints in pending
+    ]
+
+def _roll_number_key(test_answer):
+    return str(test_answer.get("student_roll_no", ""))
+
+def iter_grade_test(test_id, user_id, debug=False, workers=None, incremental=False, cancel_token=None, chunk_size=None, save=False, run_stats=None, resume=False):
+    """
+    Grade a test's students chunk by chunk, yielding (test grade record, done, total)
+    With save=True each chunk is upserted before its results are yielded and a resume cursor
+    (the last saved roll number, students being graded in roll number order) is checkpointed;
+    a chunk that can't be saved raises GradingSaveError. A full run that was cancelled or
+    crashed leaves the checkpoint behind, and resume=True continues it: students up to the
+    cursor whose saved grade is still current are skipped. Without resume a full run starts
+    over, and an incremental run already skips every current grade.
+    Pass a dict as run_stats to get the students that could not be graded under "errors".
+    """
     try:
         if not test_id or not user_id:
-            return []
+            return
         
         # Get test details
         test = get_test_by_id(test_id, user_id)
         if not test:
-            print(f"Test {test_id} not found for user {user_id}")
-            return []
+            record_error(run_stats, f"Test {test_id} not found for user {user_id}")
+            return
         
         # Get test answers
         test_answers = get_test_answers(user_id, test_id)
         if not test_answers:
             print(f"No test answers found for test {test_id}")
-            return []
+            return
         
         # Get questions for this test
         question_ids = test.get("question_ids", [])
-        questions = []
-        for qid in question_ids:
-            question = get_questions(user_id)
-            question = next((q for q in question if str(q["_id"]) == qid), None)
-            if question:
-                questions.append(question)
+        user_questions = {str(q["_id"]): q for q in get_questions(user_id)}
+        questions = [user_questions[qid] for qid in question_ids if qid in user_questions]
         
         if not questions:
-            print(f"No questions found for test {test_id}")
-            return []
+            record_error(run_stats, f"No questions found for test {test_id}")
+            return
         
         # Get grade thresholds
         grade_thresholds = get_grade_thresholds(user_id)
         
-        results = []
-        
-        for test_answer in test_answers:
-            try:
-                student_name = test_answer.get("student_name", "Unknown")
-                student_roll_no = test_answer.get("student_roll_no", "Unknown")
-                question_answers = test_answer.get("question_answers", {})
-                
-                if debug:
-                    print(f"Grading test for student: {student_name} ({student_roll_no})")
-                
-                # Grade each question in the test
-                question_scores = []
-                question_grades = []
-                question_details = []
-                
-                for question in questions:
-                    question_id = str(question["_id"])
-                    student_answer = question_answers.get(question_id, "")
-                    
-                    if not student_answer:
-                        print(f"Warning: No answer for question {question_id} by student {student_roll_no}")
-                        question_scores.append(0.0)
-                        question_grades.append("F")
-                        question_details.append({
-                            "question_id": question_id,
-                            "score": 0.0,
-                            "grade": "F",
-                            "matched_rules": [],
-                            "missed_rules": question.get("marking_scheme", [])
-                        })
-                        continue
-                    
-                    sample_answer = question.get("sample_answer", "")
-                    rules = question.get("marking_scheme", [])
-                    
-                    if debug:
-                        debug_grading(student_answer, sample_answer, rules)
-                    
-                    feedback = calculate_similarity_with_feedback(
-                        student_answer, sample_answer, rules, 
-                        grade_thresholds=grade_thresholds, debug=debug
-                    )
-                    
-                    score = feedback['score']
-                    grade = feedback['grade']
-                    
-                    question_scores.append(score)
-                    question_grades.append(grade)
-                    question_details.append({
-                        "question_id": question_id,
-                        "score": score,
-                        "grade": grade,
-                        "matched_rules": feedback["matched_rules"],
-                        "missed_rules": feedback["missed_rules"]
-                    })
-                
-                # Calculate overall test score
-                if question_scores:
-                    overall_score = sum(question_scores) / len(question_scores)
-                    overall_percentage = overall_score * 100
-                    
-                    # Determine overall grade based on average score
-                    overall_grade = "F"
-                    for grade, threshold in grade_thresholds.items():
-                        if overall_percentage >= threshold:
-                            overall_grade = grade
-                            break
-                else:
-                    overall_score = 0.0
-                    overall_percentage = 0.0
-                    overall_grade = "F"
-                
-                # Create test grade record
-                test_grade = {
-                    "test_id": test_id,
-                    "student_name": student_name,
-                    "student_roll_no": student_roll_no,
-                    "overall_score": overall_score,
-                    "overall_percentage": f"{overall_percentage:.2f}%",
-                    "overall_grade": overall_grade,
-                    "question_scores": question_scores,
-                    "question_grades": question_grades,
-                    "question_details": question_details,
-                    "total_questions": len(questions),
-                    "answered_questions": len([s for s in question_scores if s > 0])
-                }
-                
-                results.append(test_grade)
-                
-                if debug:
-                    print(f"Student {student_roll_no} - Overall: {overall_percentage:.2f}% ({overall_grade})")
-                
-            except Exception as e:
-                print(f"Error grading test for student {test_answer.get('student_roll_no', 'Unknown')}: {e}")
+        # Skip students whose answers, rubrics and grading config are unchanged since last run
+        rubric_fingerprint = "|".join(question_rubric_fingerprint(question) for question in questions)
+        config_fingerprint = grading_config_fingerprint()
+        checkpoint = get_grading_checkpoint(user_id, "test", test_id) if save else None
+        resume_after = checkpoint.get("cursor") if checkpoint and resume and not incremental else None
+        if resume_after is not None:
+            print(f"Resuming grading of test {test_id} after roll number {resume_after}")
+        elif checkpoint:
+            # Left by an earlier run; a new forced regrade mustn't skip the students it covered
+            clear_grading_checkpoint(user_id, "test", test_id)
+            checkpoint = None
+        stored_fingerprints = get_test_grade_fingerprints(user_id, test_id) if incremental or resume_after is not None else {}
+        
+        # A fixed order is what makes the checkpoint cursor meaningful
+        pending = []
+        for test_answer in sorted(test_answers, key=_roll_number_key):
+            fingerprints = grade_fingerprints(
+                student_test_fingerprint(test_answer.get("question_answers", {})), rubric_fingerprint, config_fingerprint
+            )
+            # Before the cursor only students whose saved grade is current are skipped, so
+            # answers added or edited since the interrupted run still get graded
+            skippable = incremental or (resume_after is not None and _roll_number_key(test_answer) <= resume_after)
+            if skippable and stored_fingerprints.get(test_answer.get("student_roll_no")) == fingerprints:
                 continue
+            pending.append((test_answer, fingerprints))
         
-        return results
+        if not pending:
+            if checkpoint:
+                clear_grading_checkpoint(user_id, "test", test_id)
+            return
         
+        # Load each question's compiled rubric once for the whole test
+        rubrics = {str(question["_id"]): get_question_rubric(question) for question in questions}
+        
+        workers = resolve_workers(workers)
+        chunk_size = streaming_chunk_size(chunk_size or GRADING_CONFIG["streaming"]["chunk_size"], workers)
+        total = len(pending)
+        done = 0
+        
+        for start in range(0, total, chunk_size):
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            
+            chunk = pending[start:start + chunk_size]
+            if debug or not should_parallelize(len(chunk), workers):
+                graded = [
+                    grade_test_answer(test_id, test_answer, questions, rubrics, grade_thresholds, debug, fingerprints)
+                    for test_answer, fingerprints in chunk
+                ]
+            else:
+                shard_args = [
+                    (test_id, shard_pending, questions, rubrics, grade_thresholds)
+                    for shard_pending in shard(chunk, workers)
+                ]
+                graded = [grade for shard_grades in map_shards(_grade_test_shard, shard_args, workers) for grade in shard_grades]
+            
+            records = [test_grade for test_grade in graded if test_grade is not None]
+            if len(records) < len(chunk):
+                record_error(run_stats, f"{len(chunk) - len(records)} students of test {test_id} could not be graded")
+            done += len(chunk)
+            if save:
+                save_success, save_message = upsert_test_grades(records, user_id)
+                if not save_success:
+                    # Stop here so the checkpoint never moves past grades that weren't saved
+                    raise GradingSaveError(f"Could not save test grades for test {test_id}: {save_message}")
+                save_grading_checkpoint(user_id, "test", test_id, _roll_number_key(chunk[-1][0]), done, total)
+            
+            chunk_done = done - len(records)
+            for record in records:
+                chunk_done += 1
+                yield record, chunk_done, total
+        
+        if save:
+            clear_grading_checkpoint(user_id, "test", test_id)
+        
+    except GradingSaveError:
+        raise
     except Exception as e:
-        print(f"Error in grade_test: {e}")
-        return []
+        record_error(run_stats, f"Error in grade_test: {e}")
+
+def grade_test(test_id, user_id, debug=False, workers=None, incremental=False):
+    """
+    Grade all student answers for a specific test
+    workers > 1 shards students across a process pool (see GRADING_WORKERS).
+    incremental=True only grades students with no grade or a stale fingerprint; save the
+    result with upsert_test_grades. Use iter_grade_test to stream results instead.
+    """
+    return [
+        record for record, _, _ in
+        iter_grade_test(test_id, user_id, debug=debug, workers=workers, incremental=incremental)
+    ]
 
 def get_test_statistics(test_id, user_id):
     """Get statistics for a specific test"""
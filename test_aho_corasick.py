@@ -0,0 +1,48 @@
+import random
+from core.aho_corasick import AhoCorasick
+
+def test_overlapping_phrases():
+    """Phrases that overlap, nest or share suffixes must all be reported"""
+    print("=== TESTING AHO-CORASICK OVERLAPS ===")
+    matcher = AhoCorasick([("he", "he"), ("she", "she"), ("his", "his"), ("hers", "hers"), ("f = ma", "formula")])
+
+    cases = {
+        "ushers": {"he", "she", "hers"},
+        "this is his": {"his"},
+        "newton: f = ma.": {"formula"},
+        "nothing here": {"he"},
+        "": set()
+    }
+    for text, expected in cases.items():
+        found = matcher.matches(text)
+        print(f"  {text!r}: {sorted(found)}")
+        assert found == expected, (text, found, expected)
+
+    print("✅ Overlapping phrases found")
+
+def test_matches_substring_checks():
+    """Random phrase sets must agree with one `phrase in text` check per phrase"""
+    print("=== TESTING AHO-CORASICK AGAINST SUBSTRING CHECKS ===")
+    rng = random.Random(0)
+    for _ in range(2000):
+        phrases = ["".join(rng.choice("abc ²") for _ in range(rng.randint(1, 5))) for _ in range(rng.randint(1, 10))]
+        text = "".join(rng.choice("abcd ²") for _ in range(rng.randint(0, 40)))
+        matcher = AhoCorasick([(phrase, i) for i, phrase in enumerate(phrases)])
+        assert matcher.matches(text) == {i for i, phrase in enumerate(phrases) if phrase in text}, (phrases, text)
+
+    print("✅ Automaton agrees with substring checks")
+
+def test_shared_values():
+    """Several phrases can carry one value, as all of a rule's key phrases carry its index"""
+    print("=== TESTING SHARED VALUES ===")
+    matcher = AhoCorasick([("dna", 0), ("rna", 0), ("mitochondria", 1), ("", 2)])
+    assert matcher.pattern_count == 3
+    assert matcher.matches("the cell contains rna") == {0}
+    assert matcher.matches("mitochondria and dna") == {0, 1}
+
+    print("✅ Values are shared across phrases and empty phrases ignored")
+
+if __name__ == "__main__":
+    test_overlapping_phrases()
+    test_matches_substring_checks()
+    test_shared_values()
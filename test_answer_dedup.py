@@ -0,0 +1,99 @@
+from unittest.mock import patch
+from config import EMBEDDING_MODEL
+from core.grader import calculate_similarity_with_feedback
+import services.grading_service as grading_service
+
+QUESTION = {
+    "_id": "q1",
+    "question": "What is DNA?",
+    "sample_answer": "DNA carries genetic information.",
+    "marking_scheme": [
+        {"text": "genetic information", "type": "exact_phrase"},
+        {"text": "Explains that DNA stores hereditary instructions.", "type": "semantic"}
+    ]
+}
+ANSWERS = [
+    {"_id": "a0", "question_id": "q1", "student_name": "Asha", "student_roll_no": "1", "student_ans": "DNA carries genetic information."},
+    # Same words, different whitespace: the exact phrase rule doesn't match it
+    {"_id": "a1", "question_id": "q1", "student_name": "Ben", "student_roll_no": "2", "student_ans": "DNA  carries genetic\ninformation. "},
+    {"_id": "a2", "question_id": "q1", "student_name": "Chen", "student_roll_no": "3", "student_ans": "dna carries genetic information."},
+    {"_id": "a3", "question_id": "q1", "student_name": "Dara", "student_roll_no": "4", "student_ans": "Proteins carry genetic information."},
+    {"_id": "a4", "question_id": "q1", "student_name": "Eli", "student_roll_no": "5", "student_ans": "DNA carries genetic information."}
+]
+
+def pending():
+    return [(answer, answer["student_ans"], f"fp-{answer['_id']}") for answer in ANSWERS]
+
+def group_ids(groups):
+    return [[student["_id"] for student, _, _ in group] for group in groups]
+
+def stand_ins(**overrides):
+    """Patch the grading service's database access (use with `with`)"""
+    return patch.multiple(
+        grading_service,
+        get_questions=lambda user_id: [QUESTION],
+        get_student_answers=lambda user_id: ANSWERS,
+        get_grade_thresholds=lambda user_id: None,
+        get_question_rubric=lambda question: None,
+        **overrides
+    )
+
+def test_grouping_follows_model_case():
+    """Only identical answers share a group, plus case variants for uncased models"""
+    print("=== TESTING DUPLICATE ANSWER GROUPING ===")
+    with patch.dict(EMBEDDING_MODEL, uncased=True):
+        groups = group_ids(grading_service.group_duplicate_answers(pending()))
+    print(f"  uncased model: {groups}")
+    assert groups == [["a0", "a2", "a4"], ["a1"], ["a3"]]
+
+    with patch.dict(EMBEDDING_MODEL, uncased=False):
+        groups = group_ids(grading_service.group_duplicate_answers(pending()))
+    print(f"  cased model: {groups}")
+    assert groups == [["a0", "a4"], ["a1"], ["a2"], ["a3"]]
+
+    print("✅ Duplicates are grouped as the grader sees them")
+
+def test_results_fan_out():
+    """Each group is graded once and every student in it gets their own record"""
+    print("=== TESTING DUPLICATE ANSWER FAN-OUT ===")
+    graded = []
+    def grade_chunk(q, chunk, rubric, grade_thresholds, debug, workers):
+        graded.extend(chunk)
+        return [
+            {"score": 0.9 if "DNA" in answer else 0.3, "grade": "A", "matched_rules": [], "missed_rules": []}
+            for _, answer, _ in chunk
+        ]
+
+    run_stats = {}
+    with stand_ins(_grade_chunk=grade_chunk), patch.dict(EMBEDDING_MODEL, uncased=True):
+        records = grading_service.grade_all(user_id="user", workers=1, run_stats=run_stats)
+
+    print(f"  graded {len(graded)} answers for {len(records)} records, run stats {run_stats}")
+    assert [answer for _, answer, _ in graded] == [ANSWERS[0]["student_ans"], ANSWERS[1]["student_ans"], ANSWERS[3]["student_ans"]]
+    assert [record["answer_id"] for record in records] == ["a0", "a2", "a4", "a1", "a3"]
+    assert [record["student_answer"] for record in records] == [ANSWERS[i]["student_ans"] for i in (0, 2, 4, 1, 3)]
+    assert [record["score"] for record in records] == [0.9, 0.9, 0.9, 0.9, 0.3]
+    assert run_stats["saved_calls"] == 2 and run_stats["unique_answers"] == 3
+
+    print("✅ Shared results reach every student with their own answer")
+
+def test_fanned_out_grades_match_own_grades():
+    """Every student's shared grade must equal the grade their own answer gets on its own"""
+    print("=== TESTING FANNED-OUT GRADES ===")
+    with stand_ins():
+        records = grading_service.grade_all(user_id="user", workers=1)
+
+    assert len(records) == len(ANSWERS)
+    for record in records:
+        own = calculate_similarity_with_feedback(record["student_answer"], QUESTION["sample_answer"], QUESTION["marking_scheme"])
+        print(f"  {record['answer_id']} {record['student_answer']!r}: {record['score']:.4f} shared, {own['score']:.4f} own")
+        assert record["matched_rules"] == own["matched_rules"]
+        assert record["grade"] == own["grade"]
+        assert abs(record["score"] - own["score"]) < 1e-4
+
+    print("✅ Fanned-out grades match per-answer grading")
+
+if __name__ == "__main__":
+    test_grouping_follows_model_case()
+    test_results_fan_out()
+    test_fanned_out_grades_match_own_grades()
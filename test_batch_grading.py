@@ -0,0 +1,243 @@
+import numpy as np
+from config import GRADING_CONFIG
+from core.grader import calculate_similarity_with_feedback, grade_answers_batch, semantic_score_matrix, combine_semantic_score, compile_rule, AnswerFeatures, length_buckets, sentence_windows, cap_windows, build_phrase_matcher, keyword_match_matrix, build_keyword_index, keyword_answer_words, cascade_decisions, get_cascade_stats
+from core.rubric import compile_rubric, load_rubric, is_rubric_current
+
+# Physics example from test_hybrid_grading.py plus a few weaker answers
+sample_answer = "Newton's Second Law states that the force acting on an object is equal to the mass of the object multiplied by its acceleration (F = ma). It explains how an object will accelerate in the direction of the net force applied. For example, pushing a cart with more force causes it to accelerate faster."
+
+rules = [
+    {"text": "Mentions the formula F = ma.", "type": "exact_phrase"},
+    {"text": "Explains the relationship between force, mass, and acceleration.", "type": "semantic"},
+    {"text": "Gives a real-world example of force causing acceleration.", "type": "semantic"},
+    "it has protons, neutrons and electrons"
+]
+
+student_answers = [
+    "Newton's Second Law states that the force acting on an object is the product of its mass and acceleration (F = ma). This means that if you push an object, it will accelerate in the direction of the force. For example, a heavier object needs more force to accelerate.",
+    "Force equals mass times acceleration.",
+    "Objects at rest stay at rest.",
+    "An atom has a nucleus at its center. The nucleus contains protons and neutrons."
+]
+
+def test_batch_matches_per_answer():
+    """Batched grading must give the same matched/missed rules as per-answer grading"""
+    print("=== TESTING BATCHED GRADING ===")
+    batched = grade_answers_batch(student_answers, sample_answer, rules)
+
+    for answer, batch_result in zip(student_answers, batched):
+        single_result = calculate_similarity_with_feedback(answer, sample_answer, rules)
+
+        print(f"Answer: {answer[:60]}...")
+        print(f"  Single score: {single_result['score']:.4f}  Batched score: {batch_result['score']:.4f}")
+        print(f"  Matched: {batch_result['matched_rules']}")
+
+        assert batch_result["matched_rules"] == single_result["matched_rules"]
+        assert batch_result["missed_rules"] == single_result["missed_rules"]
+        assert batch_result["grade"] == single_result["grade"]
+        assert abs(batch_result["score"] - single_result["score"]) < 1e-4
+
+    print("✅ Batched grading matches per-answer grading")
+
+def test_compiled_rubric_matches():
+    """Grading from a stored compiled rubric must match grading from raw rules"""
+    print("=== TESTING COMPILED RUBRIC ===")
+    compiled = compile_rubric(sample_answer, rules)
+    assert is_rubric_current(compiled, sample_answer, rules)
+    assert not is_rubric_current(compiled, sample_answer, rules[:-1])
+
+    from_rubric = grade_answers_batch(student_answers, sample_answer, rules, rubric=load_rubric(compiled))
+    from_rules = grade_answers_batch(student_answers, sample_answer, rules)
+
+    for rubric_result, rules_result in zip(from_rubric, from_rules):
+        assert rubric_result["matched_rules"] == rules_result["matched_rules"]
+        assert abs(rubric_result["score"] - rules_result["score"]) < 1e-2
+
+    print("✅ Compiled rubric grading matches raw rule grading")
+
+def test_semantic_kernel_matches_pairwise():
+    """The answers x rules semantic kernel must reproduce combine_semantic_score pair by pair"""
+    print("=== TESTING SEMANTIC SCORE MATRIX ===")
+    rng = np.random.default_rng(0)
+    features = [AnswerFeatures(answer) for answer in student_answers]
+    semantic_rules = [compile_rule(rule["text"], "semantic") for rule in rules[1:3]] + [compile_rule("", "semantic")]
+    answer_embs = rng.standard_normal((len(features), 384)).astype(np.float32)
+    rule_embs = rng.standard_normal((len(semantic_rules), 384)).astype(np.float32)
+
+    scores = semantic_score_matrix(
+        answer_embs, [f.key_concepts for f in features], rule_embs, [rule.key_concepts for rule in semantic_rules]
+    )
+    unit_answers = answer_embs / np.linalg.norm(answer_embs, axis=1, keepdims=True)
+    direct = unit_answers @ (rule_embs / np.linalg.norm(rule_embs, axis=1, keepdims=True)).T
+
+    for i, answer_features in enumerate(features):
+        for j, rule in enumerate(semantic_rules):
+            _, expected = combine_semantic_score(float(direct[i, j]), answer_features, rule.text, 0.2, rule.key_concepts)
+            assert abs(scores[i, j] - expected) < 1e-6, (i, j, scores[i, j], expected)
+
+    print("✅ Semantic score matrix matches pairwise scoring")
+
+def test_length_buckets():
+    """Buckets must cover every text once, respect both caps, and group similar lengths"""
+    print("=== TESTING LENGTH BUCKETS ===")
+    lengths = [120, 5, 7, 250, 6, 30, 8, 200, 9, 31]
+    buckets = length_buckets(lengths, max_texts=4, token_budget=400)
+    print(f"  Buckets: {[[lengths[i] for i in bucket] for bucket in buckets]}")
+
+    assert sorted(i for bucket in buckets for i in bucket) == list(range(len(lengths)))
+    for bucket in buckets:
+        assert len(bucket) <= 4
+        assert len(bucket) == 1 or len(bucket) * max(lengths[i] for i in bucket) <= 400
+    assert [lengths[i] for i in buckets[0]] == [5, 6, 7, 8]
+
+    print("✅ Length buckets respect the batch and token caps")
+
+def test_long_answer_windows():
+    """Long answers split into overlapping windows that cover every sentence, capped per answer"""
+    print("=== TESTING LONG ANSWER WINDOWS ===")
+    sentences = [f"Sentence {i}." for i in range(10)]
+    windows = sentence_windows(sentences, [60] * 10, window_tokens=200, overlap_sentences=1)
+    print(f"  Windows: {windows}")
+
+    assert windows[0] == "Sentence 0. Sentence 1. Sentence 2."
+    assert windows[1].startswith("Sentence 2.")
+    assert all(sentence in " ".join(windows) for sentence in sentences)
+
+    capped = cap_windows(windows, 3)
+    assert len(capped) == 3 and capped[0] == windows[0] and capped[-1] == windows[-1]
+
+    print("✅ Long answers are windowed and capped")
+
+def test_phrase_matcher_matches_substring_checks():
+    """Lexical rules must match the same answers with and without the question's phrase automaton"""
+    print("=== TESTING PHRASE MATCHER ===")
+    lexical_rules = [
+        compile_rule("Mentions the formula F = ma.", "exact_phrase"),
+        compile_rule("it has protons, neutrons and electrons", "contains_keywords"),
+        compile_rule("contains the nucleus", "contains_keywords")
+    ]
+    lexical = GRADING_CONFIG["lexical"]
+    min_phrases, lexical["automaton_min_phrases"] = lexical["automaton_min_phrases"], 1
+    try:
+        rubric = {"rules": lexical_rules, "phrase_matcher": build_phrase_matcher(lexical_rules)}
+    finally:
+        lexical["automaton_min_phrases"] = min_phrases
+    assert rubric["phrase_matcher"] is not None
+
+    for answer in student_answers:
+        features = AnswerFeatures(answer)
+        found = rubric["phrase_matcher"].matches(features.lower)
+        for i, rule in enumerate(lexical_rules):
+            assert rule.match(features, phrase_found=i in found) == rule.match(features), (answer, rule.text)
+
+    print("✅ Phrase matcher agrees with per-phrase checks")
+
+def test_keyword_matrix_matches_pairwise():
+    """Class-wide keyword decisions must equal the per-pair word-level matching"""
+    print("=== TESTING KEYWORD MATCH MATRIX ===")
+    keyword_rules = [
+        compile_rule("it has protons, neutrons and electrons", "contains_keywords"),
+        compile_rule("Student mentions the center or core is a nucleus", "contains_keywords"),
+        compile_rule("explains force, mass, acceleration, objects and pushing", "contains_keywords")
+    ]
+    features = [AnswerFeatures(answer) for answer in student_answers]
+    decisions = keyword_match_matrix([f.important_words for f in features], keyword_rules)
+
+    for i, answer_features in enumerate(features):
+        for j, rule in enumerate(keyword_rules):
+            # phrase_found=False isolates the word-level decision
+            expected, _ = rule.match(answer_features, phrase_found=False)
+            print(f"  Answer {i}, rule {j}: {bool(decisions[i, j])}")
+            assert bool(decisions[i, j]) == expected, (i, j)
+
+    print("✅ Keyword match matrix matches pairwise matching")
+
+def test_fuzzy_keywords():
+    """With fuzzy matching on, misspelled key terms must still satisfy a keyword rule"""
+    print("=== TESTING FUZZY KEYWORDS ===")
+    keyword_rule = compile_rule("it has protons, neutrons and electrons", "contains_keywords")
+    answer = AnswerFeatures("The atom is made of protns, a nuetron and electrns.")
+    assert not keyword_rule.match(answer)[0]
+
+    fuzzy = GRADING_CONFIG["fuzzy_keywords"]
+    enabled, fuzzy["enabled"] = fuzzy["enabled"], True
+    try:
+        rubric = {"rules": [keyword_rule], "keyword_index": build_keyword_index([keyword_rule])}
+    finally:
+        fuzzy["enabled"] = enabled
+
+    answer_words = keyword_answer_words(rubric, answer)
+    print(f"  Answer words seen by keyword rules: {sorted(answer_words)}")
+    assert keyword_rule.match(answer, answer_words=answer_words)[0]
+    assert keyword_match_matrix([answer_words], [keyword_rule])[0, 0]
+
+    print("✅ Misspelled keywords are matched")
+
+def test_cascade_decisions():
+    """The cascade only ever accepts on concept overlap, and skips the model only for full marks"""
+    print("=== TESTING CASCADE DECISIONS ===")
+    answer_concepts = [{"force", "mass", "acceleration"}, {"push", "trolley", "faster"}, set()]
+    rule_concepts = [{"force", "mass", "acceleration"}]
+
+    needs_model, lexical_matches = cascade_decisions(answer_concepts, rule_concepts, [True, True, True])
+    print(f"  needs model: {needs_model.tolist()}, matched on overlap: {lexical_matches.tolist()}")
+    assert lexical_matches.tolist() == [[True], [False], [False]]
+    # No overlap is no reason to reject: a paraphrase can still match on similarity
+    assert needs_model.tolist() == [False, True, True]
+
+    needs_model, _ = cascade_decisions(answer_concepts, rule_concepts, [False, True, True])
+    assert needs_model.tolist() == [True, True, True]
+
+    # At the lowest possible cosine similarity overlap can't guarantee a match
+    cascade = GRADING_CONFIG["cascade"]
+    min_similarity, cascade["min_similarity"] = cascade["min_similarity"], -1.0
+    try:
+        needs_model, lexical_matches = cascade_decisions(answer_concepts, rule_concepts, [True, True, True])
+    finally:
+        cascade["min_similarity"] = min_similarity
+    assert not lexical_matches.any() and needs_model.all()
+
+    print("✅ Cascade accepts clear matches and leaves everything else to the model")
+
+def test_cascade_matches_full_model():
+    """Grades with the cascade on must equal grades with it off"""
+    print("=== TESTING CASCADE AGAINST THE FULL MODEL ===")
+    answers = student_answers + [
+        # Paraphrases sharing few concepts with the rules
+        "Pushing a trolley harder makes it speed up more quickly, and heavy things are harder to get moving.",
+        "The harder you shove something the quicker it picks up speed.",
+        # Matches every rule, so it can be graded without the model
+        student_answers[0] + " A nucleus has protons, neutrons and electrons around it."
+    ]
+    cascade = GRADING_CONFIG["cascade"]
+    enabled = cascade["enabled"]
+    try:
+        cascade["enabled"] = False
+        full = grade_answers_batch(answers, sample_answer, rules)
+        cascade["enabled"] = True
+        before = get_cascade_stats()
+        tiered = grade_answers_batch(answers, sample_answer, rules)
+        after = get_cascade_stats()
+    finally:
+        cascade["enabled"] = enabled
+
+    print(f"  {after['answers'] - before['answers'] - (after['answers_embedded'] - before['answers_embedded'])} of {len(answers)} answers graded without the model")
+    for answer, full_result, tiered_result in zip(answers, full, tiered):
+        print(f"  {answer[:50]}...: {full_result['score']:.4f} full, {tiered_result['score']:.4f} cascade")
+        assert tiered_result["matched_rules"] == full_result["matched_rules"]
+        assert tiered_result["grade"] == full_result["grade"]
+        assert abs(tiered_result["score"] - full_result["score"]) < 1e-6
+
+    print("✅ Cascade grades match the full model")
+
+if __name__ == "__main__":
+    test_batch_matches_per_answer()
+    test_compiled_rubric_matches()
+    test_semantic_kernel_matches_pairwise()
+    test_length_buckets()
+    test_long_answer_windows()
+    test_phrase_matcher_matches_substring_checks()
+    test_keyword_matrix_matches_pairwise()
+    test_fuzzy_keywords()
+    test_cascade_decisions()
+    test_cascade_matches_full_model()
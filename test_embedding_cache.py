@@ -0,0 +1,38 @@
+import numpy as np
+from core.embedding_cache import EmbeddingCache
+
+class UnreachableStore:
+    """Persistent tier whose database never answers"""
+    def __init__(self):
+        self.calls = 0
+
+    def get_many(self, keys):
+        self.calls += 1
+        raise TimeoutError("server selection timed out")
+
+    def put_many(self, entries, model_name, model_revision):
+        self.calls += 1
+        raise TimeoutError("server selection timed out")
+
+def fake_encode(texts):
+    return np.ones((len(texts), 4), dtype=np.float32)
+
+def test_failed_store_is_disabled():
+    """After the first persistent-tier error the cache must stop calling the store"""
+    print("=== TESTING EMBEDDING CACHE STORE FAILURE ===")
+    cache = EmbeddingCache("model", "rev", backend="none")
+    store = UnreachableStore()
+    cache.store = store
+
+    first = cache.get_or_encode(["rule one", "rule two"], fake_encode)
+    second = cache.get_or_encode(["rule three"], fake_encode)
+
+    print(f"  Store calls: {store.calls}, stats: {cache.stats()}")
+    assert first.shape == (2, 4) and second.shape == (1, 4)
+    assert store.calls == 1
+    assert cache.store is None
+
+    print("✅ Unreachable store is disabled after one failure")
+
+if __name__ == "__main__":
+    test_failed_store_is_disabled()
@@ -0,0 +1,103 @@
+from config import GRADE_PRESETS
+from core.db import grade_letter_expression, reletter_pipeline
+from core.grader import assign_grade
+
+REMOVE = object()
+
+def evaluate(expression, document):
+    """Evaluate the aggregation operators the re-lettering pipeline uses, as MongoDB would"""
+    if isinstance(expression, dict):
+        operator, argument = next(iter(expression.items()))
+        if operator == "$switch":
+            for branch in argument["branches"]:
+                if evaluate(branch["case"], document):
+                    return branch["then"]
+            return argument["default"]
+        if operator == "$cond":
+            return evaluate(argument[1] if evaluate(argument[0], document) else argument[2], document)
+        if operator == "$ifNull":
+            value = evaluate(argument[0], document)
+            return evaluate(argument[1], document) if value is None else value
+        if operator == "$isNumber":
+            value = evaluate(argument, document)
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+        if operator == "$type":
+            value = evaluate(argument, document)
+            return "missing" if value is None else "string" if isinstance(value, str) else "double"
+        if operator == "$eq":
+            return evaluate(argument[0], document) == evaluate(argument[1], document)
+        if operator == "$trim":
+            return evaluate(argument["input"], document).strip(argument["chars"])
+        if operator == "$convert":
+            try:
+                value = evaluate(argument["input"], document)
+                return argument["onNull"] if value is None else float(value)
+            except (TypeError, ValueError):
+                return argument["onError"]
+        if operator in ("$gte", "$multiply", "$divide"):
+            left, right = evaluate(argument[0], document), evaluate(argument[1], document)
+            if left is None or right is None:
+                return False if operator == "$gte" else None
+            return left >= right if operator == "$gte" else left * right if operator == "$multiply" else left / right
+        raise ValueError(f"Unexpected operator {operator}")
+    if expression == "$$REMOVE":
+        return REMOVE
+    if isinstance(expression, str) and expression.startswith("$"):
+        return document.get(expression[1:])
+    return expression
+
+def apply_pipeline(pipeline, document):
+    """Run $set stages over one document, as update_many with a pipeline would"""
+    document = dict(document)
+    for stage in pipeline:
+        values = {field: evaluate(expression, document) for field, expression in stage["$set"].items()}
+        for field, value in values.items():
+            if value is REMOVE:
+                document.pop(field, None)
+            else:
+                document[field] = value
+    return document
+
+def test_letters_match_assign_grade():
+    """Re-lettered grades must get the letter grading would have given, at every boundary"""
+    print("=== TESTING GRADE LETTER EXPRESSION ===")
+    threshold_sets = list(GRADE_PRESETS.values()) + [
+        {"F": 0, "C": 50, "A": 90, "B": 75},     # unordered
+        {"Pass": 50, "Fail": 10}                 # no zero threshold
+    ]
+    for thresholds in threshold_sets:
+        expression = grade_letter_expression("$score", thresholds)
+        scores = [i / 1000 for i in range(1001)]
+        for threshold in thresholds.values():
+            scores += [threshold / 100, threshold / 100 - 1e-9, threshold / 100 + 1e-9]
+        for score in scores:
+            expected = assign_grade(score, thresholds)
+            assert evaluate(expression, {"score": score}) == expected, (thresholds, score, expected)
+        print(f"  {thresholds}: {len(scores)} scores agree")
+
+    print("✅ Aggregation letters match assign_grade")
+
+def test_malformed_legacy_scores():
+    """A legacy record with an unparseable correct_% keeps its letter; the others are re-lettered"""
+    print("=== TESTING LEGACY SCORE PARSING ===")
+    thresholds = {"A": 85, "B": 70, "C": 55, "D": 40, "F": 0}
+    pipeline = reletter_pipeline(thresholds)
+    cases = [
+        ({"score": 0.9, "correct_%": "90.00%", "grade": "C"}, 0.9, "A"),
+        ({"correct_%": "72.50%", "grade": "F"}, 0.725, "B"),
+        ({"correct_%": "", "grade": "C"}, None, "C"),
+        ({"correct_%": "n/a", "grade": "D"}, None, "D"),
+        ({"correct_%": None, "grade": "B"}, None, "B"),
+        ({"score": 0.6, "correct_%": "n/a", "grade": "F"}, 0.6, "C")
+    ]
+    for document, score, grade in cases:
+        result = apply_pipeline(pipeline, document)
+        print(f"  {document} -> score {result.get('score')}, grade {result['grade']}")
+        assert result.get("score") == score and ("score" in result) == (score is not None)
+        assert result["grade"] == grade
+
+    print("✅ Malformed legacy scores don't stop re-lettering")
+
+if __name__ == "__main__":
+    test_letters_match_assign_grade()
+    test_malformed_legacy_scores()
@@ -0,0 +1,72 @@
+from unittest.mock import patch
+import services.test_grading_service as test_grading_service
+from services.grading_service import GradingSaveError
+
+QUESTION = {"_id": "q1", "question": "State Newton's second law", "sample_answer": "Force equals mass times acceleration.", "marking_scheme": ["Mentions the formula F = ma."]}
+TEST_ANSWERS = [
+    {"_id": f"t{i}", "student_name": f"Student {i}", "student_roll_no": f"{i:04d}", "question_answers": {"q1": "F = ma"}}
+    for i in range(100)
+]
+
+def stand_ins(calls, checkpoint=None, save_success=True):
+    """Patch the test grading service with stand-ins (use with `with`); every saved grade is current"""
+    return patch.multiple(
+        test_grading_service,
+        get_test_by_id=lambda test_id, user_id: {"_id": test_id, "question_ids": ["q1"]},
+        get_test_answers=lambda user_id, test_id: TEST_ANSWERS,
+        get_questions=lambda user_id: [QUESTION],
+        get_grade_thresholds=lambda user_id: None,
+        get_question_rubric=lambda question: {"rules": []},
+        grade_fingerprints=lambda *parts: "current",
+        get_test_grade_fingerprints=lambda user_id, test_id: {a["student_roll_no"]: "current" for a in TEST_ANSWERS},
+        grade_test_answer=lambda test_id, test_answer, *args: {"student_roll_no": test_answer["student_roll_no"]},
+        get_grading_checkpoint=lambda user_id, kind, target_id: checkpoint,
+        save_grading_checkpoint=lambda *args: calls.__setitem__("saved", calls["saved"] + 1),
+        clear_grading_checkpoint=lambda *args: calls.__setitem__("cleared", calls["cleared"] + 1),
+        upsert_test_grades=lambda records, user_id: (save_success, "Saved" if save_success else "Error saving test grades: server unavailable")
+    )
+
+def graded_roll_numbers(**kwargs):
+    return [record["student_roll_no"] for record, _, _ in test_grading_service.iter_grade_test("test", "user", workers=1, save=True, **kwargs)]
+
+def test_full_regrade_ignores_checkpoint():
+    """Force full regrade must grade every student even if an old checkpoint is lying around"""
+    print("=== TESTING CHECKPOINT ON FULL REGRADE ===")
+    calls = {"cleared": 0, "saved": 0}
+    with stand_ins(calls, checkpoint={"cursor": "0049"}):
+        graded = graded_roll_numbers(incremental=False)
+    print(f"  full regrade: {len(graded)} students graded, checkpoint cleared {calls['cleared']} times")
+    assert len(graded) == len(TEST_ANSWERS)
+    assert calls["cleared"] >= 1
+
+    print("✅ A new full regrade starts over")
+
+def test_resume_skips_to_cursor():
+    """A resumed full run skips the current grades up to the cursor"""
+    print("=== TESTING CHECKPOINT RESUME ===")
+    with stand_ins({"cleared": 0, "saved": 0}, checkpoint={"cursor": "0049"}):
+        graded = graded_roll_numbers(incremental=False, resume=True)
+    print(f"  resumed run: {len(graded)} students graded, from {graded[0]}")
+    assert graded == [a["student_roll_no"] for a in TEST_ANSWERS[50:]]
+
+    print("✅ A resumed run continues after the cursor")
+
+def test_save_failure_raises():
+    """A chunk that can't be saved must raise, not end the run as if nothing was left to grade"""
+    print("=== TESTING SAVE FAILURE IN ITER_GRADE_TEST ===")
+    calls = {"cleared": 0, "saved": 0}
+    with stand_ins(calls, save_success=False):
+        try:
+            graded = graded_roll_numbers(incremental=False)
+        except GradingSaveError as e:
+            print(f"  Raised: {e}")
+        else:
+            raise AssertionError(f"iter_grade_test finished with {len(graded)} grades although saving failed")
+    assert calls["saved"] == 0
+
+    print("✅ A failed save stops the run without moving the checkpoint")
+
+if __name__ == "__main__":
+    test_full_regrade_ignores_checkpoint()
+    test_resume_skips_to_cursor()
+    test_save_failure_raises()
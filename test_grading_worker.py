@@ -0,0 +1,48 @@
+from unittest.mock import patch
+import services.grading_worker as grading_worker
+
+JOB = {"_id": "job1", "user_id": "user", "kind": "answers", "incremental": True}
+
+def run(results, run_errors):
+    """Run JOB against a stand-in iter_grade_all and return the status it finished with"""
+    finished = []
+    def fake_iter_grade_all(user_id, incremental, cancel_token, save, run_stats):
+        for message in run_errors:
+            run_stats.setdefault("errors", []).append(message)
+        yield from results
+
+    with patch.multiple(
+        grading_worker,
+        get_student_answers=lambda user_id: [],
+        prune_grades=lambda user_id, answer_ids: (True, ""),
+        heartbeat_grading_job=lambda job_id, worker_id, done, total: False,
+        finish_grading_job=lambda job_id, worker_id, status, message="": finished.append((status, message)),
+        iter_grade_all=fake_iter_grade_all
+    ):
+        grading_worker.run_job(JOB, "worker")
+    assert len(finished) == 1
+    return finished[0]
+
+def test_errors_fail_the_job():
+    """A run that swallowed errors must not be reported as completed"""
+    print("=== TESTING GRADING JOB STATUS ===")
+    status, message = run([], ["Error in grade_all: server unavailable"])
+    print(f"  nothing graded, one error: {status} ({message})")
+    assert status == "failed" and "server unavailable" in message
+
+    status, message = run([({}, 1, 2)], ["1 answers to question q1 could not be graded"])
+    print(f"  partly graded, one error: {status} ({message})")
+    assert status == "failed"
+
+    status, message = run([({}, 1, 1)], [])
+    print(f"  graded without errors: {status} ({message})")
+    assert status == "completed"
+
+    status, message = run([], [])
+    print(f"  nothing to grade: {status} ({message})")
+    assert status == "completed"
+
+    print("✅ Job status reflects grading errors")
+
+if __name__ == "__main__":
+    test_errors_fail_the_job()
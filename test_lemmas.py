@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import core.model_provider as model_provider
+from core.lemmas import CachedLemmatizer, load_lemma_table, build_lemma_table
+
+class CountingLemmatizer:
+    """Stands in for WordNet and records which words reach it"""
+    def __init__(self):
+        self.calls = []
+
+    def lemmatize(self, word):
+        self.calls.append(word)
+        return word[:-1] if word.endswith("s") else word
+
+def test_table_words_skip_base_lemmatizer():
+    """Words in the precomputed table must never load or reach the base lemmatizer"""
+    print("=== TESTING LEMMA TABLE ===")
+    loads = []
+    lemmatizer = CachedLemmatizer(lambda: loads.append(1) or CountingLemmatizer(), {"electrons": "electron", "atoms": "atom"})
+
+    assert lemmatizer.lemmatize("electrons") == "electron"
+    assert lemmatizer.lemmatize("atoms") == "atom"
+    assert not loads, "table hits must not load the base lemmatizer"
+
+    print("✅ Table words are served without the base lemmatizer")
+
+def test_unseen_words_are_memoized():
+    """Words outside the table reach the base lemmatizer once, then come from the LRU"""
+    print("=== TESTING LEMMA MEMOIZATION ===")
+    base = CountingLemmatizer()
+    lemmatizer = CachedLemmatizer(lambda: base, {"atoms": "atom"})
+
+    for _ in range(3):
+        assert lemmatizer.lemmatize("protons") == "proton"
+        assert lemmatizer.lemmatize("nucleus") == "nucleu"
+        assert lemmatizer.lemmatize("atoms") == "atom"
+
+    print(f"  Base lemmatizer calls: {base.calls}")
+    print(f"  Stats: {lemmatizer.stats()}")
+    assert base.calls == ["protons", "nucleus"]
+    assert lemmatizer.stats()["cache_misses"] == 2
+
+    print("✅ Unseen words are lemmatized once")
+
+def test_only_wordnet_tables():
+    """Tables not built with WordNet must be neither built nor loaded"""
+    print("=== TESTING LEMMA TABLE SOURCE ===")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "lemmas.json")
+        for lemmatizer, expected in (("WordNetLemmatizer", {"atoms": "atom"}), ("FallbackLemmatizer", {}), (None, {})):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"lemmatizer": lemmatizer, "lemmas": {"atoms": "atom"}}, f)
+            table = load_lemma_table(path)
+            print(f"  table built with {lemmatizer}: {table}")
+            assert table == expected
+
+        source = os.path.join(directory, "answers.csv")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("Atoms have protons and neutrons")
+        os.remove(path)
+        load_base = model_provider.load_base_lemmatizer
+        try:
+            model_provider.load_base_lemmatizer = model_provider.FallbackLemmatizer
+            assert build_lemma_table([source], path) is None
+        finally:
+            model_provider.load_base_lemmatizer = load_base
+        assert not os.path.exists(path)
+
+    print("✅ Only WordNet lemma tables are built and loaded")
+
+if __name__ == "__main__":
+    test_table_words_skip_base_lemmatizer()
+    test_unseen_words_are_memoized()
+    test_only_wordnet_tables()
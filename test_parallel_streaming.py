@@ -0,0 +1,117 @@
+from unittest.mock import patch
+from config import GRADING_CONFIG
+import services.grading_service as grading_service
+import services.test_grading_service as test_grading_service
+from services.parallel_grading import should_parallelize, streaming_chunk_size
+
+WORKERS = 4
+QUESTION = {"_id": "q1", "question": "State Newton's second law", "sample_answer": "Force equals mass times acceleration.", "marking_scheme": ["Mentions the formula F = ma."]}
+FEEDBACK = {"score": 1.0, "grade": "A", "matched_rules": ["Mentions the formula F = ma."], "missed_rules": []}
+
+class RecordingPool:
+    """Stands in for map_shards: records the shards it is given and grades them in-process"""
+    def __init__(self, items_index, grade_item):
+        self.items_index = items_index
+        self.grade_item = grade_item
+        self.shard_sizes = []
+
+    def __call__(self, fn, shard_args, workers):
+        shards = [args[self.items_index] for args in shard_args]
+        self.shard_sizes.append([len(items) for items in shards])
+        return [[self.grade_item(item) for item in items] for items in shards]
+
+def test_chunks_reach_the_pool():
+    """Streaming chunks must be big enough for should_parallelize with any worker count"""
+    print("=== TESTING STREAMING CHUNK SIZE ===")
+    for workers in (1, 2, 4, 8, 16):
+        chunk_size = streaming_chunk_size(GRADING_CONFIG["streaming"]["chunk_size"], workers)
+        print(f"  {workers} workers: chunks of {chunk_size}")
+        assert chunk_size >= GRADING_CONFIG["streaming"]["chunk_size"]
+        assert workers == 1 or should_parallelize(chunk_size, workers)
+
+    print("✅ Every streaming chunk is large enough for the pool")
+
+def test_large_question_uses_pool():
+    """grade_all on one big question must shard its answers across the pool"""
+    print("=== TESTING POOL USE IN GRADE_ALL ===")
+    answers = [
+        {"_id": f"a{i}", "question_id": "q1", "student_name": f"Student {i}", "student_roll_no": str(i), "student_ans": f"Force is mass times acceleration ({i})"}
+        for i in range(1000)
+    ]
+    pool = RecordingPool(0, lambda answer: dict(FEEDBACK))
+    with patch.multiple(
+        grading_service,
+        get_questions=lambda user_id: [QUESTION],
+        get_student_answers=lambda user_id: answers,
+        get_grade_thresholds=lambda user_id: None,
+        get_question_rubric=lambda question: {"rules": []},
+        map_shards=pool
+    ):
+        records = grading_service.grade_all(user_id="user", workers=WORKERS)
+
+    print(f"  Pool calls: {len(pool.shard_sizes)}, shard sizes: {pool.shard_sizes}")
+    assert len(records) == len(answers)
+    assert sum(sum(sizes) for sizes in pool.shard_sizes) == len(answers)
+    assert all(len(sizes) == WORKERS for sizes in pool.shard_sizes)
+
+    print("✅ Large questions are sharded across the pool")
+
+def test_large_test_uses_pool():
+    """grade_test on a big class must shard its students across the pool"""
+    print("=== TESTING POOL USE IN GRADE_TEST ===")
+    test_answers = [
+        {"_id": f"t{i}", "student_name": f"Student {i}", "student_roll_no": f"{i:04d}", "question_answers": {"q1": "F = ma"}}
+        for i in range(1000)
+    ]
+    pool = RecordingPool(1, lambda item: {"student_roll_no": item[0]["student_roll_no"]})
+    with patch.multiple(
+        test_grading_service,
+        get_test_by_id=lambda test_id, user_id: {"_id": test_id, "question_ids": ["q1"]},
+        get_test_answers=lambda user_id, test_id: test_answers,
+        get_questions=lambda user_id: [QUESTION],
+        get_grade_thresholds=lambda user_id: None,
+        get_question_rubric=lambda question: {"rules": []},
+        map_shards=pool
+    ):
+        records = test_grading_service.grade_test("test", "user", workers=WORKERS)
+
+    print(f"  Pool calls: {len(pool.shard_sizes)}, shard sizes: {pool.shard_sizes}")
+    assert len(records) == len(test_answers)
+    assert sum(sum(sizes) for sizes in pool.shard_sizes) == len(test_answers)
+    assert all(len(sizes) == WORKERS for sizes in pool.shard_sizes)
+
+    print("✅ Large tests are sharded across the pool")
+
+def test_save_failure_stops_grade_all():
+    """A chunk that can't be saved must raise instead of being yielded as saved"""
+    print("=== TESTING SAVE FAILURE IN ITER_GRADE_ALL ===")
+    answers = [
+        {"_id": f"a{i}", "question_id": "q1", "student_name": f"Student {i}", "student_roll_no": str(i), "student_ans": f"F = ma ({i})"}
+        for i in range(10)
+    ]
+    yielded = []
+    with patch.multiple(
+        grading_service,
+        get_questions=lambda user_id: [QUESTION],
+        get_student_answers=lambda user_id: answers,
+        get_grade_thresholds=lambda user_id: None,
+        get_question_rubric=lambda question: {"rules": []},
+        _grade_chunk=lambda q, chunk, rubric, grade_thresholds, debug, workers: [dict(FEEDBACK) for _ in chunk],
+        upsert_grades=lambda records, user_id: (False, "Error saving grades: server unavailable")
+    ):
+        try:
+            for record, done, total in grading_service.iter_grade_all("user", workers=1, save=True):
+                yielded.append(record)
+        except grading_service.GradingSaveError as e:
+            print(f"  Raised: {e}")
+        else:
+            raise AssertionError("iter_grade_all finished although saving failed")
+    assert not yielded
+
+    print("✅ A failed save stops the run")
+
+if __name__ == "__main__":
+    test_chunks_reach_the_pool()
+    test_large_question_uses_pool()
+    test_large_test_uses_pool()
+    test_save_failure_stops_grade_all()
@@ -0,0 +1,75 @@
+import random
+from core.symspell import DeletionIndex, deletions, edit_distance
+
+def test_misspelled_keywords():
+    """Common student misspellings must resolve to the rubric word"""
+    print("=== TESTING MISSPELLED KEYWORDS ===")
+    index = DeletionIndex(["photosynthesis", "mitochondria", "nucleus", "electron", "neutron"], max_distance=1)
+
+    cases = {
+        "photosynthsis": {"photosynthesis"},   # missing letter
+        "mitochondira": {"mitochondria"},      # swapped letters
+        "nucleas": {"nucleus"},                # wrong letter
+        "electrons": {"electron"},             # extra letter
+        "nucleus": {"nucleus"},                # exact
+        "neuron": {"neutron"},
+        "proton": set()                        # two edits from "neutron" - too far
+    }
+    for token, expected in cases.items():
+        found = index.lookup(token)
+        print(f"  {token} -> {sorted(found)}")
+        assert found == expected, (token, found, expected)
+
+    print("✅ Misspellings resolved within the edit distance bound")
+
+def test_words_stand_for_terms():
+    """Surface forms indexed for a lemma must resolve to the lemma"""
+    print("=== TESTING SURFACE FORMS ===")
+    index = DeletionIndex({"protons": "proton", "proton": "proton", "neutron": "neutron"}, max_distance=1)
+
+    cases = {
+        "protns": {"proton"},      # one edit from the plural, two from the lemma
+        "protons": {"proton"},     # exact surface form
+        "nuetron": {"neutron"},
+        "electron": set()
+    }
+    for token, expected in cases.items():
+        found = index.lookup(token)
+        print(f"  {token} -> {sorted(found)}")
+        assert found == expected, (token, found, expected)
+
+    print("✅ Surface forms resolve to their lemma")
+
+def brute_force_distance(a, b):
+    """Full optimal string alignment table, for checking the bounded version"""
+    table = [[i + j if i == 0 or j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1, table[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                table[i][j] = min(table[i][j], table[i - 2][j - 2] + 1)
+    return table[-1][-1]
+
+def test_index_matches_brute_force():
+    """Index lookups must return exactly the closest words a full scan finds"""
+    print("=== TESTING DELETION INDEX AGAINST BRUTE FORCE ===")
+    rng = random.Random(0)
+    for max_distance in (1, 2):
+        for _ in range(2000):
+            words = {"".join(rng.choice("abcd") for _ in range(rng.randint(1, 6))) for _ in range(6)}
+            token = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 7)))
+            distances = {word: brute_force_distance(token, word) for word in words}
+            closest = min(distances.values())
+            expected = {word for word, distance in distances.items() if distance == closest <= max_distance}
+
+            assert DeletionIndex(words, max_distance).lookup(token) == expected, (words, token, max_distance)
+            for word in words:
+                assert edit_distance(token, word, max_distance) == min(distances[word], max_distance + 1)
+
+    assert deletions("abc", 1) == {"abc", "bc", "ac", "ab"}
+    print("✅ Deletion index agrees with brute force")
+
+if __name__ == "__main__":
+    test_misspelled_keywords()
+    test_words_stand_for_terms()
+    test_index_matches_brute_force()
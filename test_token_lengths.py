@@ -0,0 +1,32 @@
+import core.model_provider as model_provider
+
+TEXTS = [
+    "Photosynthesis converts light energy into chemical energy.",
+    " ".join(["The mitochondria releases energy from glucose during respiration."] * 40)
+]
+
+class LoadedModel:
+    """Stands in for a loaded model whose own tokenizer must not be used for counting"""
+    tokenizer = staticmethod(lambda texts, **kwargs: {"input_ids": [[0] for _ in texts]})
+    max_seq_length = 8
+
+def test_lengths_ignore_model_state():
+    """Token counts must be the same whether or not this process has loaded the model"""
+    print("=== TESTING TOKEN LENGTH CONSISTENCY ===")
+    before = model_provider.token_lengths(TEXTS, truncate=False)
+    loaded = model_provider._model
+    try:
+        model_provider._model = LoadedModel()
+        after = model_provider.token_lengths(TEXTS, truncate=False)
+    finally:
+        model_provider._model = loaded
+
+    print(f"  {model_provider.token_counter()}: {before} before loading, {after} after")
+    assert before == after
+    assert before[1] > model_provider.MAX_SEQ_TOKENS
+    assert model_provider.token_lengths(TEXTS)[1] == model_provider.MAX_SEQ_TOKENS
+
+    print("✅ Token counts don't depend on the model being loaded")
+
+if __name__ == "__main__":
+    test_lengths_ignore_model_state()